@@ -0,0 +1,838 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Telegram Download Manager hot paths.
+Runs fixed workloads, writes machine-readable results and fails on regressions:
+    python benchmark.py --output results.json --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+from bot_client import DemoTelegramClient
+from database import Database
+from download_manager import DownloadManager
+from file_writer import FileWriter
+from logger import Logger
+from metrics import DB_WRITE_SECONDS
+from rate_limiter import BandwidthLimiter, TokenBucket
+
+KIB = 1024
+MIB = 1024 * 1024
+
+# End-to-end workloads as (file count, file size) groups
+WORKLOADS = {
+    'tiny': [(10000, 4 * KIB)],
+    'huge': [(10, 64 * MIB)],
+    'mixed': [(1000, 4 * KIB), (100, 1 * MIB), (2, 64 * MIB)],
+}
+
+SUITES = ('progress', 'database', 'refresh', 'events', 'api', 'receive', 'writer', 'queue', 'bandwidth')
+
+
+def _result(value, unit, higher_is_better, **params):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better, 'params': params}
+
+
+def _best_of(repeat, function):
+    """Smallest wall time of function() over repeat runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _create_manager(workdir, name, telegram_client, bandwidth_limiter=None, **config):
+    """A DownloadManager with its own database and download directory under workdir."""
+    download_config = {
+        'max_concurrent_downloads': 4,
+        'retry_attempts': 0,
+        'retry_delay': 1,
+        'download_path': os.path.join(workdir, name),
+    }
+    download_config.update(config)
+    database = Database(os.path.join(workdir, f"{name}.db"))
+    return DownloadManager(download_config, telegram_client, database, bandwidth_limiter)
+
+
+def bench_progress(workdir, repeat, chunks=100000, files=8):
+    """Per-chunk progress handling: journal buffering, speed tracking and progress writes."""
+    manager = _create_manager(workdir, 'progress', DemoTelegramClient())
+    file_ids = [f"progress_{i}" for i in range(files)]
+    manager.database.add_downloads({'file_id': file_id, 'file_name': file_id} for file_id in file_ids)
+    # Journal flushes are measured separately below
+    manager.progress_journal.flush_bytes = float('inf')
+    
+    def record():
+        for i in range(chunks):
+            manager.progress_journal.record(file_ids[i % files], i / chunks * 100, i * 65536)
+    
+    def update_speed():
+        for i in range(chunks):
+            manager._update_download_speed(file_ids[i % files], i * 65536)
+    
+    writes = 1000
+    
+    def write_each():
+        for i in range(writes):
+            manager.database.update_download_progress(file_ids[i % files], i / writes * 100, i)
+    
+    rows = 1000
+    updates = [(i / rows * 100, i, f"batch_{i}") for i in range(rows)]
+    manager.database.add_downloads({'file_id': f"batch_{i}", 'file_name': f"batch_{i}"} for i in range(rows))
+    
+    def write_batch():
+        manager.database.update_download_progress_many(updates)
+    
+    results = {
+        'progress.journal_record_ns': _result(_best_of(repeat, record) / chunks * 1e9, 'ns', False,
+                                              chunks=chunks, files=files),
+        'progress.speed_update_ns': _result(_best_of(repeat, update_speed) / chunks * 1e9, 'ns', False,
+                                            chunks=chunks, files=files),
+        'progress.db_write_us': _result(_best_of(repeat, write_each) / writes * 1e6, 'us', False, writes=writes),
+        'progress.db_batch_write_us_per_row': _result(_best_of(repeat, write_batch) / rows * 1e6, 'us', False,
+                                                      rows=rows),
+    }
+    manager.database.close()
+    return results
+
+
+def bench_database(workdir, repeat, threads=8, writes=250):
+    """Write rate of the shared Database from several threads at once, as download workers use it."""
+    database = Database(os.path.join(workdir, 'database.db'))
+    file_ids = [f"database_{i}" for i in range(threads)]
+    database.add_downloads({'file_id': file_id, 'file_name': file_id} for file_id in file_ids)
+    
+    def concurrently(write):
+        def worker(file_id):
+            for i in range(writes):
+                write(file_id, i)
+        
+        workers = [threading.Thread(target=worker, args=(file_id,)) for file_id in file_ids]
+        for worker_thread in workers:
+            worker_thread.start()
+        for worker_thread in workers:
+            worker_thread.join()
+    
+    def progress():
+        concurrently(lambda file_id, i: database.update_download_progress(file_id, i / writes * 100, i * 65536))
+    
+    def status():
+        concurrently(lambda file_id, i: database.update_download_status(file_id, 'downloading' if i % 2 else 'pending'))
+    
+    def progress_while_reading():
+        # The GUI keeps reading the whole list while workers write
+        stop = threading.Event()
+        
+        def reader():
+            while not stop.is_set():
+                database.get_all_downloads()
+        
+        reader_thread = threading.Thread(target=reader)
+        reader_thread.start()
+        try:
+            progress()
+        finally:
+            stop.set()
+            reader_thread.join()
+    
+    total = threads * writes
+    params = {'threads': threads, 'writes': writes}
+    results = {
+        'database.progress_writes_per_s': _result(total / _best_of(repeat, progress), 'writes/s', True, **params),
+        'database.status_writes_per_s': _result(total / _best_of(repeat, status), 'writes/s', True, **params),
+        'database.progress_writes_per_s_reading': _result(total / _best_of(repeat, progress_while_reading),
+                                                          'writes/s', True, **params),
+    }
+    database.close()
+    return results
+
+
+class _RecordingTree:
+    """Stand-in for the downloads Treeview when no display is available; counts widget calls."""
+    
+    def __init__(self, columns):
+        self.columns = columns
+        self.items = {}
+        self.calls = 0
+    
+    def __getitem__(self, option):
+        return self.columns
+    
+    def insert(self, parent, index, iid=None, text='', values=()):
+        self.calls += 1
+        self.items[iid] = [text, list(values)]
+        return iid
+    
+    def item(self, iid, text=None):
+        self.calls += 1
+        self.items[iid][0] = text
+    
+    def set(self, iid, column, value):
+        self.calls += 1
+        self.items[iid][1][self.columns.index(column)] = value
+    
+    def delete(self, *iids):
+        self.calls += 1
+        for iid in iids:
+            del self.items[iid]
+
+
+def _create_tree(columns):
+    """A real Treeview if Tk can open a display, otherwise a recording stand-in."""
+    try:
+        import tkinter as tk
+        from tkinter import ttk
+        root = tk.Tk()
+        root.withdraw()
+        return ttk.Treeview(root, columns=columns, show="tree headings"), root
+    except Exception:
+        return _RecordingTree(columns), None
+
+
+def bench_refresh(workdir, repeat, rows=10000, active=20):
+    """GUI downloads list refresh over a history of rows downloads.
+    
+    With the recording stand-in the widget calls each refresh makes are
+    counted too, since they are what the Tk main loop pays for.
+    """
+    try:
+        from main import TelegramDownloadManagerGUI
+    except ImportError as e:
+        print(f"Skipping refresh benchmark: {e}")
+        return {}
+    
+    manager = _create_manager(workdir, 'refresh', DemoTelegramClient())
+    manager.database.add_downloads({'file_id': f"refresh_{i}", 'file_name': f"file_{i}.mp4"} for i in range(rows))
+    manager.database.update_download_progress_many([(100.0, MIB, f"refresh_{i}") for i in range(active, rows)])
+    for i in range(active, rows):
+        manager.database.update_download_status(f"refresh_{i}", 'completed')
+    for i in range(active):
+        manager.database.update_download_status(f"refresh_{i}", 'downloading')
+    
+    # The GUI's refresh logic without building its window
+    gui = object.__new__(TelegramDownloadManagerGUI)
+    gui.download_manager = manager
+    gui.list_limit = rows
+    columns = ("File Name", "Status", "Progress", "Size", "Speed")
+    
+    def reset():
+        tree, root = _create_tree(columns)
+        if root is not None:
+            tree.pack()
+        gui.downloads_tree, gui._tree_root = tree, root
+        gui._tree_rows = {}
+        gui.tree_file_id_map = {}
+    
+    def close():
+        if gui._tree_root is not None:
+            gui._tree_root.destroy()
+    
+    initial = None
+    for _ in range(repeat):
+        reset()
+        started = time.perf_counter()
+        gui.refresh_downloads()
+        elapsed = time.perf_counter() - started
+        initial = elapsed if initial is None else min(initial, elapsed)
+        close()
+    
+    reset()
+    gui.refresh_downloads()
+    widget = 'recorder' if isinstance(gui.downloads_tree, _RecordingTree) else 'ttk'
+    step = [0]
+    
+    def tick():
+        # Active downloads advance between refreshes, as they do while the window is open
+        step[0] += 1
+        manager.database.update_download_progress_many(
+            [(step[0] % 100, step[0] * KIB, f"refresh_{i}") for i in range(active)])
+        gui.refresh_downloads()
+    
+    def add_remove():
+        # A new download pushes the oldest one out of the list, then goes away again
+        manager.database.add_download('refresh_new', 'new.mp4')
+        gui.refresh_downloads()
+        manager.database.delete_download('refresh_new')
+        gui.refresh_downloads()
+    
+    def widget_calls(function):
+        before = gui.downloads_tree.calls
+        function()
+        return gui.downloads_tree.calls - before
+    
+    steady = _best_of(repeat, gui.refresh_downloads)
+    changed = _best_of(repeat, tick)
+    added = _best_of(repeat, add_remove)
+    
+    params = {'rows': rows, 'active': active, 'widget': widget}
+    results = {
+        'refresh.initial_ms': _result(initial * 1000, 'ms', False, **params),
+        'refresh.steady_ms': _result(steady * 1000, 'ms', False, **params),
+        'refresh.progress_tick_ms': _result(changed * 1000, 'ms', False, **params),
+        'refresh.add_remove_ms': _result(added * 1000, 'ms', False, **params),
+    }
+    if widget == 'recorder':
+        results['refresh.steady_widget_calls'] = _result(widget_calls(gui.refresh_downloads), 'calls', False,
+                                                         **params)
+        results['refresh.progress_tick_widget_calls'] = _result(widget_calls(tick), 'calls', False, **params)
+        results['refresh.add_remove_widget_calls'] = _result(widget_calls(add_remove), 'calls', False, **params)
+    close()
+    manager.database.close()
+    return results
+
+
+class _RecordingRoot:
+    """Stand-in for the Tk root that counts scheduled callbacks instead of running them."""
+    
+    def __init__(self):
+        self.scheduled = 0
+    
+    def after(self, ms, callback):
+        self.scheduled += 1
+        return self.scheduled
+
+
+class _RecordingText:
+    """Stand-in for the log Text widget (and status bar) that keeps lines and counts inserts."""
+    
+    def __init__(self):
+        self.lines = []
+        self.inserts = 0
+    
+    def configure(self, **options):
+        pass
+    
+    def insert(self, index, text):
+        self.inserts += 1
+        self.lines.extend(text.split("\n")[:-1])
+    
+    def index(self, index):
+        return f"{len(self.lines) + 1}.0"
+    
+    def delete(self, first, last):
+        del self.lines[:int(last.split(".")[0]) - 1]
+    
+    def see(self, index):
+        pass
+
+
+def bench_events(workdir, repeat, files=500):
+    """GUI event pipeline: a burst of status events from a worker thread, then the frame that applies them.
+    
+    Every file is added, started and completed. The list refresh itself is
+    measured by the refresh suite, so here it is only counted.
+    """
+    try:
+        from main import TelegramDownloadManagerGUI
+    except ImportError as e:
+        print(f"Skipping events benchmark: {e}")
+        return {}
+    from event_bus import EventBus
+    
+    gui = object.__new__(TelegramDownloadManagerGUI)
+    gui.logger = logging.getLogger(__name__)
+    gui.download_manager = object()
+    gui.frame_interval = 100
+    gui.log_scrollback = 1000
+    counts = {'refreshes': 0}
+    
+    def refresh_downloads():
+        counts['refreshes'] += 1
+    
+    gui.refresh_downloads = refresh_downloads
+    items = [{'file_id': f"events_{i}", 'file_name': f"file_{i}.mp4"} for i in range(files)]
+    
+    def publish():
+        for item in items:
+            gui.on_download_status_change('download_added', item)
+        for item in items:
+            gui.on_download_status_change('download_started', item)
+            gui.on_download_status_change('download_completed', item)
+    
+    best = None
+    for _ in range(repeat):
+        gui.root, gui.log_text, gui.status_bar = _RecordingRoot(), _RecordingText(), _RecordingText()
+        gui.event_bus = EventBus()
+        counts['refreshes'] = 0
+        
+        publisher = threading.Thread(target=publish)
+        started = time.perf_counter()
+        publisher.start()
+        publisher.join()
+        published = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        gui._drain_events()
+        frame = time.perf_counter() - started
+        if best is None or frame < best[1]:
+            best = (published, frame)
+    
+    events = 3 * files
+    gui_calls = gui.root.scheduled + gui.log_text.inserts + counts['refreshes']
+    params = {'files': files, 'events': events, 'log_scrollback': gui.log_scrollback}
+    return {
+        'events.publish_us': _result(best[0] / events * 1e6, 'us', False, **params),
+        'events.frame_ms': _result(best[1] * 1000, 'ms', False, **params),
+        'events.gui_calls': _result(gui_calls, 'calls', False, **params),
+        'events.log_lines_kept': _result(len(gui.log_text.lines), 'lines', False, **params),
+    }
+
+
+def bench_api(workdir, repeat, requests=300):
+    """Control API requests per second, and the per-thread state they leave behind.
+    
+    Every request runs on a thread of its own, so anything cached per thread
+    must be released when the thread ends. Results with params['max'] are
+    checked against it by check_bounds().
+    """
+    from control_api import ControlApiServer
+    manager = _create_manager(workdir, 'api', DemoTelegramClient())
+    server = ControlApiServer(manager, port=0)
+    server.start()
+    url = f"http://{server.host}:{server.port}"
+    
+    def request(path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        with urllib.request.urlopen(urllib.request.Request(url + path, data=body, headers=headers)) as response:
+            response.read()
+    
+    def run():
+        for i in range(requests):
+            request('/downloads?limit=5')
+            request('/downloads', json.dumps({'file_id': f"api_{i}_{time.perf_counter_ns()}"}).encode())
+    
+    try:
+        elapsed = _best_of(repeat, run)
+        # Handler threads release their state just after answering; give the last ones a moment
+        time.sleep(0.2)
+        connections = len(manager.database._connections)
+        # A scrape folds the cells of finished threads into the metric's total
+        DB_WRITE_SECONDS.render()
+        metric_cells = len(DB_WRITE_SECONDS._unlabelled._cells._cells)
+    finally:
+        server.stop()
+        manager.database.close()
+    
+    params = {'requests': 2 * requests}
+    return {
+        'api.requests_per_s': _result(2 * requests / elapsed, 'requests/s', True, **params),
+        'api.db_connections': _result(connections, 'connections', False, max=4, **params),
+        'api.db_write_metric_cells': _result(metric_cells, 'cells', False, max=8, **params),
+    }
+
+
+def _create_client(client, file_sizes, chunk_size):
+    """The workload's Telegram client, and the stub server it talks to (if any)."""
+    if client == 'demo':
+        return DemoTelegramClient(chunk_size=chunk_size, chunk_delay=0, file_sizes=file_sizes), None
+    
+    # The real Bot API client over HTTP, against a local stand-in server
+    from bot_client import BotTelegramClient
+    from http_transport import create_transport
+    from rate_limiter import ApiRateLimiter
+    from service import run_client_call
+    from stub_server import StubBotApiServer
+    server = StubBotApiServer()
+    for file_id, size in file_sizes.items():
+        server.add_file(file_id, size)
+    server.start()
+    # Measure the client rather than the production getFile budget (30 calls/s)
+    telegram_client = BotTelegramClient(server.token, api_url=server.api_url, transport=create_transport(),
+                                        api_limiter=ApiRateLimiter(default_rate=1000000), chunk_size=chunk_size)
+    if not run_client_call(telegram_client.initialize()):
+        server.stop()
+        raise RuntimeError("Could not connect to the stub Bot API server")
+    return telegram_client, server
+
+
+def run_workload(workdir, name, groups, concurrency, chunk_size, engine, client='demo', hash_algorithm='sha256',
+                 timeout=600.0, bandwidth_limiter=None):
+    """Download every file of a workload through DownloadManager.
+    
+    client is 'demo' (DemoTelegramClient, no network) or 'stub'
+    (BotTelegramClient against a local StubBotApiServer). Returns
+    (seconds, files, bytes) from queuing the batch to the last completion.
+    """
+    file_sizes = {}
+    for group, (count, size) in enumerate(groups):
+        for i in range(count):
+            file_sizes[f"{name}_{group}_{i}"] = size
+    
+    telegram_client, server = _create_client(client, file_sizes, chunk_size)
+    manager = _create_manager(workdir, f"queue_{name}", telegram_client, bandwidth_limiter,
+                              max_concurrent_downloads=concurrency, engine=engine, hash_algorithm=hash_algorithm)
+    finished = {'completed': 0, 'failed': 0}
+    done = threading.Event()
+    
+    def on_status(event_type, download_item):
+        if event_type in ('download_completed', 'download_failed'):
+            finished['completed' if event_type == 'download_completed' else 'failed'] += 1
+            if finished['completed'] + finished['failed'] >= len(file_sizes):
+                done.set()
+    
+    manager.add_status_callback(on_status)
+    manager.start_downloads()
+    try:
+        started = time.perf_counter()
+        manager.add_downloads({'file_id': file_id, 'file_name': f"{file_id}.bin"} for file_id in file_sizes)
+        if not done.wait(timeout):
+            raise TimeoutError(f"Workload {name} did not finish within {timeout}s")
+        elapsed = time.perf_counter() - started
+    finally:
+        manager.stop_downloads()
+        if server:
+            from service import run_client_call
+            run_client_call(telegram_client.close())
+            server.stop()
+    
+    if finished['failed']:
+        raise RuntimeError(f"{finished['failed']} downloads failed in workload {name}")
+    return elapsed, len(file_sizes), sum(file_sizes.values())
+
+
+def bench_queue(workdir, repeat, workloads, concurrency, chunk_size, engine, client='demo', scale=1.0,
+                hash_algorithm='sha256'):
+    """End-to-end queue throughput for each workload."""
+    results = {}
+    for name in workloads:
+        groups = [[max(1, int(count * scale)), size] for count, size in WORKLOADS[name]]
+        best = None
+        for run in range(repeat):
+            run_dir = os.path.join(workdir, f"{name}_{run}")
+            os.makedirs(run_dir)
+            try:
+                elapsed, files, total_bytes = run_workload(run_dir, name, groups, concurrency, chunk_size, engine,
+                                                           client, hash_algorithm)
+            finally:
+                shutil.rmtree(run_dir, ignore_errors=True)
+            best = elapsed if best is None else min(best, elapsed)
+        
+        params = {'groups': groups, 'concurrency': concurrency, 'chunk_size': chunk_size, 'engine': engine,
+                  'hash_algorithm': hash_algorithm}
+        prefix = f"queue.{name}" if client == 'demo' else f"queue.{client}.{name}"
+        results[f"{prefix}.files_per_s"] = _result(files / best, 'files/s', True, **params)
+        results[f"{prefix}.mib_per_s"] = _result(total_bytes / MIB / best, 'MiB/s', True, **params)
+    return results
+
+
+def bench_bandwidth(workdir, limit=8 * MIB, files=4, file_size=8 * MIB, chunk_size=64 * KIB, engine='threads'):
+    """Achieved rate under a global and a per-download cap, with the Bot API client against stub_server.py.
+    
+    Each result has the cap it should match in params['limit'] (bytes/sec);
+    check_rates() compares the two. Buckets start full, so their burst is
+    left out of the bytes the rate is computed from.
+    """
+    groups = [[files, file_size]]
+    per_download = limit // files
+    modes = {
+        'global': (BandwidthLimiter(global_limit=limit), TokenBucket(limit).burst),
+        'per_download': (BandwidthLimiter(per_download_limit=per_download), files * TokenBucket(per_download).burst),
+    }
+    
+    results = {}
+    for mode, (bandwidth_limiter, burst) in modes.items():
+        run_dir = os.path.join(workdir, f"bandwidth_{mode}")
+        os.makedirs(run_dir)
+        try:
+            elapsed, _, total_bytes = run_workload(run_dir, mode, groups, files, chunk_size, engine, 'stub', 'none',
+                                                   bandwidth_limiter=bandwidth_limiter)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        
+        params = {'groups': groups, 'limit': limit, 'chunk_size': chunk_size, 'engine': engine}
+        results[f"bandwidth.{mode}.mib_per_s"] = _result((total_bytes - burst) / MIB / elapsed, 'MiB/s', True,
+                                                        **params)
+    return results
+
+
+def check_rates(results, tolerance):
+    """Names of rate-limited results more than tolerance away from their cap."""
+    off_target = []
+    for name, result in results.items():
+        limit = result['params'].get('limit')
+        if limit and abs(result['value'] * MIB / limit - 1) > tolerance:
+            off_target.append(name)
+    return off_target
+
+
+def _start_stub_process(workdir, file_size):
+    """Run stub_server.py in its own process, so its CPU time is not charged to the client."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_server.py')
+    process = subprocess.Popen([sys.executable, '-u', script, '--port', str(port), '--file-size', str(file_size)],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=workdir)
+    if not process.stdout.readline():
+        process.wait()
+        raise RuntimeError("stub_server.py did not start")
+    return process, f"http://127.0.0.1:{port}"
+
+
+def bench_receive(workdir, repeat, file_size=256 * MIB, segments=(1, 4)):
+    """Client CPU time per GiB received by BotTelegramClient, for each transport and segment count.
+    
+    The stub server runs in another process, so process time covers only the
+    client: transport threads, receive buffers, file writes and progress callbacks.
+    """
+    from bot_client import BotTelegramClient
+    from http_transport import aiohttp, create_transport
+    from rate_limiter import ApiRateLimiter
+    
+    transports = ['requests'] + (['aiohttp'] if aiohttp is not None else [])
+    process, api_url = _start_stub_process(workdir, file_size)
+    results = {}
+    try:
+        for transport in transports:
+            for count in segments:
+                async def download():
+                    client = BotTelegramClient('123456:stub', api_url=api_url, segments=count,
+                                               transport=create_transport(transport),
+                                               api_limiter=ApiRateLimiter(default_rate=1000000))
+                    if not await client.initialize():
+                        raise RuntimeError("Could not connect to the stub Bot API server")
+                    callbacks = [0]
+                    
+                    def progress_callback(downloaded_bytes, total_bytes, progress_percent):
+                        callbacks[0] += 1
+                    
+                    try:
+                        best = None
+                        for run in range(repeat):
+                            path = os.path.join(workdir, f"receive_{transport}_{count}_{run}.bin")
+                            callbacks[0] = 0
+                            started, cpu_started = time.perf_counter(), time.process_time()
+                            await client.download_file(f"receive_{run}", path, progress_callback)
+                            cpu, elapsed = time.process_time() - cpu_started, time.perf_counter() - started
+                            os.remove(path)
+                            if best is None or cpu < best[0]:
+                                best = (cpu, elapsed, callbacks[0])
+                        return best
+                    finally:
+                        await client.close()
+                
+                cpu, elapsed, callbacks = asyncio.run(download())
+                gib = file_size / (1024 * MIB)
+                params = {'file_size': file_size, 'transport': transport, 'segments': count}
+                prefix = f"receive.{transport}.segments_{count}"
+                results[f"{prefix}.cpu_s_per_gib"] = _result(cpu / gib, 's', False, **params)
+                results[f"{prefix}.mib_per_s"] = _result(file_size / MIB / elapsed, 'MiB/s', True, **params)
+                results[f"{prefix}.callbacks_per_gib"] = _result(callbacks / gib, 'calls', False, **params)
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def _count_extents(paths):
+    """Total on-disk extents of paths according to filefrag, or None where it is unavailable.
+    
+    Filesystems that keep no extents (tmpfs) report none at all, which is no measurement either.
+    """
+    if not shutil.which('filefrag'):
+        return None
+    output = subprocess.run(['filefrag'] + paths, capture_output=True, text=True).stdout
+    try:
+        return sum(int(line.rsplit(':', 1)[1].split()[0]) for line in output.splitlines()) or None
+    except (IndexError, ValueError):
+        return None
+
+
+def bench_writer(workdir, repeat, files=4, file_size=128 * MIB, write_size=MIB):
+    """Disk write throughput of files written side by side, as parallel downloads do.
+    
+    Compares FileWriter with and without preallocation and with each fsync
+    policy against plain buffered writes. --workdir decides which disk is measured.
+    """
+    data = os.urandom(write_size)
+    paths = [os.path.join(workdir, f"writer_{i}.part") for i in range(files)]
+    configs = {
+        'buffered': None,
+        'no_preallocate': {'preallocate': False},
+        'preallocate': {'preallocate': True},
+        'completion': {'preallocate': True, 'fsync_policy': 'completion'},
+        'interval': {'preallocate': True, 'fsync_policy': 'interval'},
+    }
+    
+    results = {}
+    for name, options in configs.items():
+        best = None
+        for _ in range(repeat):
+            started, cpu_started = time.perf_counter(), time.process_time()
+            if options is None:
+                handles = [open(path, 'wb') for path in paths]
+                for _ in range(file_size // write_size):
+                    for handle in handles:
+                        handle.write(data)
+                for handle in handles:
+                    handle.close()
+            else:
+                writers = [FileWriter(path, file_size, **options) for path in paths]
+                for _ in range(file_size // write_size):
+                    for writer in writers:
+                        writer.write(data)
+                for writer in writers:
+                    writer.close(complete=True)
+            elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+            extents = _count_extents(paths)
+            for path in paths:
+                os.remove(path)
+            if best is None or elapsed < best[0]:
+                best = (elapsed, cpu, extents)
+        
+        params = {'files': files, 'file_size': file_size, 'write_size': write_size}
+        results[f"writer.{name}.mib_per_s"] = _result(files * file_size / MIB / best[0], 'MiB/s', True, **params)
+        results[f"writer.{name}.cpu_s"] = _result(best[1], 's', False, **params)
+        if best[2] is not None:
+            results[f"writer.{name}.extents"] = _result(best[2], 'extents', False, **params)
+    return results
+
+
+def check_bounds(results):
+    """Names of results above the most they may be (params['max'])."""
+    return [name for name, result in results.items()
+            if result['params'].get('max') is not None and result['value'] > result['params']['max']]
+
+
+def compare(results, baseline, tolerance):
+    """Compare results with a baseline. Returns (rows, regressions) for results measured the same way."""
+    rows, regressions = [], []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or base.get('params') != result['params'] or not base['value']:
+            rows.append((name, result, None, None))
+            continue
+        change = result['value'] / base['value'] - 1
+        worse = -change if result['higher_is_better'] else change
+        rows.append((name, result, base, change))
+        if worse > tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_results(rows, regressions):
+    print(f"{'benchmark':<42} {'value':>12} {'unit':<8} {'baseline':>12} {'change':>8}")
+    for name, result, base, change in rows:
+        line = f"{name:<42} {result['value']:>12.2f} {result['unit']:<8}"
+        if base is not None:
+            line += f" {base['value']:>12.2f} {change:>+8.1%}"
+            if name in regressions:
+                line += "  REGRESSION"
+        print(line)
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Benchmark Telegram Download Manager hot paths.")
+    parser.add_argument('--suite', action='append', choices=SUITES,
+                        help="benchmark suite to run (repeatable; default: all)")
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+                        help="queue workload to run (repeatable; default: all)")
+    parser.add_argument('--concurrency', type=int, default=4, help="concurrent downloads (default: 4)")
+    parser.add_argument('--chunk-size', type=int, default=64 * KIB, help="demo download chunk size (default: 65536)")
+    parser.add_argument('--engine', choices=('threads', 'asyncio'), default='threads', help="download engine")
+    parser.add_argument('--client', choices=('demo', 'stub'), default='demo',
+                        help="queue suite client: demo (no network) or the Bot API client against stub_server.py")
+    parser.add_argument('--hash', default='sha256', dest='hash_algorithm',
+                        help="content hash computed by queue downloads, or none (default: sha256)")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply workload file counts (default: 1.0)")
+    parser.add_argument('--rows', type=int, default=10000, help="downloads list size for the refresh suite")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark; the best is kept (default: 3)")
+    parser.add_argument('--workdir', help="directory for databases and downloads (default: a temporary one)")
+    parser.add_argument('--output', metavar='FILE', help="write results as JSON")
+    parser.add_argument('--baseline', metavar='FILE', help="compare with earlier results; exit 1 on regressions")
+    parser.add_argument('--update-baseline', action='store_true', help="write the results to --baseline instead")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown before a result counts as a regression (default: 0.25)")
+    parser.add_argument('--rate-tolerance', type=float, default=0.1,
+                        help="allowed deviation of the bandwidth suite from its cap (default: 0.1)")
+    args = parser.parse_args(argv)
+    
+    Logger(log_level='WARNING')
+    logging.getLogger().setLevel(logging.WARNING)
+    suites = args.suite or SUITES
+    workdir = tempfile.mkdtemp(prefix='tdm-bench-', dir=args.workdir)
+    
+    results = {}
+    try:
+        if 'progress' in suites:
+            results.update(bench_progress(workdir, args.repeat))
+        if 'database' in suites:
+            results.update(bench_database(workdir, args.repeat))
+        if 'refresh' in suites:
+            results.update(bench_refresh(workdir, args.repeat, rows=args.rows))
+        if 'events' in suites:
+            results.update(bench_events(workdir, args.repeat))
+        if 'api' in suites:
+            results.update(bench_api(workdir, args.repeat))
+        if 'receive' in suites:
+            results.update(bench_receive(workdir, args.repeat))
+        if 'writer' in suites:
+            results.update(bench_writer(workdir, args.repeat))
+        if 'queue' in suites:
+            results.update(bench_queue(workdir, args.repeat, args.workload or sorted(WORKLOADS),
+                                       args.concurrency, args.chunk_size, args.engine, args.client, args.scale,
+                                       args.hash_algorithm))
+        if 'bandwidth' in suites:
+            results.update(bench_bandwidth(workdir, engine=args.engine))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    baseline = {}
+    if args.baseline and not args.update_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+    
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print_results(rows, regressions)
+    
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    off_target = check_rates(results, args.rate_tolerance)
+    if off_target:
+        print(f"{len(off_target)} rates missed their cap by more than {args.rate_tolerance:.0%}: {', '.join(off_target)}")
+    exceeded = check_bounds(results)
+    if exceeded:
+        print(f"{len(exceeded)} results exceeded their bound: {', '.join(exceeded)}")
+        off_target += exceeded
+    if regressions:
+        print(f"{len(regressions)} benchmarks regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+    return 1 if regressions or off_target else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,90 @@
 import asyncio
+import json
 import os
-import requests
+from concurrent.futures import Future
 from pathlib import Path
+import threading
 import time
+from file_writer import FileWriter
+from http_transport import create_transport
+from metrics import API_CALL_SECONDS, API_RATE_LIMITED
+from rate_limiter import ApiRateLimiter, FloodWaitError
 from logger import Logger
 
 class BotTelegramClient:
     """Telegram client using Bot API for file downloads."""
     
-    def __init__(self, bot_token):
+    # With adaptive chunk sizes, each read aims to take about this long
+    CHUNK_READ_TARGET = 0.1
+    
+    def __init__(self, bot_token, api_url="https://api.telegram.org", transport=None,
+                 segments=1, min_segment_size=4 * 1024 * 1024, api_limiter=None, file_info_ttl=3000,
+                 chunk_size=1024 * 1024, min_chunk_size=64 * 1024, adaptive_chunk_size=True, writer_options=None):
         self.bot_token = bot_token
         self.logger = Logger().get_logger(__name__)
         self._authenticated = False
-        self.base_url = f"https://api.telegram.org/bot{bot_token}"
+        self.base_url = f"{api_url}/bot{bot_token}"
+        self.file_url = f"{api_url}/file/bot{bot_token}"
+        
+        # getMe, getFile and file streaming all share one pooled transport
+        self.transport = transport or create_transport()
+        
+        # Per-method call budgets shared by every download using this client
+        self.api_limiter = api_limiter or ApiRateLimiter()
+        
+        # getFile results are reused until shortly before the download link expires (at least 1 hour)
+        self.file_info_ttl = file_info_ttl
+        self._file_info_cache = {}  # file_id -> (expires_at, file_info)
+        self._file_info_inflight = {}  # file_id -> Future shared by concurrent lookups
+        self._file_info_lock = threading.Lock()
+        
+        # Large files are split into this many parallel Range requests
+        self.segments = max(1, segments)
+        self.min_segment_size = max(1, min_segment_size)
+        
+        # Bodies are received into reused chunk_size buffers and written a whole read at a time;
+        # adaptive sizing starts at min_chunk_size and doubles or halves towards CHUNK_READ_TARGET
+        self.chunk_size = max(1, chunk_size)
+        self.min_chunk_size = max(1, min(min_chunk_size, self.chunk_size))
+        self.adaptive_chunk_size = adaptive_chunk_size
+        self._buffers = []  # idle receive buffers
+        
+        # FileWriter settings (preallocation and fsync policy) for every file written
+        self.writer_options = writer_options or {}
+    
+    async def _api_call(self, method, params=None):
+        """Call a Bot API method within its budget. Returns (status_code, response_json).
+        
+        A 429 pauses further calls to the same method for the retry_after the
+        server asked for, then the call is retried. Raises FloodWaitError if the
+        server asks for more than max_flood_wait or keeps refusing.
+        """
+        for attempt in range(max(0, self.api_limiter.flood_retries) + 1):
+            await self.api_limiter.acquire(method)
+            started = time.perf_counter()
+            status_code, data = await self.transport.get_json(f"{self.base_url}/{method}", params)
+            API_CALL_SECONDS.labels(method).observe(time.perf_counter() - started)
+            if status_code != 429:
+                return status_code, data
+            
+            API_RATE_LIMITED.labels(method).inc()
+            retry_after = ((data or {}).get('parameters') or {}).get('retry_after', 1)
+            self.api_limiter.pause(method, retry_after)
+            if retry_after > self.api_limiter.max_flood_wait:
+                break
+        
+        raise FloodWaitError(method, retry_after)
+    
+    def get_api_stats(self):
+        """Per-method Bot API call counters (calls, deferred, throttled)."""
+        return self.api_limiter.get_stats()
     
     async def initialize(self):
         """Initialize the bot client."""
         try:
             # Test bot token
-            response = requests.get(f"{self.base_url}/getMe")
-            if response.status_code == 200:
-                bot_info = response.json()
+            status_code, bot_info = await self._api_call('getMe')
+            if status_code == 200:
                 if bot_info['ok']:
                     self.logger.info(f"Bot authenticated: @{bot_info['result']['username']}")
                     self._authenticated = True
@@ -28,130 +92,404 @@ class BotTelegramClient:
                 else:
                     raise Exception(f"Bot authentication failed: {bot_info.get('description', 'Unknown error')}")
             else:
-                raise Exception(f"HTTP {response.status_code}: Failed to connect to Telegram API")
+                raise Exception(f"HTTP {status_code}: Failed to connect to Telegram API")
                 
         except Exception as e:
             self.logger.error(f"Error initializing bot client: {e}")
             return False
     
-    async def download_file(self, file_id, download_path, progress_callback=None):
-        """Download file using Bot API."""
+    async def download_file(self, file_id, download_path, progress_callback=None, offset=0, throttle=None,
+                            hasher=None):
+        """Download file using Bot API, resuming after the first offset bytes if given.
+        
+        throttle, if given, is awaited with the size of every chunk received;
+        hasher, if given, is a StreamHasher fed with every write.
+        """
         try:
             if not self._authenticated:
                 raise Exception("Bot not authenticated")
             
-            # Get file info first
-            file_response = requests.get(f"{self.base_url}/getFile", params={'file_id': file_id})
-            
-            if file_response.status_code != 200:
-                raise Exception(f"Failed to get file info: HTTP {file_response.status_code}")
-            
-            file_data = file_response.json()
-            if not file_data['ok']:
-                raise Exception(f"Telegram API error: {file_data.get('description', 'Unknown error')}")
-            
-            file_path = file_data['result']['file_path']
-            file_size = file_data['result'].get('file_size', 0)
+            # Get file info first (usually already resolved by the metadata prefetcher)
+            file_info = await self.get_file_info(file_id)
+            file_path = file_info['file_path']
+            file_size = file_info['file_size']
             
             # Download file
-            download_url = f"https://api.telegram.org/file/bot{self.bot_token}/{file_path}"
+            download_url = f"{self.file_url}/{file_path}"
             
             # Create download directory
             Path(download_path).parent.mkdir(parents=True, exist_ok=True)
             
-            # Download with progress tracking
-            response = requests.get(download_url, stream=True)
-            response.raise_for_status()
-            
-            downloaded = 0
-            with open(download_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        if progress_callback and file_size > 0:
-                            progress = (downloaded / file_size) * 100
-                            progress_callback(downloaded, file_size, progress)
-                        
-                        # Small delay to make download cancellable
-                        await asyncio.sleep(0.001)
+            # A segments sidecar from an earlier attempt takes precedence over the offset
+            segments = self._load_segments(download_path, file_size)
+            if segments is None and self.segments > 1 and file_size - offset >= 2 * self.min_segment_size:
+                segments = self._split_segments(offset, file_size)
+            
+            if segments is not None:
+                await self._download_segmented(download_url, download_path, file_size, segments,
+                                               progress_callback, throttle, hasher)
+            elif file_size and offset >= file_size:
+                self.logger.info(f"File already fully downloaded: {download_path}")
+                if progress_callback:
+                    progress_callback(file_size, file_size, 100.0)
+            else:
+                headers = {'Range': f"bytes={offset}-"} if offset else None
+                response = await self.transport.open_stream(download_url, headers=headers)
+                await self._download_stream(response, download_path, file_size, progress_callback,
+                                            offset, throttle, hasher)
             
+            self._file_info_cache.pop(file_id, None)
             self.logger.info(f"Bot download completed: {download_path}")
             return True
             
         except Exception as e:
+            # The cached link may be the problem; the next attempt asks getFile again
+            self._file_info_cache.pop(file_id, None)
             self.logger.error(f"Error downloading file with bot: {e}")
             raise
     
+    async def _download_stream(self, response, download_path, file_size, progress_callback, offset=0,
+                               throttle=None, hasher=None):
+        """Write a response sequentially from offset; every read yields to the event loop."""
+        buffer = self._acquire_buffer()
+        view = memoryview(buffer)
+        reading = False
+        try:
+            if response.status == 200 and offset:
+                self.logger.info("Server ignored Range request, restarting from byte 0")
+                offset = 0
+            elif response.status not in (200, 206):
+                raise Exception(f"HTTP {response.status}: Failed to download file")
+            
+            downloaded = offset
+            size = self._first_chunk_size()
+            with FileWriter(download_path, file_size, keep=offset, hasher=hasher,
+                            **self.writer_options) as writer:
+                while True:
+                    started = time.monotonic()
+                    reading = True
+                    received = await response.readinto(view[:size])
+                    reading = False
+                    if not received:
+                        break
+                    size = self._next_chunk_size(size, received, time.monotonic() - started)
+                    
+                    writer.write(view[:received])
+                    downloaded += received
+                    if throttle:
+                        await throttle(received)
+                    
+                    if progress_callback and file_size > 0:
+                        progress = (downloaded / file_size) * 100
+                        progress_callback(downloaded, file_size, progress)
+                
+                # Checked before closing so a cut-off body is never synced as complete
+                if file_size and downloaded < file_size:
+                    raise Exception(f"Connection closed at byte {downloaded} of {file_size}")
+        finally:
+            self._release_buffer(buffer, reading)
+            await response.close()
+    
+    def _acquire_buffer(self):
+        """A chunk_size receive buffer, reused across reads and downloads."""
+        try:
+            return self._buffers.pop()
+        except IndexError:
+            return bytearray(self.chunk_size)
+    
+    def _release_buffer(self, buffer, reading=False):
+        # A read abandoned by cancellation or an error may still be filling the
+        # buffer on a transport thread; such a buffer is dropped, never reused
+        if not reading and len(self._buffers) < 64:
+            self._buffers.append(buffer)
+    
+    def _first_chunk_size(self):
+        return self.min_chunk_size if self.adaptive_chunk_size else self.chunk_size
+    
+    def _next_chunk_size(self, size, received, elapsed):
+        """Size of the next read: doubled or halved towards CHUNK_READ_TARGET seconds of data."""
+        if not self.adaptive_chunk_size or received < size:
+            return size  # Fixed size, or a short read at the end of a body or segment
+        if elapsed < self.CHUNK_READ_TARGET / 2:
+            size *= 2
+        elif elapsed > self.CHUNK_READ_TARGET * 2:
+            size //= 2
+        return max(self.min_chunk_size, min(self.chunk_size, size))
+    
+    def _split_segments(self, start, file_size):
+        """Split the byte range [start, file_size) into evenly sized segments."""
+        count = max(1, min(self.segments, (file_size - start) // self.min_segment_size))
+        step = (file_size - start) // count
+        return [{'pos': start + i * step, 'end': file_size if i == count - 1 else start + (i + 1) * step}
+                for i in range(count)]
+    
+    def _load_segments(self, download_path, file_size):
+        """Load segment positions saved by an interrupted segmented download, if any."""
+        try:
+            with open(download_path + '.segments', 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if state.get('file_size') != file_size or not os.path.exists(download_path):
+            return None
+        return [{'pos': pos, 'end': end} for pos, end in state['segments']]
+    
+    def _save_segments(self, download_path, file_size, segments):
+        """Atomically record segment positions next to the partial file."""
+        sidecar_path = download_path + '.segments'
+        with open(sidecar_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'file_size': file_size,
+                       'segments': [[segment['pos'], segment['end']] for segment in segments]}, f)
+        os.replace(sidecar_path + '.tmp', sidecar_path)
+    
+    async def _checkpoint_segments(self, download_path, file_size, segments, writer, interval=1.0):
+        """Periodically save the segment positions covered by written and synced data."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            # The file is full length from the start, so only a sync makes positions safe to resume from
+            positions = [dict(segment) for segment in segments]
+            await loop.run_in_executor(None, writer.sync)
+            self._save_segments(download_path, file_size, positions)
+    
+    async def _download_segmented(self, download_url, download_path, file_size, segments, progress_callback,
+                                  throttle=None, hasher=None):
+        """Fetch byte ranges concurrently and write each at its offset in the target file."""
+        pending = [segment for segment in segments if segment['pos'] < segment['end']]
+        progress = {'downloaded': file_size - sum(segment['end'] - segment['pos'] for segment in segments)}
+        
+        # Probe with the first range; a server that ignores Range gets a plain stream
+        first = await self._open_range(download_url, pending[0]) if pending else None
+        if first is not None and first.status == 200:
+            self.logger.info("Server ignored Range request, downloading as a single stream")
+            if os.path.exists(download_path + '.segments'):
+                os.remove(download_path + '.segments')
+            await self._download_stream(first, download_path, file_size, progress_callback, throttle=throttle,
+                                        hasher=hasher)
+            return
+        
+        if progress['downloaded']:
+            self.logger.info(f"Resuming {len(pending)} segments at {progress['downloaded']}/{file_size} bytes")
+        
+        # Positions already fetched are kept; segment positions are only saved after a sync,
+        # so every saved position covers data that survives a crash
+        with FileWriter(download_path, file_size, keep=file_size, hasher=hasher,
+                        present=self._fetched_ranges(segments, file_size), **self.writer_options) as writer:
+            self._save_segments(download_path, file_size, segments)
+            checkpoint = asyncio.ensure_future(self._checkpoint_segments(download_path, file_size, segments,
+                                                                        writer))
+            
+            tasks = [asyncio.ensure_future(self._segment_worker(download_url, writer, segments, segment, file_size,
+                                                                progress, progress_callback, throttle,
+                                                                first if segment is pending[0] else None))
+                     for segment in pending]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                checkpoint.cancel()
+                try:
+                    writer.sync()
+                except OSError as e:
+                    # The last saved positions still hold; this must not hide why the download stopped
+                    self.logger.warning(f"Could not sync {download_path}: {e}")
+                else:
+                    self._save_segments(download_path, file_size, segments)
+        
+        if progress['downloaded'] != file_size:
+            raise Exception(f"Segmented download incomplete: {progress['downloaded']}/{file_size} bytes")
+        os.remove(download_path + '.segments')
+    
+    def _fetched_ranges(self, segments, file_size):
+        """Byte ranges outside every segment's unfetched part, i.e. already in the file."""
+        ranges, start = [], 0
+        for segment in sorted(segments, key=lambda segment: segment['pos']):
+            if segment['pos'] > start:
+                ranges.append((start, segment['pos']))
+            start = max(start, segment['end'])
+        if start < file_size:
+            ranges.append((start, file_size))
+        return ranges
+    
+    async def _segment_worker(self, download_url, writer, segments, segment, file_size,
+                              progress, progress_callback, throttle=None, response=None):
+        """Fetch a segment, then keep stealing work from the slowest remaining segment."""
+        while segment is not None:
+            if response is None:
+                response = await self._open_range(download_url, segment)
+            await self._fetch_segment(response, writer, segment, file_size, progress, progress_callback, throttle)
+            response = None
+            segment = self._steal_segment(segments)
+    
+    async def _open_range(self, download_url, segment):
+        """Start a Range request for the unfetched part of a segment."""
+        headers = {'Range': f"bytes={segment['pos']}-{segment['end'] - 1}"}
+        return await self.transport.open_stream(download_url, headers=headers)
+    
+    async def _fetch_segment(self, response, writer, segment, file_size, progress, progress_callback, throttle=None):
+        """Stream one Range response into the file until the segment's (possibly shrunk) end."""
+        buffer = self._acquire_buffer()
+        view = memoryview(buffer)
+        reading = False
+        try:
+            if response.status != 206:
+                raise Exception(f"HTTP {response.status}: Range request not honoured")
+            
+            size = self._first_chunk_size()
+            while segment['pos'] < segment['end']:
+                started = time.monotonic()
+                reading = True
+                received = await response.readinto(view[:min(size, segment['end'] - segment['pos'])])
+                reading = False
+                if not received:
+                    raise Exception(f"Connection closed at byte {segment['pos']} of segment")
+                size = self._next_chunk_size(size, received, time.monotonic() - started)
+                
+                # Another worker may have stolen the tail of this segment while we waited
+                received = min(received, segment['end'] - segment['pos'])
+                writer.write_at(segment['pos'], view[:received])
+                segment['pos'] += received
+                progress['downloaded'] += received
+                if throttle:
+                    await throttle(received)
+                
+                if progress_callback:
+                    downloaded = progress['downloaded']
+                    progress_callback(downloaded, file_size, (downloaded / file_size) * 100)
+        finally:
+            self._release_buffer(buffer, reading)
+            await response.close()
+    
+    def _steal_segment(self, segments):
+        """Split the segment with the most bytes left and hand its upper half to an idle worker."""
+        victim = max(segments, key=lambda segment: segment['end'] - segment['pos'])
+        remaining = victim['end'] - victim['pos']
+        if remaining < 2 * self.min_segment_size:
+            return None
+        
+        middle = victim['pos'] + remaining // 2
+        stolen = {'pos': middle, 'end': victim['end']}
+        victim['end'] = middle
+        segments.append(stolen)
+        return stolen
+    
     async def get_file_info(self, file_id):
-        """Get file information using Bot API."""
+        """Get file information using Bot API, cached for file_info_ttl seconds."""
         try:
             if not self._authenticated:
                 raise Exception("Bot not authenticated")
             
-            response = requests.get(f"{self.base_url}/getFile", params={'file_id': file_id})
+            # Concurrent lookups of one file (prefetcher and worker, possibly on
+            # different loops) share a single getFile call
+            with self._file_info_lock:
+                cached = self._file_info_cache.get(file_id)
+                if cached and cached[0] > time.monotonic():
+                    return cached[1]
+                inflight = self._file_info_inflight.get(file_id)
+                if inflight is None:
+                    self._file_info_inflight[file_id] = Future()
             
-            if response.status_code != 200:
-                raise Exception(f"Failed to get file info: HTTP {response.status_code}")
+            if inflight is not None:
+                # Shielded so a cancelled waiter does not cancel the shared lookup
+                return await asyncio.shield(asyncio.wrap_future(inflight))
             
-            file_data = response.json()
-            if not file_data['ok']:
-                raise Exception(f"Telegram API error: {file_data.get('description', 'Unknown error')}")
+            try:
+                file_info = await self._fetch_file_info(file_id)
+            except Exception as e:
+                with self._file_info_lock:
+                    self._file_info_inflight.pop(file_id).set_exception(e)
+                raise
             
-            return {
-                'file_id': file_id,
-                'file_unique_id': file_data['result'].get('file_unique_id'),
-                'file_size': file_data['result'].get('file_size', 0),
-                'file_path': file_data['result']['file_path']
-            }
+            with self._file_info_lock:
+                self._file_info_cache[file_id] = (time.monotonic() + self.file_info_ttl, file_info)
+                self._file_info_inflight.pop(file_id).set_result(file_info)
+            return file_info
             
         except Exception as e:
             self.logger.error(f"Error getting file info: {e}")
             raise
     
+    async def _fetch_file_info(self, file_id):
+        """Call getFile and return the file's metadata."""
+        status_code, file_data = await self._api_call('getFile', {'file_id': file_id})
+        
+        if status_code != 200:
+            raise Exception(f"Failed to get file info: HTTP {status_code}")
+        
+        if not file_data['ok']:
+            raise Exception(f"Telegram API error: {file_data.get('description', 'Unknown error')}")
+        
+        return {
+            'file_id': file_id,
+            'file_unique_id': file_data['result'].get('file_unique_id'),
+            'file_size': file_data['result'].get('file_size', 0),
+            'file_path': file_data['result']['file_path']
+        }
+    
     def is_authenticated(self):
         """Check if bot is authenticated."""
         return self._authenticated
     
     async def close(self):
         """Close the bot client."""
+        await self.transport.close()
         self.logger.info("Bot client closed")
 
 
 class DemoTelegramClient:
-    """Demo client that works without any credentials."""
+    """Demo client that works without any credentials.
+    
+    Every file is file_size bytes (or file_sizes[file_id]) delivered in
+    chunk_size pieces, chunk_delay seconds apart; benchmark.py uses a zero
+    delay to measure the download pipeline without a network.
+    """
     
-    def __init__(self):
+    def __init__(self, file_size=1024 * 1024, chunk_size=8192, chunk_delay=0.05, file_sizes=None,
+                 writer_options=None):
         self.logger = Logger().get_logger(__name__)
         self._authenticated = True
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.file_sizes = file_sizes or {}
+        self.writer_options = writer_options or {}
     
     async def initialize(self):
         """Initialize demo client."""
         self.logger.info("Demo client initialized - no authentication required")
         return True
     
-    async def download_file(self, file_id, download_path, progress_callback=None):
-        """Demo download that creates a sample file."""
+    async def download_file(self, file_id, download_path, progress_callback=None, offset=0, throttle=None,
+                            hasher=None):
+        """Demo download that creates a sample file, resuming after offset bytes."""
         try:
             # Create download directory
             Path(download_path).parent.mkdir(parents=True, exist_ok=True)
             
             # Create a sample file with some content
-            file_size = 1024 * 1024  # 1MB demo file
-            downloaded = 0
-            chunk_size = 8192
+            file_size = self.file_sizes.get(file_id, self.file_size)
+            downloaded = min(offset, file_size)
+            chunk_size = self.chunk_size
+            line = f"Demo file content - File ID: {file_id}\n".encode()
+            content = (line * (chunk_size // len(line) + 1))[:chunk_size]
             
-            with open(download_path, 'wb') as f:
+            with FileWriter(download_path, file_size, keep=downloaded, hasher=hasher,
+                            **self.writer_options) as writer:
                 while downloaded < file_size:
-                    # Simulate download delay
-                    await asyncio.sleep(0.05)
+                    # Simulate download delay (a zero delay still lets other downloads run)
+                    await asyncio.sleep(self.chunk_delay)
                     
                     chunk = min(chunk_size, file_size - downloaded)
                     # Write some sample content
-                    content = f"Demo file content - File ID: {file_id}\n".encode() * (chunk // 50 + 1)
-                    f.write(content[:chunk])
+                    writer.write(content if chunk == chunk_size else content[:chunk])
                     downloaded += chunk
+                    if throttle:
+                        await throttle(chunk)
                     
                     if progress_callback:
                         progress = (downloaded / file_size) * 100
@@ -169,7 +507,7 @@ class DemoTelegramClient:
         return {
             'file_id': file_id,
             'file_unique_id': f"demo_{file_id}",
-            'file_size': 1024 * 1024,  # 1MB
+            'file_size': self.file_sizes.get(file_id, self.file_size),
             'file_path': f"demo/{file_id}"
         }
     
@@ -0,0 +1,209 @@
+import threading
+import time
+from logger import Logger
+
+class SlotGate:
+    """Counting gate for download slots whose limit can change while downloads run.
+    
+    Lowering the limit never interrupts running downloads; new ones just wait
+    until enough have finished. Listeners are called whenever a slot may have
+    become free, so the asyncio engine can wake its dispatcher.
+    """
+    
+    def __init__(self, limit):
+        self._condition = threading.Condition()
+        self._limit = max(1, limit)
+        self._active = 0
+        self._listeners = []
+    
+    @property
+    def limit(self):
+        return self._limit
+    
+    @property
+    def active(self):
+        return self._active
+    
+    def add_listener(self, callback):
+        """Call callback() whenever a slot may have become available."""
+        self._listeners.append(callback)
+    
+    def try_acquire(self):
+        """Take a slot if one is free."""
+        with self._condition:
+            if self._active >= self._limit:
+                return False
+            self._active += 1
+            return True
+    
+    def acquire(self, timeout=None):
+        """Wait up to timeout seconds for a free slot."""
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._active < self._limit, timeout):
+                return False
+            self._active += 1
+            return True
+    
+    def release(self):
+        """Give a slot back."""
+        with self._condition:
+            self._active = max(0, self._active - 1)
+            self._condition.notify()
+        self._notify()
+    
+    def set_limit(self, limit):
+        """Change how many slots may be held at once."""
+        with self._condition:
+            self._limit = max(1, limit)
+            self._condition.notify_all()
+        self._notify()
+    
+    def _notify(self):
+        for callback in self._listeners:
+            callback()
+
+
+class ConcurrencyController:
+    """AIMD controller that sizes a SlotGate from observed download health.
+    
+    Every interval it looks at the outcomes reported since the last sample:
+    any 429, an error ratio above error_threshold, or a time to first byte far
+    above the best seen so far halves the limit. Otherwise, if every slot is
+    busy and work is waiting, the limit grows by one as long as the previous
+    increase bought at least gain_threshold more bytes/sec or completions/sec;
+    a slot that bought neither is taken back. After probe_after intervals without a
+    change it probes upward again.
+    """
+    
+    def __init__(self, gate, backlog_fn, min_limit=1, max_limit=16, interval=5.0,
+                 decrease_factor=0.5, error_threshold=0.2, latency_factor=3.0,
+                 gain_threshold=0.05, probe_after=6):
+        self.gate = gate
+        self.backlog_fn = backlog_fn
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.interval = interval
+        self.decrease_factor = decrease_factor
+        self.error_threshold = error_threshold
+        self.latency_factor = latency_factor
+        self.gain_threshold = gain_threshold
+        self.probe_after = probe_after
+        self.logger = Logger().get_logger(__name__)
+        
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._sampled_at = time.monotonic()
+        self._successes = 0
+        self._errors = 0
+        self._rate_limited = 0
+        self._latencies = []
+        self._best_latency = None
+        self._throughput_at_increase = None
+        self._just_increased = False
+        self._holds = 0
+        self.gate.set_limit(max(self.min_limit, min(self.max_limit, gate.limit)))
+        
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start sampling and adjusting the gate."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ConcurrencyController")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        """Stop adjusting; the gate keeps its current limit."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+    
+    def record_bytes(self, nbytes):
+        """Report bytes received by any download."""
+        with self._lock:
+            self._bytes += nbytes
+    
+    def record_success(self):
+        """Report a download that completed."""
+        with self._lock:
+            self._successes += 1
+    
+    def record_error(self, rate_limited=False):
+        """Report a failed download attempt; rate_limited marks HTTP 429 / flood waits."""
+        with self._lock:
+            self._errors += 1
+            if rate_limited:
+                self._rate_limited += 1
+    
+    def record_latency(self, seconds):
+        """Report a download's time to first byte."""
+        with self._lock:
+            self._latencies.append(seconds)
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self._adjust()
+            except Exception as e:
+                self.logger.error(f"Error adjusting concurrency: {e}")
+    
+    def _adjust(self):
+        """Take one sample and move the limit."""
+        with self._lock:
+            now = time.monotonic()
+            elapsed = max(now - self._sampled_at, 1e-6)
+            throughput = (self._bytes / elapsed, self._successes / elapsed)
+            successes, errors, rate_limited = self._successes, self._errors, self._rate_limited
+            latencies = self._latencies
+            self._bytes = self._successes = self._errors = self._rate_limited = 0
+            self._latencies = []
+            self._sampled_at = now
+        
+        limit = self.gate.limit
+        attempts = successes + errors
+        error_ratio = errors / attempts if attempts else 0.0
+        latency = sum(latencies) / len(latencies) if latencies else None
+        if latency is not None:
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+        
+        backoff = True
+        if rate_limited:
+            new_limit, reason = int(limit * self.decrease_factor), f"{rate_limited} rate limited"
+        elif attempts and error_ratio > self.error_threshold:
+            new_limit, reason = int(limit * self.decrease_factor), f"error ratio {error_ratio:.0%}"
+        elif latency is not None and latency > self._best_latency * self.latency_factor:
+            new_limit, reason = int(limit * self.decrease_factor), \
+                f"first byte after {latency:.2f}s (best {self._best_latency:.2f}s)"
+        else:
+            backoff = False
+            improved = (self._throughput_at_increase is None
+                        or any(current > before * (1 + self.gain_threshold)
+                               for current, before in zip(throughput, self._throughput_at_increase)))
+            if self._just_increased and not improved:
+                new_limit, reason = limit - 1, "last slot added no throughput"
+            elif self.gate.active >= limit and self.backlog_fn() > 0 and (improved or self._holds >= self.probe_after):
+                new_limit, reason = limit + 1, "all slots busy"
+            else:
+                new_limit, reason = limit, None
+        
+        new_limit = max(self.min_limit, min(self.max_limit, new_limit))
+        self._just_increased = new_limit > limit
+        if new_limit == limit:
+            self._holds += 1
+            return
+        
+        if new_limit > limit:
+            self._throughput_at_increase = throughput
+        elif backoff:
+            # Throughput measured at a higher limit says nothing about the next increase
+            self._throughput_at_increase = None
+        self._holds = 0
+        self.gate.set_limit(new_limit)
+        self.logger.info(f"Concurrency {limit} -> {new_limit} ({reason}; "
+                         f"{throughput[0] / (1024 * 1024):.1f} MiB/s, {successes} ok, {errors} failed, "
+                         f"latency {'n/a' if latency is None else f'{latency:.2f}s'})")
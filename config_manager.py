@@ -33,6 +33,7 @@ class ConfigManager:
             # Check for bot token (easiest option)
             if self.config.has_option('telegram', 'bot_token'):
                 config['bot_token'] = self.config.get('telegram', 'bot_token')
+                config['api_url'] = self.config.get('telegram', 'api_url', fallback='https://api.telegram.org')
                 config['auth_type'] = 'bot'
                 return config
             
@@ -71,14 +72,144 @@ class ConfigManager:
             return {
                 'download_path': self.config.get('downloads', 'download_path', fallback='./downloads'),
                 'max_concurrent_downloads': int(self.config.get('downloads', 'max_concurrent_downloads', fallback='3')),
+                'engine': self.config.get('downloads', 'engine', fallback='threads'),
+                'concurrency_mode': self.config.get('downloads', 'concurrency_mode', fallback='fixed'),
+                'concurrency_min': int(self.config.get('downloads', 'concurrency_min', fallback='1')),
+                'concurrency_max': int(self.config.get('downloads', 'concurrency_max', fallback='16')),
+                'concurrency_interval': float(self.config.get('downloads', 'concurrency_interval', fallback='5')),
+                'scheduler': self.config.get('downloads', 'scheduler', fallback='priority'),
+                'scheduler_aging': float(self.config.get('downloads', 'scheduler_aging', fallback='300')),
+                'scheduler_size_weight': float(self.config.get('downloads', 'scheduler_size_weight', fallback='1.0')),
                 'chunk_size': int(self.config.get('downloads', 'chunk_size', fallback='1048576')),
+                'min_chunk_size': int(self.config.get('downloads', 'min_chunk_size', fallback='65536')),
+                'adaptive_chunk_size': self.config.getboolean('downloads', 'adaptive_chunk_size', fallback=True),
+                'preallocate': self.config.getboolean('downloads', 'preallocate', fallback=True),
+                'fsync_policy': self.config.get('downloads', 'fsync_policy', fallback='none'),
+                'fsync_interval': int(self.config.get('downloads', 'fsync_interval', fallback='67108864')),
+                'hash_algorithm': self.config.get('downloads', 'hash_algorithm', fallback='sha256'),
+                'hash_workers': int(self.config.get('downloads', 'hash_workers', fallback='2')),
+                'dedup': self.config.getboolean('downloads', 'dedup', fallback=True),
+                'dedup_method': self.config.get('downloads', 'dedup_method', fallback='auto'),
+                'metadata_prefetch': self.config.getboolean('downloads', 'metadata_prefetch', fallback=True),
+                'metadata_concurrency': int(self.config.get('downloads', 'metadata_concurrency', fallback='4')),
+                'metadata_lookahead': int(self.config.get('downloads', 'metadata_lookahead', fallback='0')),
+                'segments': int(self.config.get('downloads', 'segments', fallback='1')),
+                'min_segment_size': int(self.config.get('downloads', 'min_segment_size', fallback='4194304')),
                 'retry_attempts': int(self.config.get('downloads', 'retry_attempts', fallback='5')),
-                'retry_delay': int(self.config.get('downloads', 'retry_delay', fallback='5'))
+                'retry_delay': int(self.config.get('downloads', 'retry_delay', fallback='5')),
+                'retry_max_delay': float(self.config.get('downloads', 'retry_max_delay', fallback='300')),
+                'retry_jitter': float(self.config.get('downloads', 'retry_jitter', fallback='0.5')),
+                'progress_flush_interval': float(self.config.get('downloads', 'progress_flush_interval', fallback='1.0')),
+                'progress_flush_bytes': int(self.config.get('downloads', 'progress_flush_bytes', fallback='4194304'))
             }
         except Exception as e:
             self.logger.error(f"Error reading download configuration: {e}")
             raise
     
+    def get_network_config(self):
+        """Get HTTP transport configuration for the Bot API client."""
+        try:
+            return {
+                'http_transport': self.config.get('network', 'http_transport', fallback='auto'),
+                'max_connections': int(self.config.get('network', 'max_connections', fallback='100')),
+                'max_connections_per_host': int(self.config.get('network', 'max_connections_per_host', fallback='16')),
+                'read_buffer_size': int(self.config.get('network', 'read_buffer_size', fallback='65536')),
+                'connect_timeout': float(self.config.get('network', 'connect_timeout', fallback='10')),
+                'read_timeout': float(self.config.get('network', 'read_timeout', fallback='60')),
+                'keepalive_timeout': float(self.config.get('network', 'keepalive_timeout', fallback='30'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading network configuration: {e}")
+            raise
+    
+    def get_database_config(self):
+        """Get database configuration."""
+        try:
+            return {
+                'db_path': self.config.get('database', 'db_path', fallback='downloads.db'),
+                'journal_mode': self.config.get('database', 'journal_mode', fallback='WAL'),
+                'synchronous': self.config.get('database', 'synchronous', fallback='NORMAL'),
+                'cache_size': int(self.config.get('database', 'cache_size', fallback='-8000')),
+                'busy_timeout': int(self.config.get('database', 'busy_timeout', fallback='5000'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading database configuration: {e}")
+            raise
+    
+    def get_bandwidth_config(self):
+        """Get bandwidth limits in bytes per second (0 = unlimited)."""
+        try:
+            return {
+                'global_limit': int(self.config.get('bandwidth', 'global_limit', fallback='0')),
+                'per_download_limit': int(self.config.get('bandwidth', 'per_download_limit', fallback='0')),
+                'chat_limits': self._get_pairs('bandwidth', 'chat_limits', int)
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading bandwidth configuration: {e}")
+            raise
+    
+    def get_api_limits_config(self):
+        """Get Bot API call budgets (calls per second) and flood-control handling."""
+        try:
+            return {
+                'default_rate': float(self.config.get('api_limits', 'default_rate', fallback='30')),
+                'method_rates': self._get_pairs('api_limits', 'method_rates', float),
+                'max_flood_wait': float(self.config.get('api_limits', 'max_flood_wait', fallback='60')),
+                'flood_retries': int(self.config.get('api_limits', 'flood_retries', fallback='3'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading API limits configuration: {e}")
+            raise
+    
+    def get_gui_config(self):
+        """Get GUI update pacing (frame interval in ms, log scrollback, event queue bound) and list paging."""
+        try:
+            return {
+                'frame_interval': int(self.config.get('gui', 'frame_interval', fallback='100')),
+                'log_scrollback': int(self.config.get('gui', 'log_scrollback', fallback='1000')),
+                'event_queue_size': int(self.config.get('gui', 'event_queue_size', fallback='10000')),
+                'list_page_size': int(self.config.get('gui', 'list_page_size', fallback='1000'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading GUI configuration: {e}")
+            raise
+    
+    def get_api_config(self):
+        """Get the embedded HTTP control API settings."""
+        try:
+            return {
+                'enabled': self.config.getboolean('api', 'enabled', fallback=False),
+                'host': self.config.get('api', 'host', fallback='127.0.0.1'),
+                'port': int(self.config.get('api', 'port', fallback='8765')),
+                'token': self.config.get('api', 'token', fallback='') or None,
+                'max_subscribers': int(self.config.get('api', 'max_subscribers', fallback='500')),
+                'progress_interval': float(self.config.get('api', 'progress_interval', fallback='0.5'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading API configuration: {e}")
+            raise
+    
+    def get_metrics_config(self):
+        """Get the Prometheus metrics exporter settings."""
+        try:
+            return {
+                'enabled': self.config.getboolean('metrics', 'enabled', fallback=False),
+                'host': self.config.get('metrics', 'host', fallback='127.0.0.1'),
+                'port': int(self.config.get('metrics', 'port', fallback='9464'))
+            }
+        except Exception as e:
+            self.logger.error(f"Error reading metrics configuration: {e}")
+            raise
+    
+    def _get_pairs(self, section, key, cast):
+        """Parse a comma-separated list of name:value pairs into a dict."""
+        pairs = {}
+        for entry in self.config.get(section, key, fallback='').split(','):
+            if entry.strip():
+                name, value = entry.strip().rsplit(':', 1)
+                pairs[name.strip()] = cast(value)
+        return pairs
+    
     def get_logging_config(self):
         """Get logging configuration."""
         try:
@@ -0,0 +1,371 @@
+import base64
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from event_bus import EventBroadcaster
+from importer import normalize_download
+from logger import Logger
+
+
+class ApiError(Exception):
+    """An error returned to the API client with an HTTP status."""
+    
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ControlApiHttpServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer with a listen backlog sized for many event subscribers connecting at once."""
+    
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class ControlApiServer:
+    """Embedded HTTP/JSON control API over a DownloadManager.
+    
+    Endpoints (all JSON):
+        GET  /status                          queue counts, concurrency, pause state
+        GET  /downloads?status=&chat_id=&created_after=&created_before=&order=&limit=&cursor=
+        GET  /downloads/<file_id>
+        POST /downloads                       one download
+        POST /downloads/bulk                  JSON array or {"downloads": [...]}; JSON lines
+                                              with Content-Type application/x-ndjson
+        POST /downloads/<file_id>/cancel|retry
+        POST /pause, POST /resume
+        GET  /events                          Server-Sent Events: status changes and progress
+    
+    POST requests must declare a JSON Content-Type (see JSON_TYPES).
+    
+    Status and progress hooks only hand events to an EventBroadcaster, so
+    subscribers never hold up download workers. With a token configured,
+    requests must send "Authorization: Bearer <token>" (or ?token= for
+    EventSource clients, which cannot set headers).
+    """
+    
+    def __init__(self, download_manager, host='127.0.0.1', port=8765, token=None,
+                 max_subscribers=500, progress_interval=0.5, heartbeat_interval=15.0):
+        self.download_manager = download_manager
+        self.host = host
+        self.port = port
+        self.token = token or None
+        self.max_subscribers = max_subscribers
+        self.heartbeat_interval = heartbeat_interval
+        self.logger = Logger().get_logger(__name__)
+        self.broadcaster = EventBroadcaster(progress_interval=progress_interval)
+        self._subscribers = 0
+        self._subscribers_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        
+        download_manager.add_status_callback(self._on_status_change)
+        download_manager.add_progress_listener(self._on_progress)
+    
+    def start(self):
+        """Start serving on a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        handler = type('ControlApiHandler', (ControlApiHandler,), {'api': self})
+        self._server = ControlApiHttpServer((self.host, self.port), handler)
+        self.port = self._server.server_address[1]
+        self.broadcaster.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="ControlApiServer")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info(f"Control API listening on http://{self.host}:{self.port}")
+    
+    def stop(self):
+        """Stop serving and end every event stream."""
+        self.broadcaster.stop()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.logger.info("Control API stopped")
+    
+    def _on_status_change(self, event_type, download_item):
+        self.broadcaster.publish(event_type, dict(download_item) if download_item else None)
+    
+    def _on_progress(self, file_id, downloaded_bytes, total_bytes, progress_percent):
+        self.broadcaster.publish_progress(file_id, {
+            'file_id': file_id,
+            'downloaded_bytes': downloaded_bytes,
+            'total_bytes': total_bytes,
+            'progress': progress_percent,
+            'speed': self.download_manager.get_download_speed(file_id)
+        })
+    
+    def check_token(self, headers, query):
+        """Whether a request carries the configured token."""
+        if not self.token:
+            return True
+        supplied = query.get('token', [''])[0]
+        authorization = headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            supplied = authorization[len('Bearer '):]
+        return hmac.compare_digest(supplied.encode(), self.token.encode())
+    
+    def acquire_subscriber(self):
+        """Reserve an event stream; False when max_subscribers are already connected."""
+        with self._subscribers_lock:
+            if self._subscribers >= self.max_subscribers:
+                return False
+            self._subscribers += 1
+            return True
+    
+    def release_subscriber(self):
+        with self._subscribers_lock:
+            self._subscribers -= 1
+    
+    def get_status(self):
+        manager = self.download_manager
+        return dict(manager.get_queue_stats(), concurrency=manager.get_concurrency(),
+                    subscribers=self._subscribers)
+    
+    def list_downloads(self, query):
+        """One page of downloads and the cursor for the next page (None on the last)."""
+        database = self.download_manager.database
+        filters = {'order': query.get('order', ['newest'])[0]}
+        if 'status' in query:
+            filters['statuses'] = [status for value in query['status'] for status in value.split(',') if status]
+        if 'chat_id' in query:
+            filters['chat_id'] = query['chat_id'][0]
+        if 'columns' in query:
+            filters['columns'] = [column for value in query['columns'] for column in value.split(',') if column]
+        try:
+            for name in ('created_after', 'created_before'):
+                if name in query:
+                    filters[name] = float(query[name][0])
+            limit = min(max(1, int(query.get('limit', ['100'])[0])), 1000)
+            if 'cursor' in query:
+                filters['after'] = json.loads(base64.urlsafe_b64decode(query['cursor'][0].encode()))
+        except (TypeError, ValueError) as e:
+            raise ApiError(400, f"Invalid query: {e}")
+        if filters['order'] not in database.ORDERS:
+            raise ApiError(400, f"Unknown order: {filters['order']}")
+        keys = [column for column, _ in database.ORDERS[filters['order']]]
+        if 'after' in filters and not (isinstance(filters['after'], dict)
+                                       and all(key in filters['after'] for key in keys)):
+            raise ApiError(400, "Cursor does not match the order")
+        
+        try:
+            rows = database.query_downloads(limit=limit, **filters)
+        except ValueError as e:
+            raise ApiError(400, str(e))
+        cursor = None
+        if len(rows) == limit:
+            last = {key: rows[-1][key] for key in keys}
+            cursor = base64.urlsafe_b64encode(json.dumps(last).encode()).decode()
+        return {'downloads': rows, 'next_cursor': cursor}
+    
+    def get_download(self, file_id):
+        download = self.download_manager.get_download_status(file_id)
+        if download is None:
+            raise ApiError(404, f"Unknown download: {file_id}")
+        return download
+    
+    def add_download(self, body):
+        try:
+            download = normalize_download(json.loads(body))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ApiError(400, f"Invalid download: {e}")
+        download_id = self.download_manager.add_download(
+            download['file_id'],
+            download.get('file_name') or f"file_{download['file_id'][:10]}",
+            chat_id=download.get('chat_id'),
+            message_id=download.get('message_id'),
+            priority=download.get('priority', 0)
+        )
+        return {'id': download_id, 'file_id': download['file_id']}
+    
+    def add_downloads(self, lines, json_lines=False):
+        """Bulk enqueue from a JSON array or {"downloads": [...]} body, or from JSON lines."""
+        invalid = []
+        if json_lines:
+            rows = (line for line in lines if line.strip())
+        else:
+            try:
+                body = json.loads(b''.join(lines))
+            except ValueError as e:
+                raise ApiError(400, f"Invalid JSON: {e}")
+            rows = body.get('downloads') if isinstance(body, dict) else body
+            if not isinstance(rows, list):
+                raise ApiError(400, "Expected a list of downloads")
+        
+        def downloads():
+            for number, row in enumerate(rows, start=1):
+                try:
+                    yield normalize_download(json.loads(row) if json_lines else row)
+                except (KeyError, TypeError, ValueError) as e:
+                    invalid.append({'index': number, 'error': str(e)})
+        
+        added, known = self.download_manager.add_downloads(downloads())
+        return {'added': added, 'known': known, 'invalid': invalid}
+    
+    def act(self, file_id, action):
+        self.get_download(file_id)
+        if action == 'cancel':
+            self.download_manager.cancel_download(file_id)
+        elif action == 'retry':
+            self.download_manager.retry_download(file_id)
+        else:
+            raise ApiError(404, f"Unknown action: {action}")
+        return self.download_manager.get_download_status(file_id)
+
+
+class ControlApiHandler(BaseHTTPRequestHandler):
+    """Routes requests to ControlApiServer (set as the class attribute api)."""
+    
+    protocol_version = 'HTTP/1.1'
+    server_version = 'TelegramDownloadManager'
+    api = None
+    
+    # Content types a bulk request body is read as one download per line for
+    JSON_LINES_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/x-jsonlines')
+    
+    # Content types POST requests must declare. Browsers send cross-site POSTs without a CORS
+    # preflight only for form and text bodies, so web pages cannot drive the API.
+    JSON_TYPES = ('application/json',) + JSON_LINES_TYPES
+    
+    def log_message(self, format, *args):
+        self.api.logger.debug(f"{self.address_string()} {format % args}")
+    
+    def finish(self):
+        try:
+            super().finish()
+        finally:
+            # Each connection gets a thread of its own; its database connection must not outlive it
+            self.api.download_manager.database.release_connection()
+    
+    def do_GET(self):
+        self._handle('GET')
+    
+    def do_POST(self):
+        self._handle('POST')
+    
+    def _handle(self, method):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        try:
+            if not self.api.check_token(self.headers, query):
+                raise ApiError(401, "Missing or invalid token")
+            if method == 'POST' and self._content_type() not in self.JSON_TYPES:
+                raise ApiError(415, "POST requests must have Content-Type: application/json")
+            
+            if method == 'GET' and parts == ['events']:
+                self._stream_events()
+                return
+            result = self._route(method, parts, query)
+            self._send_json(201 if method == 'POST' and parts == ['downloads'] else 200, result)
+        
+        except ApiError as e:
+            self._drain_body()
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            self.api.logger.error(f"Error handling {method} {url.path}: {e}")
+            self._drain_body()
+            self._send_json(500, {'error': str(e)})
+    
+    def _route(self, method, parts, query):
+        api = self.api
+        if method == 'GET':
+            if parts == ['status']:
+                return api.get_status()
+            if parts == ['downloads']:
+                return api.list_downloads(query)
+            if len(parts) == 2 and parts[0] == 'downloads':
+                return api.get_download(parts[1])
+        else:
+            if parts == ['downloads']:
+                return api.add_download(self._read_body())
+            if parts == ['downloads', 'bulk']:
+                return api.add_downloads(self._body_lines(), json_lines=self._content_type() in self.JSON_LINES_TYPES)
+            if len(parts) == 3 and parts[0] == 'downloads':
+                return api.act(parts[1], parts[2])
+            if parts == ['pause']:
+                api.download_manager.pause_downloads()
+                return api.get_status()
+            if parts == ['resume']:
+                api.download_manager.resume_downloads()
+                return api.get_status()
+        raise ApiError(404, f"No such endpoint: {method} /{'/'.join(parts)}")
+    
+    def _content_type(self):
+        return self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    
+    def _content_length(self):
+        try:
+            return int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            raise ApiError(400, "Invalid Content-Length")
+    
+    def _read_body(self):
+        length = self._content_length()
+        self._body_read = True
+        return self.rfile.read(length) if length else b''
+    
+    def _body_lines(self):
+        """Stream the request body line by line, never reading past Content-Length."""
+        remaining = self._content_length()
+        self._body_read = True
+        while remaining > 0:
+            line = self.rfile.readline(min(remaining, 1 << 20))
+            if not line:
+                break
+            remaining -= len(line)
+            yield line
+    
+    def _drain_body(self):
+        # Unread request bodies would be parsed as the next request on this connection
+        if not getattr(self, '_body_read', False) and self.command == 'POST':
+            self.close_connection = True
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _stream_events(self):
+        """Serve /events until the client disconnects or the server stops."""
+        api = self.api
+        if not api.acquire_subscriber():
+            raise ApiError(503, f"Too many event subscribers ({api.max_subscribers})")
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            
+            last_id = api.broadcaster.last_id()
+            header_id = self.headers.get('Last-Event-ID')
+            if header_id and header_id.isdigit():
+                last_id = int(header_id)
+            self.wfile.write(b"retry: 2000\n\n")
+            self.wfile.flush()
+            
+            while api.broadcaster.running:
+                events, last_id, missed = api.broadcaster.read(last_id, api.heartbeat_interval)
+                if missed:
+                    self.wfile.write(f"event: missed\ndata: {missed}\n\n".encode())
+                if events:
+                    self.wfile.write(b''.join(event for _, event in events))
+                elif not missed:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Subscriber went away
+        finally:
+            api.release_subscriber()
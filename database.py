@@ -1,25 +1,137 @@
 import sqlite3
 import threading
+import time
 import json
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from metrics import DB_LOCK_WAIT_SECONDS, DB_WRITE_SECONDS
 from logger import Logger
 
 class Database:
     """Database manager for storing download information."""
     
-    def __init__(self, db_path="downloads.db"):
+    JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+    SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+    
+    # Schema changes applied on top of the base tables, in order. The number of
+    # entries applied so far is stored in PRAGMA user_version.
+    MIGRATIONS = [
+        # 1: per-download scheduling priority
+        ["ALTER TABLE downloads ADD COLUMN priority INTEGER DEFAULT 0"],
+        # 2: epoch time a download waiting in backoff becomes eligible again
+        ["ALTER TABLE downloads ADD COLUMN next_retry_at REAL"],
+        # 3: Telegram's stable identifier for the file content
+        ["ALTER TABLE downloads ADD COLUMN file_unique_id TEXT"],
+        # 4: dedup lookups by content
+        ["CREATE INDEX IF NOT EXISTS idx_downloads_file_unique_id ON downloads(file_unique_id)"],
+        # 5: query_downloads filters and orderings
+        ["CREATE INDEX IF NOT EXISTS idx_downloads_created ON downloads(created_at)",
+         "CREATE INDEX IF NOT EXISTS idx_downloads_status_created ON downloads(status, created_at)",
+         "CREATE INDEX IF NOT EXISTS idx_downloads_status_queue ON downloads(status, priority DESC, created_at)",
+         "CREATE INDEX IF NOT EXISTS idx_downloads_chat_created ON downloads(chat_id, created_at)"],
+        # 6: digest of the completed content ('algorithm:hex'), computed while downloading
+        ["ALTER TABLE downloads ADD COLUMN content_hash TEXT"],
+    ]
+    
+    # Sort orders for query_downloads as (column, descending) keys; id makes every key unique
+    ORDERS = {
+        'newest': (('created_at', True), ('id', True)),
+        'oldest': (('created_at', False), ('id', False)),
+        'queue': (('priority', True), ('created_at', False), ('id', False)),
+    }
+    
+    # Statuses get_pending_downloads resumes on startup
+    PENDING_STATUSES = ('pending', 'paused', 'failed', 'downloading', 'retrying')
+    
+    def __init__(self, db_path="downloads.db", journal_mode="WAL", synchronous="NORMAL",
+                 cache_size=-8000, busy_timeout=5000):
         self.db_path = db_path
         self.logger = Logger().get_logger(__name__)
+        
+        # Connection tuning (validated because pragmas cannot be parameterized)
+        self.journal_mode = journal_mode.upper()
+        self.synchronous = synchronous.upper()
+        if self.journal_mode not in self.JOURNAL_MODES:
+            raise ValueError(f"Invalid journal_mode: {journal_mode}")
+        if self.synchronous not in self.SYNCHRONOUS_MODES:
+            raise ValueError(f"Invalid synchronous mode: {synchronous}")
+        self.cache_size = int(cache_size)
+        self.busy_timeout = int(busy_timeout)
+        
+        # One long-lived connection per thread; the lock only serializes writers,
+        # so readers never wait behind a write transaction in WAL mode.
+        self._local = threading.local()
+        self._connections = {}  # thread -> its connection
+        self._connections_lock = threading.Lock()
         self._lock = threading.Lock()
+        self.columns = ()
         self.init_database()
     
-    def init_database(self):
-        """Initialize database tables."""
+    def _get_connection(self):
+        """Get the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout / 1000.0,
+                                   check_same_thread=False)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA cache_size={self.cache_size}")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+            self._local.conn = conn
+            with self._connections_lock:
+                # Threads that have ended (e.g. control API request threads) no longer need theirs
+                stale = [thread for thread in self._connections if not thread.is_alive()]
+                stale_connections = [self._connections.pop(thread) for thread in stale]
+                self._connections[threading.current_thread()] = conn
+            self._close_connections(stale_connections)
+        return conn
+    
+    def release_connection(self):
+        """Close the calling thread's connection; short-lived threads call this when they are done."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._connections_lock:
+            if self._connections.get(threading.current_thread()) is conn:
+                del self._connections[threading.current_thread()]
+        self._close_connections([conn])
+    
+    def _close_connections(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                self.logger.error(f"Error closing database connection: {e}")
+    
+    @contextmanager
+    def _write(self):
+        """Run a write transaction on the calling thread's connection."""
+        waiting = time.perf_counter()
         with self._lock:
+            started = time.perf_counter()
+            DB_LOCK_WAIT_SECONDS.observe(started - waiting)
+            conn = self._get_connection()
             try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+                yield conn.cursor()
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+    
+    def close(self):
+        """Close every connection opened by this database."""
+        with self._connections_lock:
+            connections, self._connections = list(self._connections.values()), {}
+        self._close_connections(connections)
+        self._local = threading.local()
+    
+    def init_database(self):
+        """Initialize database tables."""
+        try:
+            with self._write() as cursor:
                 # Downloads table
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS downloads (
@@ -52,212 +164,373 @@ class Database:
                     )
                 ''')
                 
-                conn.commit()
-                conn.close()
-                self.logger.info("Database initialized successfully")
-                
-            except Exception as e:
-                self.logger.error(f"Error initializing database: {e}")
-                raise
+                self._migrate(cursor)
+                self.columns = tuple(row[1] for row in cursor.execute('PRAGMA table_info(downloads)'))
+            
+            self.logger.info(f"Database initialized successfully ({self.journal_mode} journal)")
+        
+        except Exception as e:
+            self.logger.error(f"Error initializing database: {e}")
+            raise
+    
+    def _migrate(self, cursor):
+        """Apply schema migrations newer than the database's user_version."""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        for target, statements in enumerate(self.MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(f'PRAGMA user_version = {target}')
+            self.logger.info(f"Migrated database schema to version {target}")
     
     def add_download(self, file_id, file_name, file_size=None, download_path=None, 
-                    chat_id=None, message_id=None, metadata=None):
-        """Add a new download to the database."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+                    chat_id=None, message_id=None, metadata=None, priority=0):
+        """Add a new download to the database. An existing row for file_id is left untouched."""
+        try:
+            with self._write() as cursor:
                 cursor.execute('''
-                    INSERT OR REPLACE INTO downloads 
-                    (file_id, file_name, file_size, download_path, chat_id, message_id, metadata)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    INSERT OR IGNORE INTO downloads 
+                    (file_id, file_name, file_size, download_path, chat_id, message_id, metadata, priority)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (file_id, file_name, file_size, download_path, chat_id, message_id,
-                      json.dumps(metadata) if metadata else None))
-                
-                conn.commit()
+                      json.dumps(metadata) if metadata else None, priority))
+                if cursor.rowcount == 0:
+                    cursor.execute('SELECT id FROM downloads WHERE file_id = ?', (file_id,))
+                    download_id = cursor.fetchone()[0]
+                    self.logger.info(f"Download already exists: {file_id} (ID: {download_id})")
+                    return download_id
                 download_id = cursor.lastrowid
-                conn.close()
-                
-                self.logger.info(f"Added download: {file_name} (ID: {download_id})")
-                return download_id
-                
-            except Exception as e:
-                self.logger.error(f"Error adding download: {e}")
-                raise
+            
+            self.logger.info(f"Added download: {file_name} (ID: {download_id})")
+            return download_id
+        
+        except Exception as e:
+            self.logger.error(f"Error adding download: {e}")
+            raise
+    
+    def add_downloads(self, downloads):
+        """Add several downloads in one transaction; rows that already exist are left untouched.
+        
+        ``downloads`` is an iterable of dicts with file_id, file_name and optionally
+        download_path, chat_id, message_id, metadata and priority. Returns a dict
+        mapping each file_id to (id, status), where status is None for rows added
+        by this call and the existing status otherwise.
+        """
+        downloads = list(downloads)
+        file_ids = [download['file_id'] for download in downloads]
+        try:
+            with self._write() as cursor:
+                existing = self._get_ids(cursor, file_ids)
+                cursor.executemany('''
+                    INSERT OR IGNORE INTO downloads
+                    (file_id, file_name, download_path, chat_id, message_id, metadata, priority)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(download['file_id'], download['file_name'], download.get('download_path'),
+                       download.get('chat_id'), download.get('message_id'),
+                       json.dumps(download['metadata']) if download.get('metadata') else None,
+                       download.get('priority') or 0)
+                      for download in downloads if download['file_id'] not in existing])
+                added = self._get_ids(cursor, [file_id for file_id in file_ids if file_id not in existing])
+            
+            self.logger.info(f"Added {len(added)} downloads ({len(existing)} already present)")
+            results = {file_id: (download_id, None) for file_id, (download_id, _) in added.items()}
+            results.update(existing)
+            return results
+        
+        except Exception as e:
+            self.logger.error(f"Error adding downloads: {e}")
+            raise
+    
+    def _get_ids(self, cursor, file_ids, chunk_size=500):
+        """Map the given file_ids that exist to (id, status)."""
+        ids = {}
+        for start in range(0, len(file_ids), chunk_size):
+            chunk = file_ids[start:start + chunk_size]
+            cursor.execute(f"SELECT file_id, id, status FROM downloads WHERE file_id IN ({', '.join('?' * len(chunk))})",
+                           chunk)
+            ids.update((file_id, (download_id, status)) for file_id, download_id, status in cursor.fetchall())
+        return ids
     
     def update_download_progress(self, file_id, progress, downloaded_bytes):
         """Update download progress."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+        try:
+            with self._write() as cursor:
                 cursor.execute('''
                     UPDATE downloads 
                     SET progress = ?, downloaded_bytes = ?
                     WHERE file_id = ?
                 ''', (progress, downloaded_bytes, file_id))
-                
-                conn.commit()
-                conn.close()
-                
-            except Exception as e:
-                self.logger.error(f"Error updating progress: {e}")
+        
+        except Exception as e:
+            self.logger.error(f"Error updating progress: {e}")
     
-    def update_download_status(self, file_id, status, error_message=None):
-        """Update download status."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                timestamp_field = None
-                if status == 'downloading':
-                    timestamp_field = 'started_at'
-                elif status in ['completed', 'failed']:
-                    timestamp_field = 'completed_at'
-                
-                if timestamp_field:
-                    cursor.execute(f'''
-                        UPDATE downloads 
-                        SET status = ?, error_message = ?, {timestamp_field} = CURRENT_TIMESTAMP
-                        WHERE file_id = ?
-                    ''', (status, error_message, file_id))
-                else:
-                    cursor.execute('''
-                        UPDATE downloads 
-                        SET status = ?, error_message = ?
-                        WHERE file_id = ?
-                    ''', (status, error_message, file_id))
-                
-                conn.commit()
-                conn.close()
-                
-                self.logger.info(f"Updated download status: {file_id} -> {status}")
-                
-            except Exception as e:
-                self.logger.error(f"Error updating status: {e}")
+    def update_download_progress_many(self, updates):
+        """Update progress for several downloads in one transaction.
+        
+        ``updates`` is an iterable of (progress, downloaded_bytes, file_id) tuples.
+        """
+        try:
+            with self._write() as cursor:
+                cursor.executemany('''
+                    UPDATE downloads
+                    SET progress = ?, downloaded_bytes = ?
+                    WHERE file_id = ?
+                ''', updates)
+        
+        except Exception as e:
+            self.logger.error(f"Error updating progress batch: {e}")
+    
+    def update_file_metadata_many(self, updates):
+        """Store resolved metadata for several downloads in one transaction.
+        
+        ``updates`` is an iterable of (file_size, file_unique_id, file_id) tuples.
+        """
+        try:
+            with self._write() as cursor:
+                cursor.executemany('''
+                    UPDATE downloads
+                    SET file_size = COALESCE(?, file_size), file_unique_id = COALESCE(?, file_unique_id)
+                    WHERE file_id = ?
+                ''', updates)
+        
+        except Exception as e:
+            self.logger.error(f"Error updating file metadata batch: {e}")
+    
+    def update_download_status(self, file_id, status, error_message=None, content_hash=None):
+        """Update download status; completing a download also records its content_hash (or clears it)."""
+        try:
+            assignments = 'status = ?, error_message = ?'
+            values = [status, error_message]
+            if status == 'downloading':
+                assignments += ', started_at = CURRENT_TIMESTAMP'
+            elif status in ['completed', 'failed']:
+                assignments += ', completed_at = CURRENT_TIMESTAMP'
+            if status == 'completed':
+                assignments += ', content_hash = ?'
+                values.append(content_hash)
+            
+            with self._write() as cursor:
+                cursor.execute(f'''
+                    UPDATE downloads 
+                    SET {assignments}
+                    WHERE file_id = ?
+                ''', (*values, file_id))
+            
+            self.logger.info(f"Updated download status: {file_id} -> {status}")
+        
+        except Exception as e:
+            self.logger.error(f"Error updating status: {e}")
+    
+    def update_download_priority(self, file_id, priority):
+        """Update a download's scheduling priority."""
+        try:
+            with self._write() as cursor:
+                cursor.execute('''
+                    UPDATE downloads
+                    SET priority = ?
+                    WHERE file_id = ?
+                ''', (priority, file_id))
+        
+        except Exception as e:
+            self.logger.error(f"Error updating priority: {e}")
     
     def increment_retry_count(self, file_id):
         """Increment retry count for a download."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+        try:
+            with self._write() as cursor:
                 cursor.execute('''
                     UPDATE downloads 
                     SET retry_count = retry_count + 1
                     WHERE file_id = ?
                 ''', (file_id,))
-                
-                conn.commit()
-                conn.close()
-                
-            except Exception as e:
-                self.logger.error(f"Error incrementing retry count: {e}")
+        
+        except Exception as e:
+            self.logger.error(f"Error incrementing retry count: {e}")
+    
+    def schedule_retry(self, file_id, next_retry_at, error_message=None):
+        """Count a failed attempt and park the download until next_retry_at."""
+        try:
+            with self._write() as cursor:
+                cursor.execute('''
+                    UPDATE downloads
+                    SET status = 'retrying', error_message = ?, next_retry_at = ?,
+                        retry_count = retry_count + 1
+                    WHERE file_id = ?
+                ''', (error_message, next_retry_at, file_id))
+            
+            self.logger.info(f"Updated download status: {file_id} -> retrying")
+        
+        except Exception as e:
+            self.logger.error(f"Error scheduling retry: {e}")
     
     def get_download(self, file_id):
         """Get download information by file_id."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT * FROM downloads WHERE file_id = ?
-                ''', (file_id,))
-                
-                result = cursor.fetchone()
-                conn.close()
-                
-                if result:
-                    columns = [description[0] for description in cursor.description]
-                    return dict(zip(columns, result))
-                return None
-                
-            except Exception as e:
-                self.logger.error(f"Error getting download: {e}")
-                return None
+        try:
+            cursor = self._get_connection().cursor()
+            cursor.execute('''
+                SELECT * FROM downloads WHERE file_id = ?
+            ''', (file_id,))
+            
+            result = cursor.fetchone()
+            columns = [description[0] for description in cursor.description]
+            cursor.close()
+            
+            if result:
+                return dict(zip(columns, result))
+            return None
+        
+        except Exception as e:
+            self.logger.error(f"Error getting download: {e}")
+            return None
+    
+    def get_completed_by_unique_id(self, file_unique_id):
+        """Get completed downloads with the given content, most recent first."""
+        try:
+            cursor = self._get_connection().cursor()
+            cursor.execute('''
+                SELECT file_id, download_path, file_size, content_hash FROM downloads
+                WHERE file_unique_id = ? AND status = 'completed'
+                ORDER BY completed_at DESC
+            ''', (file_unique_id,))
+            
+            results = cursor.fetchall()
+            
+            columns = [description[0] for description in cursor.description]
+            return [dict(zip(columns, row)) for row in results]
+        
+        except Exception as e:
+            self.logger.error(f"Error getting downloads by unique id: {e}")
+            return []
+    
+    def query_downloads(self, statuses=None, chat_id=None, created_after=None, created_before=None,
+                        columns=None, order='newest', after=None, limit=None):
+        """Get downloads matching the given filters, one page at a time.
+        
+        statuses is a list of statuses to include, created_after/created_before
+        bound created_at (epoch seconds or datetime, inclusive/exclusive) and
+        columns restricts the row dicts to those columns plus the ones the
+        order sorts by. order is one of ORDERS. Pages are keyset based: pass
+        the last row of a page as after to get the next one.
+        """
+        try:
+            keys = self.ORDERS[order]
+        except KeyError:
+            raise ValueError(f"Unknown order: {order}")
+        if columns is not None:
+            unknown = [column for column in columns if column not in self.columns]
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+            columns = list(dict.fromkeys(list(columns) + [column for column, _ in keys]))
+        
+        conditions, params = [], []
+        if statuses is not None:
+            statuses = list(statuses)
+            conditions.append(f"status IN ({', '.join('?' * len(statuses))})" if statuses else "0")
+            params.extend(statuses)
+        if chat_id is not None:
+            conditions.append("chat_id = ?")
+            params.append(str(chat_id))
+        if created_after is not None:
+            conditions.append("created_at >= ?")
+            params.append(self._format_timestamp(created_after))
+        if created_before is not None:
+            conditions.append("created_at < ?")
+            params.append(self._format_timestamp(created_before))
+        if after is not None:
+            condition, values = self._keyset_condition(keys, after)
+            conditions.append(condition)
+            params.extend(values)
+        
+        query = f"SELECT {', '.join(columns) if columns else '*'} FROM downloads"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY " + ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column, descending in keys)
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        
+        try:
+            cursor = self._get_connection().cursor()
+            cursor.execute(query, params)
+            names = [description[0] for description in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+        
+        except Exception as e:
+            self.logger.error(f"Error querying downloads: {e}")
+            return []
+    
+    def _keyset_condition(self, keys, after):
+        """WHERE clause selecting rows that sort strictly after the row after.
+        
+        Runs of keys with the same direction are compared as row values, so
+        SQLite can seek an index instead of scanning it.
+        """
+        runs = []
+        for column, descending in keys:
+            if runs and runs[-1][1] == descending:
+                runs[-1][0].append(column)
+            else:
+                runs.append(([column], descending))
+        
+        condition, values = None, []
+        for columns, descending in reversed(runs):
+            operand = columns[0] if len(columns) == 1 else f"({', '.join(columns)})"
+            placeholder = '?' if len(columns) == 1 else f"({', '.join('?' * len(columns))})"
+            run_values = [after[column] for column in columns]
+            op = '<' if descending else '>'
+            if condition is None:
+                condition, values = f"{operand} {op} {placeholder}", run_values
+            else:
+                # Within this run's bound, either strictly past it or tied and past on the later keys
+                condition = (f"{operand} {op}= {placeholder} AND "
+                             f"({operand} {op} {placeholder} OR ({condition}))")
+                values = run_values + run_values + values
+        return f"({condition})", values
+    
+    def iter_downloads(self, page_size=1000, **filters):
+        """Yield every download matching query_downloads filters, fetching page_size rows at a time."""
+        after = None
+        while True:
+            page = self.query_downloads(after=after, limit=page_size, **filters)
+            yield from page
+            if len(page) < page_size:
+                return
+            after = page[-1]
     
     def get_pending_downloads(self):
-        """Get all pending downloads."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT * FROM downloads 
-                    WHERE status IN ('pending', 'paused', 'failed')
-                    ORDER BY created_at ASC
-                ''')
-                
-                results = cursor.fetchall()
-                conn.close()
-                
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in results]
-                
-            except Exception as e:
-                self.logger.error(f"Error getting pending downloads: {e}")
-                return []
+        """Get all pending downloads, including ones interrupted mid-download."""
+        return self.query_downloads(statuses=self.PENDING_STATUSES, order='queue')
     
     def get_all_downloads(self):
         """Get all downloads."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    SELECT * FROM downloads ORDER BY created_at DESC
-                ''')
-                
-                results = cursor.fetchall()
-                conn.close()
-                
-                columns = [description[0] for description in cursor.description]
-                return [dict(zip(columns, row)) for row in results]
-                
-            except Exception as e:
-                self.logger.error(f"Error getting all downloads: {e}")
-                return []
+        return self.query_downloads()
+    
+    def _format_timestamp(self, value):
+        """Epoch seconds or a datetime as the UTC text SQLite's CURRENT_TIMESTAMP stores."""
+        if isinstance(value, datetime):
+            value = value.timestamp() if value.tzinfo else value.replace(tzinfo=timezone.utc).timestamp()
+        return datetime.fromtimestamp(value, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
     
     def delete_download(self, file_id):
         """Delete a download from database."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+        try:
+            with self._write() as cursor:
                 cursor.execute('DELETE FROM downloads WHERE file_id = ?', (file_id,))
-                
-                conn.commit()
-                conn.close()
-                
-                self.logger.info(f"Deleted download: {file_id}")
-                
-            except Exception as e:
-                self.logger.error(f"Error deleting download: {e}")
+            
+            self.logger.info(f"Deleted download: {file_id}")
+        
+        except Exception as e:
+            self.logger.error(f"Error deleting download: {e}")
     
     def delete_completed_downloads(self):
         """Delete all completed and cancelled downloads from database."""
-        with self._lock:
-            try:
-                conn = sqlite3.connect(self.db_path)
-                cursor = conn.cursor()
-                
+        try:
+            with self._write() as cursor:
                 cursor.execute('DELETE FROM downloads WHERE status IN (?, ?)', ('completed', 'cancelled'))
                 deleted_count = cursor.rowcount
-                
-                conn.commit()
-                conn.close()
-                
-                self.logger.info(f"Deleted {deleted_count} completed/cancelled downloads")
-                return deleted_count
-                
-            except Exception as e:
-                self.logger.error(f"Error deleting completed downloads: {e}")
-                return 0
+            
+            self.logger.info(f"Deleted {deleted_count} completed/cancelled downloads")
+            return deleted_count
+        
+        except Exception as e:
+            self.logger.error(f"Error deleting completed downloads: {e}")
+            return 0
@@ -0,0 +1,102 @@
+import os
+import shutil
+import threading
+from concurrent.futures import Future
+from logger import Logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl: share extents with another file (btrfs, XFS, ...)
+
+
+class Deduplicator:
+    """Content deduplication keyed on Telegram's file_unique_id.
+    
+    The same media forwarded under different file_ids has one file_unique_id.
+    Content that is already on disk is materialized locally (hardlink, reflink
+    or copy) instead of downloaded. Concurrent downloads of the same content
+    coalesce behind a single in-flight transfer. Hits and bytes saved are
+    counted for the session.
+    """
+    
+    METHODS = ('hardlink', 'reflink', 'copy')
+    
+    def __init__(self, database, method='auto'):
+        if method != 'auto' and method not in self.METHODS:
+            raise ValueError(f"Unknown dedup method: {method}")
+        self.database = database
+        self.method = method
+        self.logger = Logger().get_logger(__name__)
+        self._lock = threading.Lock()
+        self._inflight = {}  # file_unique_id -> Future resolving to the finished path (or None)
+        self._stats = {'hits': 0, 'coalesced': 0, 'bytes_saved': 0}
+    
+    def find_local_copy(self, file_unique_id, exclude_file_id=None):
+        """Path of a completed download with this content that is still on disk, or None."""
+        for download in self.database.get_completed_by_unique_id(file_unique_id):
+            if download['file_id'] == exclude_file_id:
+                continue
+            path = download['download_path']
+            if path and os.path.isfile(path) and (not download['file_size']
+                                                  or os.path.getsize(path) == download['file_size']):
+                return path
+        return None
+    
+    def join(self, file_unique_id):
+        """Become the transfer for this content, or get the Future of the one already running.
+        
+        Returns None when the caller is now the leader and must call release().
+        """
+        with self._lock:
+            future = self._inflight.get(file_unique_id)
+            if future is None:
+                self._inflight[file_unique_id] = Future()
+            return future
+    
+    def release(self, file_unique_id, path=None):
+        """Finish a leader's transfer; waiting downloads get path, or None if it failed."""
+        with self._lock:
+            future = self._inflight.pop(file_unique_id, None)
+        if future is not None and not future.done():
+            future.set_result(path)
+    
+    def materialize(self, source, target):
+        """Create target with source's content without downloading it. Returns the method used."""
+        methods = self.METHODS if self.method == 'auto' else (self.method,)
+        for method in methods:
+            try:
+                if method == 'hardlink':
+                    os.link(source, target)
+                elif method == 'reflink':
+                    self._reflink(source, target)
+                else:
+                    shutil.copyfile(source, target)
+                return method
+            except OSError as e:
+                if os.path.exists(target):
+                    os.remove(target)
+                if method == methods[-1]:
+                    raise
+                self.logger.debug(f"{method} from {source} failed ({e}), trying next method")
+    
+    def record_hit(self, size, coalesced=False):
+        """Count a download satisfied without a network fetch."""
+        with self._lock:
+            self._stats['hits'] += 1
+            self._stats['bytes_saved'] += size
+            if coalesced:
+                self._stats['coalesced'] += 1
+    
+    def get_stats(self):
+        """Session counters: hits, coalesced (waited on an in-flight transfer) and bytes_saved."""
+        with self._lock:
+            return dict(self._stats)
+    
+    def _reflink(self, source, target):
+        if fcntl is None:
+            raise OSError("reflink is not supported on this platform")
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
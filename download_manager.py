@@ -1,38 +1,135 @@
 import asyncio
+import functools
+import itertools
+import os
+import random
 import threading
 import queue
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrency import ConcurrencyController, SlotGate
 from database import Database
+from dedup import Deduplicator
+from file_writer import EXTENT_SUFFIX, FSYNC_POLICIES, durable_extent, finalize_file
+from hashing import StreamHasher, new_hash
+from importer import iter_download_list
+from metadata_prefetcher import MetadataPrefetcher
+from metrics import (ACTIVE_DOWNLOADS, CONCURRENCY_LIMIT, DOWNLOAD_RETRIES, DOWNLOAD_THROUGHPUT,
+                     DOWNLOADED_BYTES, DOWNLOADS_FINISHED, QUEUE_DEPTH, RETRYING_DOWNLOADS,
+                     STREAM_SECONDS, TIME_TO_FIRST_BYTE, error_class)
+from progress_journal import ProgressJournal
+from rate_limiter import BandwidthLimiter
+from scheduler import RetryScheduler, create_scheduler
 from telegram_client import TelegramClient
 from logger import Logger
 
 class DownloadManager:
     """Manages download queue and handles concurrent downloads."""
     
-    def __init__(self, config, telegram_client):
+    def __init__(self, config, telegram_client, database=None, bandwidth_limiter=None):
         self.config = config
         self.telegram_client = telegram_client
-        self.database = Database()
+        self.database = database or Database()
+        self.bandwidth_limiter = bandwidth_limiter or BandwidthLimiter()
         self.logger = Logger().get_logger(__name__)
         
+        # Progress is buffered and written behind in batches
+        self.progress_journal = ProgressJournal(
+            self.database,
+            flush_interval=config.get('progress_flush_interval', 1.0),
+            flush_bytes=config.get('progress_flush_bytes', 4 * 1024 * 1024)
+        )
+        
         # Download configuration
         self.max_concurrent = config['max_concurrent_downloads']
         self.retry_attempts = config['retry_attempts']
         self.retry_delay = config['retry_delay']
+        self.retry_max_delay = config.get('retry_max_delay', 300)
+        self.retry_jitter = config.get('retry_jitter', 0.5)
         self.download_path = Path(config['download_path']).expanduser()
+        # Clients sync finished files under any fsync policy but 'none'; the final rename is synced to match
+        fsync_policy = config.get('fsync_policy', 'none')
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.durable_finalize = fsync_policy != 'none'
+        self.engine = config.get('engine', 'threads')
+        if self.engine not in ('threads', 'asyncio'):
+            raise ValueError(f"Unknown download engine: {self.engine}")
+        
+        # Download slots; in adaptive mode the controller resizes them between the bounds
+        self.concurrency_mode = config.get('concurrency_mode', 'fixed')
+        if self.concurrency_mode not in ('fixed', 'adaptive'):
+            raise ValueError(f"Unknown concurrency mode: {self.concurrency_mode}")
+        self.slot_gate = SlotGate(self.max_concurrent)
+        self.concurrency_controller = None
+        if self.concurrency_mode == 'adaptive':
+            self.concurrency_controller = ConcurrencyController(
+                self.slot_gate,
+                backlog_fn=lambda: self.download_queue.qsize(),
+                min_limit=config.get('concurrency_min', 1),
+                max_limit=config.get('concurrency_max', 16),
+                interval=config.get('concurrency_interval', 5.0)
+            )
         
-        # Queue management
-        self.download_queue = queue.Queue()
+        # Queue management (ordered by the configured scheduling policy)
+        self.download_queue = create_scheduler(
+            config.get('scheduler', 'priority'),
+            aging_interval=config.get('scheduler_aging', 300.0),
+            size_weight=config.get('scheduler_size_weight', 1.0)
+        )
         self.active_downloads = {}
         self.download_threads = []
         self.is_running = False
         self.pause_event = threading.Event()
         self.pause_event.set()  # Start unpaused
         
+        # Shared asyncio engine state (engine = asyncio)
+        self._loop = None
+        self._engine_thread = None
+        self._work_available = None
+        self._async_resume = None
+        self._async_tasks = {}  # file_id -> asyncio.Task
+        self._slot_available = None
+        self.download_queue.add_listener(lambda: self._call_in_engine(lambda: self._work_available.set()))
+        self.slot_gate.add_listener(lambda: self._call_in_engine(lambda: self._slot_available.set()))
+        
+        # Failed downloads wait out their backoff here, off the download slots
+        self.retry_scheduler = RetryScheduler(self._enqueue)
+        
+        # Identical content (same file_unique_id) is fetched once and linked or copied locally
+        self.deduplicator = None
+        if config.get('dedup', True):
+            self.deduplicator = Deduplicator(self.database, method=config.get('dedup_method', 'auto'))
+        
+        # Content digests are computed from the bytes as they are written, on a small shared pool
+        self.hash_algorithm = config.get('hash_algorithm', 'sha256')
+        self.hash_executor = None
+        if self.hash_algorithm != 'none':
+            new_hash(self.hash_algorithm)  # Unknown or unavailable algorithms fail here, not per download
+            self.hash_executor = ThreadPoolExecutor(max_workers=max(1, config.get('hash_workers', 2)),
+                                                    thread_name_prefix='hash')
+        
+        # Resolve getFile metadata for queued downloads before a worker needs it
+        self.metadata_prefetcher = None
+        if config.get('metadata_prefetch', True) and hasattr(telegram_client, 'get_file_info'):
+            # By default look four downloads ahead per slot the queue can drain into
+            slot_limit = self.concurrency_controller.max_limit if self.concurrency_controller else self.max_concurrent
+            self.metadata_prefetcher = MetadataPrefetcher(
+                telegram_client,
+                self.database,
+                self.download_queue,
+                on_resolved=self._on_metadata_resolved,
+                concurrency=config.get('metadata_concurrency', 4),
+                lookahead=config.get('metadata_lookahead') or 4 * slot_limit,
+                resolved_ttl=getattr(telegram_client, 'file_info_ttl', None)
+            )
+            self.download_queue.add_listener(self.metadata_prefetcher.top_up)
+        
         # Progress callbacks
         self.progress_callbacks = {}
+        self.progress_listeners = []  # called for every download's progress
         self.status_callbacks = []
         
         # Speed tracking
@@ -42,10 +139,25 @@ class DownloadManager:
         
         # Create download directory
         self.download_path.mkdir(parents=True, exist_ok=True)
+        
+        self._register_metrics()
     
-    def add_download(self, file_id, file_name, chat_id=None, message_id=None, metadata=None):
-        """Add a download to the queue."""
+    def add_download(self, file_id, file_name, chat_id=None, message_id=None, metadata=None, priority=0):
+        """Add a download to the queue. Higher priority downloads start first.
+        
+        Re-adding a known file_id does not reset it: a failed or cancelled
+        download is retried, anything else is left as it is.
+        """
         try:
+            existing = self.database.get_download(file_id)
+            if existing:
+                if existing['status'] in ['failed', 'cancelled']:
+                    self.retry_download(file_id)
+                else:
+                    self.logger.info(f"Download already {existing['status']}: {existing['file_name']}")
+                return existing['id']
+            
+            file_name = self._safe_file_name(file_name, file_id)
             download_file_path = self.download_path / file_name
             
             # Add to database
@@ -55,7 +167,8 @@ class DownloadManager:
                 download_path=str(download_file_path),
                 chat_id=chat_id,
                 message_id=message_id,
-                metadata=metadata
+                metadata=metadata,
+                priority=priority
             )
             
             # Add to queue
@@ -64,10 +177,13 @@ class DownloadManager:
                 'file_id': file_id,
                 'file_name': file_name,
                 'download_path': str(download_file_path),
-                'retry_count': 0
+                'retry_count': 0,
+                'priority': priority,
+                'file_size': None,
+                'chat_id': chat_id
             }
             
-            self.download_queue.put(download_item)
+            self._enqueue(download_item)
             self.logger.info(f"Added download to queue: {file_name}")
             
             # Notify status callbacks
@@ -79,6 +195,78 @@ class DownloadManager:
             self.logger.error(f"Error adding download: {e}")
             raise
     
+    def add_downloads(self, downloads, batch_size=1000):
+        """Add many downloads: one transaction and one queue push per batch, one event in total.
+        
+        ``downloads`` is an iterable of dicts with file_id and optionally
+        file_name, chat_id, message_id, metadata and priority; it is consumed
+        batch_size items at a time, so it can stream from a file. Known file_ids
+        are treated as in add_download. Returns (added, already_known) counts.
+        """
+        added = known = 0
+        downloads = iter(downloads)
+        try:
+            while True:
+                batch = {}
+                for download in itertools.islice(downloads, batch_size):
+                    batch.setdefault(download['file_id'], download)
+                if not batch:
+                    break
+                
+                for download in batch.values():
+                    download['file_name'] = self._safe_file_name(download.get('file_name'), download['file_id'])
+                    download['download_path'] = str(self.download_path / download['file_name'])
+                results = self.database.add_downloads(batch.values())
+                
+                items = []
+                for file_id, (download_id, status) in results.items():
+                    if status is None:
+                        download = batch[file_id]
+                        items.append({
+                            'id': download_id,
+                            'file_id': file_id,
+                            'file_name': download['file_name'],
+                            'download_path': download['download_path'],
+                            'retry_count': 0,
+                            'priority': download.get('priority') or 0,
+                            'file_size': None,
+                            'chat_id': download.get('chat_id')
+                        })
+                    elif status in ['failed', 'cancelled']:
+                        self.retry_download(file_id)
+                
+                self.download_queue.put_many(items)
+                added += len(items)
+                known += len(results) - len(items)
+        
+        except Exception as e:
+            self.logger.error(f"Error adding downloads: {e}")
+            raise
+        
+        finally:
+            if added or known:
+                self.logger.info(f"Added {added} downloads to queue ({known} already known)")
+                self._notify_status_change("downloads_added", {'added': added, 'known': known})
+        
+        return added, known
+    
+    def _safe_file_name(self, file_name, file_id):
+        """The last component of a requested file name, so downloads always land in download_path.
+        
+        Names given by API clients or import lists may be absolute or contain '..';
+        only the final part is kept, and nothing usable falls back to a name from the file_id.
+        """
+        name = Path(str(file_name or '').replace('\\', '/')).name
+        if name in ('', '.', '..'):
+            name = f"file_{file_id[:10]}"
+        if file_name and name != file_name:
+            self.logger.warning(f"Using file name {name!r} for {file_id} instead of {file_name!r}")
+        return name
+    
+    def import_downloads(self, path, batch_size=1000):
+        """Add every download listed in a CSV or JSONL file. Returns (added, already_known)."""
+        return self.add_downloads(iter_download_list(path), batch_size)
+    
     def start_downloads(self):
         """Start the download manager."""
         if self.is_running:
@@ -88,20 +276,37 @@ class DownloadManager:
         self.is_running = True
         self.logger.info("Starting download manager")
         
+        self.progress_journal.start()
+        self.retry_scheduler.start()
+        if self.metadata_prefetcher:
+            self.metadata_prefetcher.start()
+        if self.concurrency_controller:
+            self.concurrency_controller.start()
+        
         # Load pending downloads from database
         self._load_pending_downloads()
         
-        # Start worker threads
-        for i in range(self.max_concurrent):
+        if self.engine == 'asyncio':
+            self._start_async_engine()
+            self.logger.info(f"Started asyncio download engine ({self._describe_concurrency()})")
+            return
+        
+        # Start enough worker threads for the largest slot limit; the gate decides how many run
+        worker_count = self.concurrency_controller.max_limit if self.concurrency_controller else self.max_concurrent
+        for i in range(worker_count):
             thread = threading.Thread(target=self._download_worker, name=f"DownloadWorker-{i}")
             thread.daemon = True
             thread.start()
             self.download_threads.append(thread)
         
-        self.logger.info(f"Started {self.max_concurrent} download worker threads")
+        self.logger.info(f"Started {worker_count} download worker threads ({self._describe_concurrency()})")
     
-    def stop_downloads(self):
-        """Stop the download manager."""
+    def stop_downloads(self, resumable=False):
+        """Stop the download manager.
+        
+        Active downloads are cancelled, or with resumable=True interrupted and
+        left pending so the next start resumes them from their checkpoint.
+        """
         if not self.is_running:
             return
         
@@ -110,24 +315,44 @@ class DownloadManager:
         
         # Stop all active downloads
         for file_id in list(self.active_downloads.keys()):
-            self.cancel_download(file_id)
+            if resumable:
+                self._interrupt_download(file_id)
+            else:
+                self.cancel_download(file_id)
+        
+        if self._engine_thread:
+            self._stop_async_engine()
         
         # Wait for threads to finish (with timeout)
         for thread in self.download_threads:
             thread.join(timeout=5.0)
         
         self.download_threads.clear()
+        if self.deduplicator:
+            stats = self.deduplicator.get_stats()
+            if stats['hits']:
+                self.logger.info(f"Deduplicated {stats['hits']} downloads ({stats['coalesced']} coalesced), "
+                                 f"saving {stats['bytes_saved']} bytes")
+        if self.concurrency_controller:
+            self.concurrency_controller.stop()
+        self.retry_scheduler.stop()
+        if self.metadata_prefetcher:
+            self.metadata_prefetcher.stop()
+        self.progress_journal.close()
+        self.database.close()
         self.logger.info("Download manager stopped")
     
     def pause_downloads(self):
         """Pause all downloads."""
         self.pause_event.clear()
+        self._call_in_engine(lambda: self._async_resume.clear())
         self.logger.info("Downloads paused")
         self._notify_status_change("downloads_paused", None)
     
     def resume_downloads(self):
         """Resume all downloads."""
         self.pause_event.set()
+        self._call_in_engine(lambda: self._async_resume.set())
         self.logger.info("Downloads resumed")
         self._notify_status_change("downloads_resumed", None)
     
@@ -138,15 +363,21 @@ class DownloadManager:
             if file_id in self.active_downloads:
                 download_info = self.active_downloads[file_id]
                 download_info['cancelled'] = True
-                self.database.update_download_status(file_id, 'cancelled')
+                task = self._async_tasks.get(file_id)
+                if task:
+                    self._call_in_engine(task.cancel)
+                self._set_status(file_id, 'cancelled')
                 self._cleanup_download_tracking(file_id)
                 self.logger.info(f"Cancelled active download: {file_id}")
                 self._notify_status_change("download_cancelled", download_info)
             else:
-                # Cancel pending download by updating status in database
+                # Cancel pending download: drop it from the queue or backoff and update the database
+                if self.download_queue.remove(file_id):
+                    self._prefetch_past(file_id)
+                self.retry_scheduler.cancel(file_id)
                 download_info = self.database.get_download(file_id)
-                if download_info and download_info['status'] in ['pending', 'downloading']:
-                    self.database.update_download_status(file_id, 'cancelled')
+                if download_info and download_info['status'] in ['pending', 'downloading', 'retrying']:
+                    self._set_status(file_id, 'cancelled')
                     self._cleanup_download_tracking(file_id)
                     self.logger.info(f"Cancelled pending download: {file_id}")
                     self._notify_status_change("download_cancelled", download_info)
@@ -154,28 +385,48 @@ class DownloadManager:
         except Exception as e:
             self.logger.error(f"Error cancelling download: {e}")
     
+    def _interrupt_download(self, file_id):
+        """Stop an active download without cancelling it, keeping its progress for a later resume."""
+        download_info = self.active_downloads.get(file_id)
+        if download_info is None:
+            return
+        download_info['cancelled'] = True
+        task = self._async_tasks.get(file_id)
+        if task:
+            self._call_in_engine(task.cancel)
+        self._set_status(file_id, 'pending')
+        self.logger.info(f"Interrupted active download, will resume on next start: {file_id}")
+    
+    def is_idle(self):
+        """Whether nothing is running, queued or waiting to retry."""
+        return (not self.active_downloads and self.download_queue.empty()
+                and self.retry_scheduler.pending_count() == 0)
+    
     def retry_download(self, file_id):
-        """Retry a failed download."""
+        """Retry a failed or cancelled download."""
         try:
             download_info = self.database.get_download(file_id)
-            if download_info and download_info['status'] == 'failed':
+            if download_info and download_info['status'] in ['failed', 'cancelled']:
                 # Reset status and add back to queue
-                self.database.update_download_status(file_id, 'pending')
-                
-                download_item = {
-                    'id': download_info['id'],
-                    'file_id': file_id,
-                    'file_name': download_info['file_name'],
-                    'download_path': download_info['download_path'],
-                    'retry_count': download_info['retry_count']
-                }
+                self._set_status(file_id, 'pending')
                 
-                self.download_queue.put(download_item)
+                self._enqueue(self._item_from_row(download_info))
                 self.logger.info(f"Retrying download: {download_info['file_name']}")
                 
         except Exception as e:
             self.logger.error(f"Error retrying download: {e}")
     
+    def set_priority(self, file_id, priority):
+        """Change a download's priority, re-sorting it in place if it is queued."""
+        try:
+            self.database.update_download_priority(file_id, priority)
+            if self.download_queue.reprioritize(file_id, priority):
+                self.logger.info(f"Reprioritised queued download {file_id} -> {priority}")
+            self._notify_status_change("download_reprioritized", {'file_id': file_id, 'priority': priority})
+            
+        except Exception as e:
+            self.logger.error(f"Error setting priority: {e}")
+    
     def get_download_status(self, file_id):
         """Get current status of a download."""
         return self.database.get_download(file_id)
@@ -184,6 +435,10 @@ class DownloadManager:
         """Get all downloads from database."""
         return self.database.get_all_downloads()
     
+    def query_downloads(self, **filters):
+        """Get one page of downloads; see Database.query_downloads for the filters."""
+        return self.database.query_downloads(**filters)
+    
     def clear_completed_downloads(self):
         """Clear all completed downloads from database."""
         return self.database.delete_completed_downloads()
@@ -192,10 +447,53 @@ class DownloadManager:
         """Add a progress callback for a specific download."""
         self.progress_callbacks[file_id] = callback
     
+    def add_progress_listener(self, callback):
+        """Add a callback(file_id, downloaded_bytes, total_bytes, progress_percent) for all downloads.
+        
+        It runs on the download's worker, so it must return quickly.
+        """
+        self.progress_listeners.append(callback)
+    
     def add_status_callback(self, callback):
         """Add a status callback for general events."""
         self.status_callbacks.append(callback)
     
+    def get_dedup_stats(self):
+        """Dedup counters for this session: hits, coalesced and bytes_saved."""
+        return self.deduplicator.get_stats() if self.deduplicator else {'hits': 0, 'coalesced': 0, 'bytes_saved': 0}
+    
+    def is_paused(self):
+        """Whether starting new downloads is paused."""
+        return not self.pause_event.is_set()
+    
+    def get_queue_stats(self):
+        """Counts of running, queued and backing-off downloads."""
+        return {
+            'active': len(self.active_downloads),
+            'queued': self.download_queue.qsize(),
+            'retrying': self.retry_scheduler.pending_count(),
+            'paused': self.is_paused()
+        }
+    
+    def _register_metrics(self):
+        """Sample queue state for the metrics exporter at scrape time rather than on every change."""
+        QUEUE_DEPTH.set_function(self.download_queue.qsize)
+        ACTIVE_DOWNLOADS.set_function(lambda: len(self.active_downloads))
+        RETRYING_DOWNLOADS.set_function(self.retry_scheduler.pending_count)
+        CONCURRENCY_LIMIT.set_function(lambda: self.slot_gate.limit)
+        DOWNLOAD_THROUGHPUT.set_function(lambda: sum(list(self.download_speeds.values())))
+    
+    def get_concurrency(self):
+        """Current number of download slots and how many are in use."""
+        return {'limit': self.slot_gate.limit, 'active': self.slot_gate.active, 'mode': self.concurrency_mode}
+    
+    def _describe_concurrency(self):
+        """Human readable slot configuration for log messages."""
+        if self.concurrency_controller:
+            return (f"adaptive, {self.slot_gate.limit} concurrent downloads within "
+                    f"{self.concurrency_controller.min_limit}-{self.concurrency_controller.max_limit}")
+        return f"{self.slot_gate.limit} concurrent downloads"
+    
     def get_download_speed(self, file_id):
         """Get current download speed for a file."""
         return self.download_speeds.get(file_id, 0)
@@ -224,8 +522,57 @@ class DownloadManager:
             
             self.last_progress_update[file_id] = (current_time, downloaded_bytes)
     
+    def _get_resume_offset(self, file_id, part_path):
+        """Get how many leading bytes of a .part file are both on disk and covered by the progress checkpoint."""
+        if not os.path.exists(part_path):
+            return 0
+        
+        self.progress_journal.flush(file_id)
+        download_info = self.database.get_download(file_id)
+        checkpoint = (download_info or {}).get('downloaded_bytes') or 0
+        return min(durable_extent(part_path), checkpoint)
+    
+    def _promote_download(self, part_path, download_path, expected_size):
+        """Validate a finished .part file's size and move it into its final place."""
+        finalize_file(part_path, download_path, expected_size, durable=self.durable_finalize)
+    
+    def _set_status(self, file_id, status, error_message=None, content_hash=None):
+        """Persist a status change, flushing buffered progress for the download first."""
+        self.progress_journal.flush(file_id)
+        self.database.update_download_status(file_id, status, error_message, content_hash)
+    
+    def _start_transfer(self, file_id, part_path):
+        """Mark a download as downloading and return the offset to resume it from."""
+        self._set_status(file_id, 'downloading')
+        return self._get_resume_offset(file_id, part_path)
+    
+    def _record_completion(self, file_id, size, unique_id, content_hash):
+        """Persist a finished transfer: its size for later deduplication, then its status."""
+        if unique_id:
+            self.database.update_file_metadata_many([(size or None, unique_id, file_id)])
+        self._set_status(file_id, 'completed', content_hash=content_hash)
+    
+    def _persist_retry(self, file_id, next_retry_at, error_message):
+        """Persist a retry deadline, flushing buffered progress for the download first."""
+        self.progress_journal.flush(file_id)
+        self.database.schedule_retry(file_id, next_retry_at, error_message)
+    
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Run a database or file system call for a download.
+        
+        The asyncio engine runs every download on one loop, so the call goes to
+        the loop's executor instead of holding all of them up behind the
+        database lock or the disk. A threads-engine worker owns its loop and
+        calls it directly.
+        """
+        if self.engine != 'asyncio':
+            return func(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args, **kwargs))
+    
     def _cleanup_download_tracking(self, file_id):
         """Clean up tracking data for a completed/cancelled download."""
+        self.progress_journal.discard(file_id)
+        self.bandwidth_limiter.release(file_id)
         self.download_speeds.pop(file_id, None)
         self.download_start_times.pop(file_id, None)
         self.last_progress_update.pop(file_id, None)
@@ -233,25 +580,181 @@ class DownloadManager:
     def _load_pending_downloads(self):
         """Load pending downloads from database."""
         try:
-            pending_downloads = self.database.get_pending_downloads()
+            now = time.time()
             
-            for download in pending_downloads:
-                download_item = {
-                    'id': download['id'],
-                    'file_id': download['file_id'],
-                    'file_name': download['file_name'],
-                    'download_path': download['download_path'],
-                    'retry_count': download['retry_count']
-                }
-                self.download_queue.put(download_item)
+            ready = []
+            file_ids = []
+            for download in self.database.iter_downloads(statuses=self.database.PENDING_STATUSES, order='queue'):
+                file_ids.append(download['file_id'])
+                # Age items from when they were first added, so restarts keep the same order
+                download_item = self._item_from_row(download, queued_at=self._parse_timestamp(download['created_at']))
+                next_retry_at = download.get('next_retry_at')
+                if download['status'] == 'retrying' and next_retry_at and next_retry_at > now:
+                    self.retry_scheduler.schedule(download_item, next_retry_at)
+                else:
+                    ready.append(download_item)
+            self.download_queue.put_many(ready)
             
-            self.logger.info(f"Loaded {len(pending_downloads)} pending downloads")
+            self.logger.info(f"Loaded {len(file_ids)} pending downloads "
+                             f"({len(file_ids) - len(ready)} waiting to retry)")
             
         except Exception as e:
             self.logger.error(f"Error loading pending downloads: {e}")
     
+    def _prefetch_past(self, file_id):
+        """Move the metadata lookahead on once a download leaves the queue."""
+        if self.metadata_prefetcher:
+            self.metadata_prefetcher.started(file_id)
+    
+    def _on_metadata_resolved(self, file_id, file_info):
+        """Give the scheduler the real size of a queued download."""
+        if file_info.get('file_size'):
+            self.download_queue.update(file_id, file_size=file_info['file_size'])
+    
+    def _item_from_row(self, download, **extra):
+        """Build a queue item from a downloads table row."""
+        download_item = {
+            'id': download['id'],
+            'file_id': download['file_id'],
+            'file_name': download['file_name'],
+            'download_path': download['download_path'],
+            'retry_count': download['retry_count'],
+            'priority': download.get('priority') or 0,
+            'file_size': download.get('file_size'),
+            'chat_id': download.get('chat_id')
+        }
+        download_item.update(extra)
+        return download_item
+    
+    def _parse_timestamp(self, value):
+        """Convert an SQLite CURRENT_TIMESTAMP (UTC) string to epoch seconds."""
+        try:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+        except (TypeError, ValueError):
+            return time.time()
+    
+    def _is_rate_limited(self, error):
+        """Whether a download failed because the server asked us to slow down."""
+        return getattr(error, 'status', None) == 429 or 'HTTP 429' in str(error)
+    
+    def _get_retry_delay(self, retry_count):
+        """Exponential backoff for the given attempt, capped and randomly shortened by up to retry_jitter."""
+        delay = min(self.retry_max_delay, self.retry_delay * (2 ** (retry_count - 1)))
+        return delay * (1 - self.retry_jitter * random.random())
+    
+    def _enqueue(self, download_item):
+        """Queue a download; the scheduler wakes whichever engine is running."""
+        self.download_queue.put(download_item)
+    
+    def _call_in_engine(self, callback):
+        """Run a callback on the asyncio engine's loop, if the engine is running."""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(callback)
+            except RuntimeError:
+                pass  # Loop already closed
+    
+    def _start_async_engine(self):
+        """Start the single event loop thread that runs all downloads as tasks."""
+        ready = threading.Event()
+        self._engine_thread = threading.Thread(target=self._run_async_engine, args=(ready,),
+                                               name="DownloadEngine")
+        self._engine_thread.daemon = True
+        self._engine_thread.start()
+        ready.wait()
+    
+    def _stop_async_engine(self):
+        """Wake the dispatcher so it sees is_running is False, and wait for the engine to exit."""
+        self._call_in_engine(lambda: self._async_resume.set())
+        self._call_in_engine(lambda: self._work_available.set())
+        self._call_in_engine(lambda: self._slot_available.set())
+        self._engine_thread.join(timeout=5.0)
+        self._engine_thread = None
+    
+    def _run_async_engine(self, ready):
+        """Engine thread body: own the loop and run the dispatcher until stopped."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._work_available = asyncio.Event()
+        self._slot_available = asyncio.Event()
+        self._async_resume = asyncio.Event()
+        if self.pause_event.is_set():
+            self._async_resume.set()
+        self._loop = loop
+        ready.set()
+        
+        try:
+            loop.run_until_complete(self._dispatch_downloads())
+        except Exception as e:
+            self.logger.error(f"Error in download engine: {e}")
+        finally:
+            self._loop = None
+            loop.close()
+    
+    async def _dispatch_downloads(self):
+        """Start queued downloads as tasks, bounded by the download slots."""
+        def on_task_done(task, file_id):
+            if self._async_tasks.get(file_id) is task:
+                del self._async_tasks[file_id]
+            self.slot_gate.release()
+        
+        try:
+            while self.is_running:
+                # Take a slot first so the scheduler picks the item at the moment it can run
+                await self._async_resume.wait()
+                if not await self._acquire_slot():
+                    break
+                download_item = await self._next_queued_item()
+                if download_item is None:
+                    self.slot_gate.release()
+                    break
+                self._prefetch_past(download_item['file_id'])
+                
+                file_id = download_item['file_id']
+                task = asyncio.ensure_future(self._process_download(download_item))
+                self._async_tasks[file_id] = task
+                task.add_done_callback(lambda t, fid=file_id: on_task_done(t, fid))
+        finally:
+            tasks = list(self._async_tasks.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _acquire_slot(self):
+        """Wait for a free download slot; False once the manager stops."""
+        while self.is_running:
+            if self.slot_gate.try_acquire():
+                return True
+            # The gate's listener sets this from other threads via call_soon_threadsafe
+            self._slot_available.clear()
+            await self._slot_available.wait()
+        return False
+    
+    async def _next_queued_item(self):
+        """Wait for the scheduler to yield an item; None once the manager stops."""
+        while self.is_running:
+            try:
+                return self.download_queue.get_nowait()
+            except queue.Empty:
+                # Scheduler listeners set this from other threads via call_soon_threadsafe
+                self._work_available.clear()
+                await self._work_available.wait()
+        return None
+    
     def _download_worker(self):
         """Worker thread for processing downloads."""
+        # One event loop per worker, reused for every download it runs
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        
+        try:
+            self._run_worker_loop(loop)
+        finally:
+            loop.close()
+    
+    def _run_worker_loop(self, loop):
+        """Pull downloads off the thread-safe queue until the manager stops."""
         while self.is_running:
             try:
                 # Wait for pause event
@@ -260,24 +763,34 @@ class DownloadManager:
                 if not self.is_running:
                     break
                 
-                # Get next download from queue (with timeout)
-                try:
-                    download_item = self.download_queue.get(timeout=1.0)
-                except queue.Empty:
+                # Wait for a download slot, then for the next download (with timeouts)
+                if not self.slot_gate.acquire(timeout=1.0):
                     continue
-                
-                # Process the download
-                self._process_download(download_item)
-                self.download_queue.task_done()
+                try:
+                    try:
+                        download_item = self.download_queue.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+                    self._prefetch_past(download_item['file_id'])
+                    
+                    # Process the download
+                    loop.run_until_complete(self._process_download(download_item))
+                    self.download_queue.task_done()
+                finally:
+                    self.slot_gate.release()
                 
             except Exception as e:
                 self.logger.error(f"Error in download worker: {e}")
     
-    def _process_download(self, download_item):
+    async def _process_download(self, download_item):
         """Process a single download."""
         file_id = download_item['file_id']
         file_name = download_item['file_name']
         download_path = download_item['download_path']
+        part_path = download_path + '.part'
+        unique_id = None
+        hasher = None
+        completed = False
         
         try:
             # Check if already cancelled
@@ -287,35 +800,73 @@ class DownloadManager:
             # Mark as active
             self.active_downloads[file_id] = download_item
             
-            # Update status to downloading
-            self.database.update_download_status(file_id, 'downloading')
             self._notify_status_change("download_started", download_item)
             
+            # Content already on disk, or being fetched for another file_id, needs no transfer of its own
+            unique_id = await self._get_file_unique_id(file_id)
+            if unique_id:
+                source, coalesced = await self._find_content(file_id, unique_id)
+                if source:
+                    content_id, unique_id = unique_id, None  # Not the transfer for this content
+                    await self._run_blocking(self._complete_from_copy, download_item, source, coalesced, content_id)
+                    return
+            
+            # Update status to downloading, resuming from whatever a previous attempt verifiably wrote
+            offset = await self._run_blocking(self._start_transfer, file_id, part_path)
+            if offset:
+                self.logger.info(f"Resuming {file_name} from byte {offset}")
+            
+            expected = {'total': 0, 'received': offset, 'first_byte': False}
+            started = time.monotonic()
+            
             # Create progress callback
             def progress_callback(downloaded_bytes, total_bytes, progress_percent):
+                received = max(0, downloaded_bytes - expected['received'])
+                expected['received'] = downloaded_bytes
+                expected['total'] = total_bytes
+                DOWNLOADED_BYTES.inc(received)
+                if not expected['first_byte']:
+                    expected['first_byte'] = True
+                    TIME_TO_FIRST_BYTE.observe(time.monotonic() - started)
+                    if self.concurrency_controller:
+                        self.concurrency_controller.record_latency(time.monotonic() - started)
+                if self.concurrency_controller:
+                    self.concurrency_controller.record_bytes(received)
+                
                 # Update speed tracking
                 self._update_download_speed(file_id, downloaded_bytes)
                 
-                # Update database
-                self.database.update_download_progress(file_id, progress_percent, downloaded_bytes)
+                # Buffer for the write-behind journal
+                self.progress_journal.record(file_id, progress_percent, downloaded_bytes)
                 
                 # Call registered progress callback if exists
                 if file_id in self.progress_callbacks:
                     self.progress_callbacks[file_id](downloaded_bytes, total_bytes, progress_percent)
+                for listener in self.progress_listeners:
+                    listener(file_id, downloaded_bytes, total_bytes, progress_percent)
             
-            # Start download
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-            success = loop.run_until_complete(
-                self.telegram_client.download_file(file_id, download_path, progress_callback)
-            )
-            
-            loop.close()
+            # Start download, paced by the global, per-download and per-chat bandwidth caps
+            throttle = self.bandwidth_limiter.throttle_for(file_id, download_item.get('chat_id'))
+            if self.hash_executor:
+                hasher = StreamHasher(self.hash_algorithm, part_path, self.hash_executor)
+            try:
+                success = await self.telegram_client.download_file(file_id, part_path, progress_callback,
+                                                                   offset=offset, throttle=throttle,
+                                                                   hasher=hasher)
+            finally:
+                STREAM_SECONDS.observe(time.monotonic() - started)
             
             if success and not download_item.get('cancelled'):
+                # Usually already caught up; bytes the client did not report are read back here
+                content_hash = await asyncio.wrap_future(hasher.finish()) if hasher else None
+                await self._run_blocking(self._promote_download, part_path, download_path, expected['total'])
+                completed = True
+                
                 # Download completed successfully
-                self.database.update_download_status(file_id, 'completed')
+                if self.concurrency_controller:
+                    self.concurrency_controller.record_success()
+                await self._run_blocking(self._record_completion, file_id, expected['total'], unique_id, content_hash)
+                DOWNLOADS_FINISHED.labels('completed').inc()
                 self.logger.info(f"Download completed: {file_name}")
                 self._cleanup_download_tracking(file_id)
                 self._notify_status_change("download_completed", download_item)
@@ -325,28 +876,108 @@ class DownloadManager:
         except Exception as e:
             self.logger.error(f"Download failed: {file_name} - {e}")
             
+            if download_item.get('cancelled'):
+                return
+            
+            if self.concurrency_controller:
+                self.concurrency_controller.record_error(rate_limited=self._is_rate_limited(e))
+            
             # Handle retry logic
             if download_item['retry_count'] < self.retry_attempts:
-                self.database.increment_retry_count(file_id)
                 download_item['retry_count'] += 1
+                DOWNLOAD_RETRIES.labels(error_class(e)).inc()
                 
-                # Wait before retry
-                time.sleep(self.retry_delay)
-                
-                # Add back to queue for retry
-                self.download_queue.put(download_item)
-                self.logger.info(f"Retrying download ({download_item['retry_count']}/{self.retry_attempts}): {file_name}")
+                # Park the download until its backoff expires instead of holding this slot
+                # Never come back before the server's flood-control wait is over
+                delay = max(self._get_retry_delay(download_item['retry_count']), getattr(e, 'retry_after', 0))
+                next_retry_at = time.time() + delay
+                await self._run_blocking(self._persist_retry, file_id, next_retry_at, str(e))
+                self.retry_scheduler.schedule(download_item, next_retry_at)
+                self.logger.info(f"Retrying download ({download_item['retry_count']}/{self.retry_attempts}) "
+                                 f"in {delay:.1f}s: {file_name}")
+                self._notify_status_change("download_retrying", download_item)
             else:
                 # Max retries reached
-                self.database.update_download_status(file_id, 'failed', str(e))
+                await self._run_blocking(self._set_status, file_id, 'failed', str(e))
+                DOWNLOADS_FINISHED.labels('failed').inc()
                 self._cleanup_download_tracking(file_id)
                 self._notify_status_change("download_failed", download_item)
         
         finally:
+            if hasher:
+                hasher.close()
+            
+            # Hand the result to downloads of the same content waiting on this transfer
+            if unique_id:
+                self.deduplicator.release(unique_id, download_path if completed else None)
+            
             # Remove from active downloads
             if file_id in self.active_downloads:
                 del self.active_downloads[file_id]
     
+    async def _get_file_unique_id(self, file_id):
+        """A download's file_unique_id from the client's (cached) file info, if dedup applies."""
+        if not self.deduplicator or not hasattr(self.telegram_client, 'get_file_info'):
+            return None
+        file_info = await self.telegram_client.get_file_info(file_id)
+        return file_info.get('file_unique_id')
+    
+    async def _find_content(self, file_id, unique_id):
+        """Find identical content for a download.
+        
+        Returns (path, coalesced) for content already on disk or just fetched by
+        another download, or (None, False) once this download is the transfer
+        other downloads of the content will wait on.
+        """
+        coalesced = False
+        while True:
+            source = await self._run_blocking(self.deduplicator.find_local_copy, unique_id, exclude_file_id=file_id)
+            if source:
+                return source, coalesced
+            
+            inflight = self.deduplicator.join(unique_id)
+            if inflight is None:
+                return None, False
+            
+            # Shielded so cancelling this download does not cancel the shared transfer
+            self.logger.info(f"Waiting for an in-flight download of the same content: {file_id}")
+            source = await asyncio.shield(asyncio.wrap_future(inflight))
+            coalesced = True
+            if source and os.path.isfile(source):
+                return source, True
+    
+    def _complete_from_copy(self, download_item, source, coalesced, unique_id):
+        """Finish a download from identical content that is already on disk."""
+        file_id = download_item['file_id']
+        download_path = download_item['download_path']
+        size = os.path.getsize(source)
+        
+        # The content is identical, so is its digest
+        content_hash = next((row['content_hash'] for row in self.database.get_completed_by_unique_id(unique_id)
+                             if row['download_path'] == source), None)
+        
+        method = 'existing file'
+        if os.path.abspath(source) != os.path.abspath(download_path):
+            part_path = download_path + '.part'
+            for stale in (part_path, part_path + '.segments', part_path + EXTENT_SUFFIX):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            method = self.deduplicator.materialize(source, part_path)
+            os.replace(part_path, download_path)
+        
+        self.deduplicator.record_hit(size, coalesced)
+        self.progress_journal.record(file_id, 100.0, size)
+        if file_id in self.progress_callbacks:
+            self.progress_callbacks[file_id](size, size, 100.0)
+        for listener in self.progress_listeners:
+            listener(file_id, size, size, 100.0)
+        
+        self._set_status(file_id, 'completed', content_hash=content_hash)
+        DOWNLOADS_FINISHED.labels('deduplicated').inc()
+        self.logger.info(f"Download deduplicated ({method} of {source}): {download_item['file_name']}")
+        self._cleanup_download_tracking(file_id)
+        self._notify_status_change("download_completed", download_item)
+    
     def _notify_status_change(self, event_type, download_item):
         """Notify all status callbacks about an event."""
         try:
@@ -0,0 +1,186 @@
+import collections
+import itertools
+import json
+import threading
+import time
+from logger import Logger
+
+class EventBus:
+    """Thread-safe, coalescing hand-off of download events to a single consumer.
+    
+    Worker threads publish() as often as they like; the consumer (the GUI)
+    drain()s on its own schedule. Between drains the latest event per file
+    replaces earlier ones, and log lines wait in a bounded queue that drops
+    the oldest lines once full, so the consumer's cost depends on how often
+    it drains rather than on how many events arrive.
+    """
+    
+    def __init__(self, max_lines=10000):
+        self._lock = threading.Lock()
+        self._updates = collections.OrderedDict()  # file_id -> (event_type, download_item)
+        self._lines = collections.deque(maxlen=max(1, max_lines))
+        self._dropped = 0
+    
+    def publish(self, event_type, download_item=None, message=None):
+        """Record an event from any thread; message overrides the default log line.
+        
+        Events that are not about a single file (bulk adds, pause/resume) are
+        kept under the file_id None.
+        """
+        file_id = download_item.get('file_id') if download_item else None
+        if message is None:
+            name = download_item.get('file_name', 'Unknown') if download_item else ''
+            message = f"Download {event_type}: {name}"
+        with self._lock:
+            self._updates.pop(file_id, None)
+            self._updates[file_id] = (event_type, download_item)
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(message)
+    
+    def publish_line(self, message):
+        """Queue a log line that is not tied to a download."""
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(message)
+    
+    def drain(self, max_lines=None):
+        """Take everything published since the last drain.
+        
+        Returns (updates, lines, dropped): the latest (event_type, item) per
+        file_id in publish order, the pending log lines (only the newest
+        max_lines of them if given) and how many lines were discarded.
+        """
+        with self._lock:
+            updates, self._updates = self._updates, collections.OrderedDict()
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped, self._dropped = self._dropped, 0
+        
+        if max_lines is not None and len(lines) > max_lines:
+            dropped += len(lines) - max_lines
+            lines = lines[-max_lines:]
+        return updates, lines, dropped
+    
+    def pending(self):
+        """Whether anything is waiting to be drained."""
+        with self._lock:
+            return bool(self._updates or self._lines or self._dropped)
+
+
+class EventBroadcaster:
+    """Fans download events out to any number of subscribers without slowing publishers.
+    
+    publish() and publish_progress() only append to a pending list under a
+    lock, so download workers pay the same small cost however many
+    subscribers there are. A dispatcher thread encodes each event once,
+    numbers it and appends it to a ring of recent events; subscribers read
+    from the ring at their own pace. Progress is coalesced to the latest
+    value per file and sent as one batch every progress_interval seconds.
+    Dispatches are at least batch_interval apart, so a burst of events wakes
+    subscribers once rather than once per event. A subscriber that falls
+    more than capacity events behind skips ahead.
+    """
+    
+    def __init__(self, capacity=10000, progress_interval=0.5, batch_interval=0.05):
+        self.progress_interval = progress_interval
+        self.batch_interval = batch_interval
+        self.logger = Logger().get_logger(__name__)
+        self._lock = threading.Lock()
+        self._pending = []  # (event_type, data) waiting to be dispatched
+        self._progress = {}  # file_id -> latest progress data
+        self._wakeup = threading.Event()
+        self._condition = threading.Condition()
+        self._ring = collections.deque(maxlen=max(1, capacity))  # (seq, encoded event)
+        self._seq = 0
+        self._running = False
+        self._thread = None
+    
+    def start(self):
+        """Start the dispatcher thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="EventBroadcaster")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        """Stop dispatching and wake every subscriber so it can return."""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        with self._condition:
+            self._condition.notify_all()
+    
+    @property
+    def running(self):
+        return self._running
+    
+    def publish(self, event_type, data=None):
+        """Queue an event for every subscriber (any thread, never blocks on subscribers)."""
+        with self._lock:
+            self._pending.append((event_type, data))
+        self._wakeup.set()
+    
+    def publish_progress(self, file_id, data):
+        """Record a download's latest progress; sent with the next progress batch."""
+        with self._lock:
+            self._progress[file_id] = data
+    
+    def last_id(self):
+        """Number of the newest dispatched event."""
+        with self._condition:
+            return self._seq
+    
+    def read(self, after_id, timeout=None):
+        """Wait up to timeout seconds for events numbered above after_id.
+        
+        Returns (events, last_id, missed): the encoded events as (id, bytes),
+        the id to pass next time and how many events were too old to return.
+        """
+        with self._condition:
+            if after_id > self._seq:
+                after_id = self._seq  # An id from before a restart; carry on from now
+            if self._seq == after_id and self._running:
+                self._condition.wait(timeout)
+            if self._seq == after_id:
+                return [], after_id, 0
+            oldest = self._ring[0][0]
+            missed = max(0, oldest - after_id - 1)
+            events = list(itertools.islice(self._ring, max(0, after_id + 1 - oldest), None))
+            return events, self._seq, missed
+    
+    def _run(self):
+        """Dispatcher: encode pending events as they arrive and progress batches on a timer."""
+        next_progress = time.monotonic() + self.progress_interval
+        while self._running:
+            self._wakeup.wait(max(0.0, next_progress - time.monotonic()))
+            # Let the rest of a burst arrive before waking every subscriber
+            time.sleep(self.batch_interval)
+            self._wakeup.clear()
+            with self._lock:
+                pending, self._pending = self._pending, []
+                progress = None
+                if time.monotonic() >= next_progress:
+                    progress, self._progress = self._progress, {}
+                    next_progress = time.monotonic() + self.progress_interval
+            
+            if progress:
+                pending.append(('progress', list(progress.values())))
+            if not pending:
+                continue
+            
+            try:
+                encoded = [(event_type, json.dumps(data, default=str)) for event_type, data in pending]
+            except Exception as e:
+                self.logger.error(f"Error encoding events: {e}")
+                continue
+            with self._condition:
+                for event_type, payload in encoded:
+                    self._seq += 1
+                    self._ring.append((self._seq, f"id: {self._seq}\nevent: {event_type}\ndata: {payload}\n\n".encode()))
+                self._condition.notify_all()
@@ -0,0 +1,204 @@
+import errno
+import os
+from logger import Logger
+
+FSYNC_POLICIES = ('none', 'completion', 'interval')
+
+# Filesystems without fallocate support report one of these; the file is then sized sparsely instead
+_FALLOCATE_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL)
+
+# Appended to a .part path for the file recording how much of a file sized up front is written and synced
+EXTENT_SUFFIX = '.written'
+
+# Smaller remainders are written without sizing the file first; there is nothing to fragment
+PREALLOCATE_MIN_SIZE = 8 * 1024 * 1024
+
+
+def _pwrite(fd, data, offset):
+    """os.pwrite, or seek-then-write where the platform lacks it (Windows)."""
+    if hasattr(os, 'pwrite'):
+        return os.pwrite(fd, data, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.write(fd, data)
+
+
+def _datasync(fd):
+    (os.fdatasync if hasattr(os, 'fdatasync') else os.fsync)(fd)
+
+
+def durable_extent(part_path):
+    """How many leading bytes of a .part file a resume can rely on.
+    
+    A file sized up front is full length from the start, so its size says
+    nothing about what was written; FileWriter records its synced extent next
+    to it instead. Any other file holds exactly the bytes written to it.
+    """
+    try:
+        with open(part_path + EXTENT_SUFFIX, 'r', encoding='utf-8') as f:
+            extent = int(f.read())
+    except FileNotFoundError:
+        return os.path.getsize(part_path)
+    except (OSError, ValueError):
+        return 0
+    return min(extent, os.path.getsize(part_path))
+
+
+class FileWriter:
+    """Positional writer for a download's temporary (.part) file.
+    
+    Opening cuts the file to its first keep bytes (zero for a fresh download,
+    the resume offset for a resumed stream, file_size for segments) and, if
+    file_size is known, preallocates the rest so the disk space is reserved
+    up front and out-of-order writes do not fragment the file. Every write
+    goes straight to the OS at an explicit offset, so there is no buffer to
+    flush before checkpointing progress.
+    
+    fsync_policy decides when data is forced to disk: 'none' leaves it to the
+    OS, 'completion' syncs once when a finished download is closed, and
+    'interval' also syncs after every fsync_interval bytes written.
+    
+    A file sized up front no longer shows by its size how much was written.
+    For those the writer also syncs every fsync_interval bytes and when an
+    unfinished download is closed, and records the extent written with
+    write() and synced in a sidecar; durable_extent() reads it back.
+    
+    A StreamHasher, if given, is told which (start, end) ranges are already
+    present (default: the kept bytes) and then sees every write.
+    """
+    
+    def __init__(self, path, file_size=0, keep=0, preallocate=True, fsync_policy='none',
+                 fsync_interval=64 * 1024 * 1024, hasher=None, present=None):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        
+        self.path = path
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = max(1, fsync_interval)
+        self.position = keep
+        self.file_size = file_size
+        self.hasher = hasher
+        self._unsynced = 0
+        self._extent_path = None
+        
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            os.ftruncate(self.fd, keep)
+            if preallocate and file_size - keep >= PREALLOCATE_MIN_SIZE:
+                self._extent_path = path + EXTENT_SUFFIX
+                self._record_extent()
+                self._preallocate(file_size)
+            else:
+                if os.path.exists(path + EXTENT_SUFFIX):
+                    os.remove(path + EXTENT_SUFFIX)
+                if preallocate and file_size == keep:
+                    self._preallocate(file_size)  # Segments: the size is set, reserve the blocks behind it
+        except BaseException:
+            os.close(self.fd)
+            raise
+        
+        if hasher is not None:
+            hasher.restart(present if present is not None else [(0, keep)])
+    
+    def _preallocate(self, file_size):
+        """Reserve file_size bytes on disk; running out of space fails here rather than mid-download."""
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self.fd, 0, file_size)
+                return
+            except OSError as e:
+                if e.errno not in _FALLOCATE_UNSUPPORTED:
+                    raise
+                Logger().get_logger(__name__).debug(f"fallocate not supported for {self.path}, sizing sparsely")
+        if os.fstat(self.fd).st_size < file_size:
+            os.ftruncate(self.fd, file_size)
+    
+    def write_at(self, offset, data):
+        """Write all of data starting at offset."""
+        view = memoryview(data)
+        total = len(view)
+        position = offset
+        while view:
+            written = _pwrite(self.fd, view, position)
+            view = view[written:]
+            position += written
+        
+        # Only after the write: the hasher may read these bytes back from the file
+        if self.hasher is not None:
+            self.hasher.update(offset, data)
+        
+        self._unsynced += total
+        if self._unsynced >= self.fsync_interval:
+            # A resume checkpoint is pointless for the write that completes the file
+            if self.fsync_policy == 'interval' or (self._extent_path and position < self.file_size):
+                self.sync()
+    
+    def write(self, data):
+        """Write data at the current position and advance past it."""
+        self.write_at(self.position, data)
+        self.position += len(data)
+    
+    def sync(self):
+        """Force written data to disk."""
+        _datasync(self.fd)
+        self._unsynced = 0
+        if self._extent_path:
+            self._record_extent()
+    
+    def _record_extent(self):
+        """Durably record the current position as the extent a resume may keep."""
+        with open(self._extent_path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(str(self.position))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self._extent_path + '.tmp', self._extent_path)
+    
+    def close(self, complete=False):
+        """Close the file, syncing it first if complete and the policy asks for it."""
+        if self.fd is None:
+            return
+        try:
+            if complete and self.fsync_policy != 'none':
+                os.fsync(self.fd)
+            elif not complete and self._extent_path:
+                self._save_progress()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+    
+    def _save_progress(self):
+        # Keep what an interrupted download wrote; failing here must not hide why it stopped
+        try:
+            self.sync()
+        except OSError as e:
+            Logger().get_logger(__name__).warning(f"Could not record progress of {self.path}: {e}")
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(complete=exc_type is None)
+
+
+def finalize_file(part_path, final_path, expected_size=None, durable=False):
+    """Atomically move a finished temporary file into place after checking its size.
+    
+    A file sized up front always passes the size check; the clients' own
+    byte counts are what catch a short download there. With durable set the
+    directory is synced too, so the rename itself survives a crash.
+    """
+    actual_size = os.path.getsize(part_path)
+    if expected_size and actual_size != expected_size:
+        raise Exception(f"Size mismatch: got {actual_size} bytes, expected {expected_size}")
+    os.replace(part_path, final_path)
+    if os.path.exists(part_path + EXTENT_SUFFIX):
+        os.remove(part_path + EXTENT_SUFFIX)
+    
+    if durable:
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(final_path)), os.O_RDONLY)
+        except OSError:
+            return  # Directories cannot be opened on Windows; the rename is as durable as it gets
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
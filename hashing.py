@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from logger import Logger
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Bytes read per call when hashing data back from the file
+READ_SIZE = 1024 * 1024
+
+# Writes up to this size are cheaper to hash in place than to hand to a worker
+INLINE_SIZE = 16 * 1024
+
+
+def new_hash(algorithm):
+    """A fresh hash object: any hashlib algorithm, or xxh64 / xxh3_64 / xxh3_128 / xxh128 with xxhash installed."""
+    if algorithm.startswith('xxh'):
+        if xxhash is None:
+            raise ValueError(f"Hash algorithm {algorithm} needs the xxhash package (pip install xxhash)")
+        if not hasattr(xxhash, algorithm):
+            raise ValueError(f"Unknown hash algorithm: {algorithm}")
+        return getattr(xxhash, algorithm)()
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}")
+
+
+class StreamHasher:
+    """Digest of a download computed from its writes on a shared worker pool.
+    
+    FileWriter reports every write with update(). Bytes that extend the
+    contiguous prefix written so far are copied and hashed on a worker
+    thread, so the network thread only pays for the copy. Everything else -
+    a resumed download's existing prefix, segments written ahead of the
+    prefix, writes made while max_pending bytes are already queued, or a
+    client that never reports writes - is read back from the file once the
+    prefix reaches it, normally straight from the page cache.
+    """
+    
+    def __init__(self, algorithm, path, executor, max_pending=16 * 1024 * 1024):
+        self.algorithm = algorithm
+        self.path = path
+        self.executor = executor
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._draining = False
+        self._closed = False
+        self._reader = None
+        self._result = None  # Future returned by finish()
+        self._reset()
+    
+    def _reset(self):
+        self._generation += 1
+        self._hash = new_hash(self.algorithm)
+        self._hashed = 0  # bytes fed to the hash so far
+        self._prefix = 0  # end of the contiguous prefix known to be on disk
+        self._starts = {}  # written ranges beyond the prefix: start -> end
+        self._ends = {}  # and end -> start
+        self._chunks = deque()  # copies of prefix writes waiting to be hashed: (offset, data)
+        self._pending = 0
+    
+    def restart(self, present=()):
+        """Start over for a newly opened file whose (start, end) ranges in present already hold data."""
+        with self._lock:
+            self._reset()
+            for start, end in present:
+                self._add_range(start, end)
+            self._schedule()
+    
+    def update(self, offset, data):
+        """Account for data just written at offset."""
+        size = len(data)
+        if not size:
+            return
+        with self._lock:
+            if offset == self._prefix:
+                if offset == self._hashed and size <= INLINE_SIZE and not self._draining:
+                    self._hash.update(data)
+                    self._hashed += size
+                elif self._pending + size <= self.max_pending:
+                    self._chunks.append((offset, bytes(data)))
+                    self._pending += size
+                self._add_range(offset, offset + size)
+                self._schedule()
+            elif offset > self._prefix:
+                self._add_range(offset, offset + size)
+            else:
+                # Bytes already counted were overwritten; hash everything again from the file
+                prefix, starts = self._prefix, self._starts
+                self._reset()
+                self._add_range(0, prefix)
+                for start, end in starts.items():
+                    self._add_range(start, end)
+                self._add_range(offset, offset + size)
+                self._schedule()
+    
+    def _add_range(self, start, end):
+        """Record [start, end) as written, merging with its neighbours and the prefix."""
+        if end <= start:
+            return
+        if start <= self._prefix:
+            self._prefix = max(self._prefix, end)
+        else:
+            start = self._ends.pop(start, start)
+            following = self._starts.pop(end, None)
+            if following is not None:
+                del self._ends[following]
+                end = following
+            self._starts[start] = end
+            self._ends[end] = start
+        
+        # Ranges the prefix has reached become part of it
+        while self._prefix in self._starts:
+            end = self._starts.pop(self._prefix)
+            del self._ends[end]
+            self._prefix = end
+    
+    def finish(self):
+        """Future for the digest ('algorithm:hex') of the file once every byte of it is hashed."""
+        with self._lock:
+            if self._result is None:
+                self._result = Future()
+                self._add_range(0, os.path.getsize(self.path))
+                self._schedule()
+            return self._result
+    
+    def close(self):
+        """Stop hashing and release the file."""
+        with self._lock:
+            self._closed = True
+            if self._result is not None and not self._result.done():
+                self._result.cancel()
+            if not self._draining:
+                self._close_reader()
+    
+    def _schedule(self):
+        # Called with the lock held; at most one drain runs per hasher, which keeps the bytes in order
+        if self._draining or self._closed:
+            return
+        if self._chunks or self._hashed < self._prefix:
+            self._draining = True
+            self.executor.submit(self._drain)
+        elif self._result is not None and not self._result.done():
+            self._result.set_result(f"{self.algorithm}:{self._hash.hexdigest()}")
+    
+    def _drain(self):
+        """Feed the hash in file order until it catches up with the prefix."""
+        try:
+            while True:
+                with self._lock:
+                    if self._closed:
+                        self._draining = False
+                        self._close_reader()
+                        return
+                    generation, digest, hashed = self._generation, self._hash, self._hashed
+                    if self._chunks and self._chunks[0][0] == hashed:
+                        data = self._chunks.popleft()[1]
+                        self._pending -= len(data)
+                        end = None
+                    else:
+                        data = None
+                        end = self._chunks[0][0] if self._chunks else self._prefix
+                    if data is None and end <= hashed:
+                        if self._result is not None and end == self._prefix:
+                            self._result.set_result(f"{self.algorithm}:{digest.hexdigest()}")
+                        self._draining = False
+                        return
+                
+                if data is None:
+                    data = self._read(hashed, min(end - hashed, READ_SIZE))
+                digest.update(data)
+                
+                with self._lock:
+                    # A restart while hashing outside the lock makes this data stale
+                    if generation == self._generation:
+                        self._hashed = hashed + len(data)
+        except Exception as e:
+            Logger().get_logger(__name__).error(f"Error hashing {self.path}: {e}")
+            with self._lock:
+                self._draining = False
+                self._close_reader()
+                if self._result is None:
+                    self._result = Future()
+                if not self._result.done():
+                    self._result.set_exception(e)
+    
+    def _read(self, offset, size):
+        if self._reader is None:
+            self._reader = open(self.path, 'rb', buffering=0)
+        self._reader.seek(offset)
+        data = self._reader.read(size)
+        if not data:
+            raise Exception(f"File ended at byte {offset} while hashing")
+        return data
+    
+    def _close_reader(self):
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
@@ -0,0 +1,355 @@
+import asyncio
+import functools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from logger import Logger
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class HttpTransport:
+    """Non-blocking, connection-pooled HTTP transport shared by all Bot API calls.
+    
+    Every method is a coroutine that can be awaited from any event loop, so the
+    per-thread loops of the thread engine and the shared asyncio engine all draw
+    from the same keep-alive connection pool.
+    """
+    
+    def __init__(self, max_connections=100, max_connections_per_host=16, read_buffer_size=65536,
+                 connect_timeout=10.0, read_timeout=60.0, keepalive_timeout=30.0):
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.read_buffer_size = read_buffer_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.logger = Logger().get_logger(__name__)
+    
+    async def get_json(self, url, params=None):
+        """GET a JSON document. Returns (status_code, parsed_body or None)."""
+        raise NotImplementedError
+    
+    async def open_stream(self, url, headers=None):
+        """Start a streaming GET and return an HttpStream once headers arrive."""
+        raise NotImplementedError
+    
+    async def close(self):
+        """Close pooled connections."""
+        raise NotImplementedError
+
+
+class HttpStream:
+    """Streaming response body returned by HttpTransport.open_stream."""
+    
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = headers
+    
+    async def read(self, size):
+        """Read up to size bytes; returns b'' at end of body."""
+        raise NotImplementedError
+    
+    async def readinto(self, buffer):
+        """Fill a writable buffer (e.g. a memoryview slice) until it is full or the body ends.
+        
+        Returns the number of bytes read, 0 at end of body. Transports
+        override this to receive without allocating a bytes object per read.
+        """
+        filled = 0
+        while filled < len(buffer):
+            data = await self.read(len(buffer) - filled)
+            if not data:
+                break
+            buffer[filled:filled + len(data)] = data
+            filled += len(data)
+        return filled
+    
+    async def close(self):
+        """Release the connection back to the pool."""
+        raise NotImplementedError
+
+
+class _ConnectionSlots:
+    """Per-host connection limit that callers wait on in their own event loop.
+    
+    RequestsTransport takes a slot before a request reaches the thread pool,
+    so a pool thread never blocks waiting for a connection that only another
+    task's pending read on the same pool could give back.
+    """
+    
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._lock = threading.Lock()
+        self._in_use = {}  # host -> slots taken
+        self._waiters = {}  # host -> deque of (loop, future)
+    
+    async def acquire(self, host):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_use.get(host, 0) < self.limit:
+                self._in_use[host] = self._in_use.get(host, 0) + 1
+                return
+            future = loop.create_future()
+            self._waiters.setdefault(host, deque()).append((loop, future))
+        
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                waiters = self._waiters.get(host)
+                if waiters and (loop, future) in waiters:
+                    waiters.remove((loop, future))
+                    raise
+            if future.done() and not future.cancelled():
+                self.release(host)  # granted just as the wait was cancelled
+            raise
+    
+    def release(self, host):
+        """Free a slot, handing it straight to the longest waiter if there is one."""
+        with self._lock:
+            waiters = self._waiters.get(host)
+            while waiters:
+                loop, future = waiters.popleft()
+                try:
+                    loop.call_soon_threadsafe(self._grant, host, future)
+                    return
+                except RuntimeError:
+                    continue  # the waiter's loop is closed
+            self._in_use[host] -= 1
+    
+    def _grant(self, host, future):
+        if future.cancelled():
+            self.release(host)
+        else:
+            future.set_result(None)
+
+
+class RequestsTransport(HttpTransport):
+    """Transport backed by a pooled requests.Session, run on a thread pool off the event loop."""
+    
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_connections,
+                              pool_maxsize=self.max_connections_per_host,
+                              pool_block=True, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_connections,
+                                            thread_name_prefix="HttpTransport")
+        self._timeout = (self.connect_timeout, self.read_timeout)
+        # With these, requests never wait inside urllib3 for pool_block's connections
+        self._slots = _ConnectionSlots(self.max_connections_per_host)
+    
+    async def _run(self, func, *args):
+        """Run a blocking call on the transport's thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+    
+    async def get_json(self, url, params=None):
+        def request():
+            response = self.session.get(url, params=params, timeout=self._timeout)
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, None
+        
+        host = urlsplit(url).netloc
+        await self._slots.acquire(host)
+        future = self._executor.submit(request)
+        # Freed when the request ends, even if the awaiting task was cancelled first
+        future.add_done_callback(lambda _: self._slots.release(host))
+        return await asyncio.wrap_future(future)
+    
+    async def open_stream(self, url, headers=None):
+        host = urlsplit(url).netloc
+        await self._slots.acquire(host)
+        future = self._executor.submit(lambda: self.session.get(url, headers=headers, stream=True,
+                                                                timeout=self._timeout))
+        try:
+            response = await asyncio.wrap_future(future)
+        except BaseException:
+            future.add_done_callback(functools.partial(self._abandon_stream, host))
+            raise
+        return _RequestsStream(self, response, host)
+    
+    def _abandon_stream(self, host, future):
+        """Close a stream nobody is waiting for any more and free its slot."""
+        try:
+            if not future.cancelled() and future.exception() is None:
+                future.result().close()
+        finally:
+            self._slots.release(host)
+    
+    async def close(self):
+        self.session.close()
+        self._executor.shutdown(wait=False)
+
+
+class _RequestsStream(HttpStream):
+    def __init__(self, transport, response, host):
+        super().__init__(response.status_code, response.headers)
+        self._transport = transport
+        self._response = response
+        self._host = host  # connection slot held until close()
+        self._pending = None  # the last read submitted to the thread pool
+    
+    def _submit(self, func, *args):
+        # Kept so close() can tell whether a read outlived the task that awaited it
+        self._pending = self._transport._executor.submit(func, *args)
+        return asyncio.wrap_future(self._pending)
+    
+    async def read(self, size):
+        return await self._submit(functools.partial(self._response.raw.read, size, decode_content=True))
+    
+    async def readinto(self, buffer):
+        return await self._submit(self._readinto, buffer)
+    
+    def _readinto(self, buffer):
+        # urllib3's own readinto reads into a new bytes object and copies it; an
+        # uncompressed body can go straight from the socket into the buffer
+        raw = self._response.raw
+        fp = getattr(raw, '_fp', None)
+        if fp is None or self.headers.get('Content-Encoding', 'identity') != 'identity':
+            data = raw.read(len(buffer), decode_content=True)
+            buffer[:len(data)] = data
+            return len(data)
+        filled = 0
+        while filled < len(buffer):
+            count = fp.readinto(buffer[filled:])
+            if not count:
+                break
+            filled += count
+        return filled
+    
+    async def close(self):
+        # Cancelling the awaiting task does not stop a read already running on the
+        # pool; let it finish (at most read_timeout) before closing the connection under it
+        if self._pending is not None and not self._pending.done():
+            await asyncio.wait([asyncio.wrap_future(self._pending)])
+        self._response.close()
+        if self._host is not None:
+            self._transport._slots.release(self._host)
+            self._host = None
+
+
+class AiohttpTransport(HttpTransport):
+    """Transport backed by one aiohttp session living on a dedicated I/O loop thread."""
+    
+    def __init__(self, **options):
+        if aiohttp is None:
+            raise ImportError("aiohttp is not installed")
+        super().__init__(**options)
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._start_lock = threading.Lock()
+    
+    def _ensure_loop(self):
+        """Start the I/O loop thread and session on first use."""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+            
+            ready = threading.Event()
+            
+            async def create_session():
+                connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                                 limit_per_host=self.max_connections_per_host,
+                                                 keepalive_timeout=self.keepalive_timeout)
+                timeout = aiohttp.ClientTimeout(total=None, connect=self.connect_timeout,
+                                                sock_read=self.read_timeout)
+                return aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                             read_bufsize=self.read_buffer_size)
+            
+            def run():
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                self._session = loop.run_until_complete(create_session())
+                self._loop = loop
+                ready.set()
+                loop.run_forever()
+                loop.close()
+            
+            self._thread = threading.Thread(target=run, name="HttpTransport")
+            self._thread.daemon = True
+            self._thread.start()
+            ready.wait()
+    
+    async def _run(self, coro):
+        """Await a coroutine on the I/O loop from whatever loop the caller is on."""
+        if asyncio.get_running_loop() is self._loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self._loop))
+    
+    async def get_json(self, url, params=None):
+        self._ensure_loop()
+        
+        async def request():
+            async with self._session.get(url, params=params) as response:
+                try:
+                    return response.status, await response.json(content_type=None)
+                except ValueError:
+                    return response.status, None
+        
+        return await self._run(request())
+    
+    async def open_stream(self, url, headers=None):
+        self._ensure_loop()
+        response = await self._run(self._session.get(url, headers=headers))
+        return _AiohttpStream(self, response)
+    
+    async def close(self):
+        if self._loop is None:
+            return
+        await self._run(self._session.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5.0)
+        self._loop = None
+
+
+class _AiohttpStream(HttpStream):
+    def __init__(self, transport, response):
+        super().__init__(response.status, response.headers)
+        self._transport = transport
+        self._response = response
+    
+    async def read(self, size):
+        return await self._transport._run(self._response.content.read(size))
+    
+    async def readinto(self, buffer):
+        # Fill the whole buffer in one trip to the I/O loop rather than one per received chunk
+        async def fill():
+            filled = 0
+            while filled < len(buffer):
+                data = await self._response.content.read(len(buffer) - filled)
+                if not data:
+                    break
+                buffer[filled:filled + len(data)] = data
+                filled += len(data)
+            return filled
+        
+        return await self._transport._run(fill())
+    
+    async def close(self):
+        async def release():
+            self._response.release()
+        
+        await self._transport._run(release())
+
+
+def create_transport(http_transport="auto", **options):
+    """Create an HTTP transport by name: auto, aiohttp or requests."""
+    if http_transport == "auto":
+        http_transport = "aiohttp" if aiohttp is not None else "requests"
+    if http_transport == "aiohttp":
+        return AiohttpTransport(**options)
+    if http_transport == "requests":
+        return RequestsTransport(**options)
+    raise ValueError(f"Unknown HTTP transport: {http_transport}")
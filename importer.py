@@ -0,0 +1,100 @@
+import csv
+import json
+from pathlib import Path
+from logger import Logger
+
+# Accepted column / key names for each download field
+FIELD_ALIASES = {
+    'file_id': ('file_id',),
+    'file_name': ('file_name', 'name'),
+    'chat_id': ('chat_id', 'chat'),
+    'message_id': ('message_id', 'message'),
+    'priority': ('priority',),
+}
+
+# Column order assumed for CSV files without a header row
+CSV_COLUMNS = ('file_id', 'file_name', 'chat_id', 'message_id', 'priority')
+
+
+def iter_download_list(path):
+    """Yield download dicts from a CSV or JSONL file list, one line at a time.
+    
+    JSONL files (.jsonl, .ndjson, or any file whose first character is '{')
+    hold one object per line. CSV files may start with a header naming their
+    columns; otherwise columns are taken in CSV_COLUMNS order. Only file_id is
+    required. Malformed lines are logged and skipped.
+    """
+    logger = Logger().get_logger(__name__)
+    path = Path(path)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        first = f.read(1)
+        f.seek(0)
+        if path.suffix.lower() in ('.jsonl', '.ndjson') or first == '{':
+            rows = _read_jsonl(f)
+        else:
+            rows = _read_csv(f)
+        
+        skipped = 0
+        for line_number, row in rows:
+            try:
+                yield normalize_download(row)
+            except (KeyError, TypeError, ValueError) as e:
+                skipped += 1
+                logger.warning(f"Skipping {path.name} line {line_number}: {e}")
+        
+        if skipped:
+            logger.warning(f"Skipped {skipped} malformed lines in {path.name}")
+
+
+def _read_jsonl(f):
+    for line_number, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as e:
+            yield line_number, e
+
+
+def _read_csv(f):
+    reader = csv.reader(f)
+    columns = None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if columns is None:
+            names = [cell.strip().lower() for cell in row]
+            columns = names if 'file_id' in names else CSV_COLUMNS
+            if columns is names:
+                continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def normalize_download(row):
+    """Map a raw row (dict) onto add_downloads fields, dropping blanks and converting numbers.
+    
+    Raises KeyError, TypeError or ValueError for rows that are not a valid download.
+    """
+    if isinstance(row, Exception):
+        raise ValueError(f"invalid JSON ({row})")
+    if not isinstance(row, dict):
+        raise TypeError("expected an object")
+    
+    download = {}
+    for field, aliases in FIELD_ALIASES.items():
+        for alias in aliases:
+            value = row.get(alias)
+            if value is not None and str(value).strip() != '':
+                download[field] = str(value).strip() if isinstance(value, str) else value
+                break
+    
+    if 'file_id' not in download:
+        raise KeyError('file_id')
+    download['file_id'] = str(download['file_id'])
+    if 'chat_id' in download:
+        download['chat_id'] = str(download['chat_id'])
+    if 'message_id' in download:
+        download['message_id'] = int(download['message_id'])
+    if 'priority' in download:
+        download['priority'] = int(download['priority'])
+    return download
@@ -1,23 +1,30 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import threading
-import asyncio
+import time
 from pathlib import Path
 import webbrowser
 from config_manager import ConfigManager
-from telegram_client import TelegramClient
-from bot_client import BotTelegramClient, DemoTelegramClient
-from download_manager import DownloadManager
+from event_bus import EventBus
+from rate_limiter import BandwidthLimiter
+from service import (create_download_manager, create_telegram_client, run_client_call, start_control_api,
+                     start_metrics_server)
 from logger import Logger
 
 class TelegramDownloadManagerGUI:
     """Main GUI application for Telegram Download Manager."""
     
+    # Columns the downloads list needs from the database
+    LIST_COLUMNS = ('id', 'file_id', 'file_name', 'status', 'progress', 'file_size')
+    
     def __init__(self):
         self.logger = Logger().get_logger(__name__)
         self.config_manager = None
         self.telegram_client = None
         self.download_manager = None
+        self.bandwidth_limiter = None
+        self.control_api = None
+        self.metrics_server = None
         
         # Create main window
         self.root = tk.Tk()
@@ -32,18 +39,32 @@ class TelegramDownloadManagerGUI:
         # Variables
         self.status_var = tk.StringVar(value="Not connected")
         self.download_path_var = tk.StringVar()
+        self.global_limit_var = tk.StringVar(value="0")
+        self.per_download_limit_var = tk.StringVar(value="0")
+        
+        # The downloads list shows the newest list_limit downloads; Show More raises it by list_page_size
+        self.list_page_size = 1000
+        self.list_limit = self.list_page_size
         
-        # File ID mapping for tree items
+        # File ID mapping for tree items (rows use the file_id as their item id)
         self.tree_file_id_map = {}
+        self._tree_rows = {}  # file_id -> (source fields, (text, values)) last rendered
         
         # Auto-refresh for speed updates
         self.refresh_job = None
         
+        # Download events are queued by worker threads and applied once per frame
+        self.event_bus = EventBus()
+        self.frame_interval = 100
+        self.log_scrollback = 1000
+        self.drain_job = None
+        
         # Initialize GUI
         self.create_gui()
         
         # Initialize application
         self.initialize_app()
+        self._drain_events()
     
     def create_gui(self):
         """Create the GUI layout."""
@@ -78,6 +99,17 @@ class TelegramDownloadManagerGUI:
         
         ttk.Button(path_frame, text="Browse", command=self.browse_download_path).grid(row=0, column=2)
         
+        ttk.Label(path_frame, text="Speed Limit (KB/s):").grid(row=1, column=0, sticky="w", pady=(10, 0))
+        limits_frame = ttk.Frame(path_frame)
+        limits_frame.grid(row=1, column=1, sticky="w", padx=(10, 10), pady=(10, 0))
+        ttk.Label(limits_frame, text="Total").pack(side="left")
+        ttk.Entry(limits_frame, textvariable=self.global_limit_var, width=8).pack(side="left", padx=(5, 15))
+        ttk.Label(limits_frame, text="Per download").pack(side="left")
+        ttk.Entry(limits_frame, textvariable=self.per_download_limit_var, width=8).pack(side="left", padx=(5, 5))
+        ttk.Label(limits_frame, text="(0 = unlimited)").pack(side="left")
+        
+        ttk.Button(path_frame, text="Apply", command=self.apply_speed_limits).grid(row=1, column=2, pady=(10, 0))
+        
         # Add download frame
         add_frame = ttk.LabelFrame(main_frame, text="Add Download", padding=10)
         add_frame.grid(row=2, column=0, columnspan=2, sticky="ew", pady=(0, 10))
@@ -88,6 +120,7 @@ class TelegramDownloadManagerGUI:
         self.file_id_entry.grid(row=0, column=1, sticky="ew", padx=(10, 10))
         
         ttk.Button(add_frame, text="Add Download", command=self.add_download).grid(row=0, column=2)
+        ttk.Button(add_frame, text="Import List...", command=self.import_downloads).grid(row=1, column=2, pady=(10, 0))
         
         ttk.Label(add_frame, text="File Name:").grid(row=1, column=0, sticky="w", pady=(10, 0))
         self.file_name_entry = ttk.Entry(add_frame)
@@ -102,6 +135,7 @@ class TelegramDownloadManagerGUI:
         
         ttk.Button(control_frame, text="Clear Finished", command=self.clear_completed).pack(side="left", padx=5)
         ttk.Button(control_frame, text="Refresh", command=self.refresh_downloads).pack(side="left", padx=5)
+        ttk.Button(control_frame, text="Show More", command=self.show_more_downloads).pack(side="left", padx=5)
         
         # Downloads list frame
         downloads_frame = ttk.LabelFrame(main_frame, text="Downloads", padding=10)
@@ -144,6 +178,9 @@ class TelegramDownloadManagerGUI:
         self.context_menu.add_command(label="Cancel", command=self.cancel_selected)
         self.context_menu.add_command(label="Remove", command=self.remove_selected)
         self.context_menu.add_separator()
+        self.context_menu.add_command(label="Increase Priority", command=lambda: self.change_selected_priority(1))
+        self.context_menu.add_command(label="Decrease Priority", command=lambda: self.change_selected_priority(-1))
+        self.context_menu.add_separator()
         self.context_menu.add_command(label="Open Folder", command=self.open_folder)
         
         self.downloads_tree.bind("<Button-3>", self.show_context_menu)
@@ -168,6 +205,17 @@ class TelegramDownloadManagerGUI:
             download_config = self.config_manager.get_download_config()
             self.download_path_var.set(download_config['download_path'])
             
+            bandwidth_config = self.config_manager.get_bandwidth_config()
+            self.bandwidth_limiter = BandwidthLimiter(**bandwidth_config)
+            self.global_limit_var.set(str(bandwidth_config['global_limit'] // 1024))
+            self.per_download_limit_var.set(str(bandwidth_config['per_download_limit'] // 1024))
+            
+            gui_config = self.config_manager.get_gui_config()
+            self.frame_interval = gui_config['frame_interval']
+            self.log_scrollback = gui_config['log_scrollback']
+            self.list_page_size = self.list_limit = gui_config['list_page_size']
+            self.event_bus = EventBus(gui_config['event_queue_size'])
+            
             self.log_message("Application initialized successfully")
             
         except Exception as e:
@@ -187,38 +235,18 @@ class TelegramDownloadManagerGUI:
                 self.root.after(0, lambda: self.status_var.set("Connecting..."))
                 self.root.after(0, lambda: self.connect_button.configure(state="disabled"))
                 
-                # Get Telegram configuration
-                telegram_config = self.config_manager.get_telegram_config()
-                
-                # Initialize appropriate client based on configuration
-                auth_type = telegram_config.get('auth_type', 'user')
-                
-                if auth_type == 'bot':
-                    self.telegram_client = BotTelegramClient(
-                        bot_token=telegram_config.get('bot_token')
-                    )
-                elif auth_type == 'demo':
-                    self.telegram_client = DemoTelegramClient()
-                else:
-                    # User authentication (API credentials)
-                    self.telegram_client = TelegramClient(
-                        api_id=telegram_config.get('api_id'),
-                        api_hash=telegram_config.get('api_hash'),
-                        phone=telegram_config.get('phone')
-                    )
-                
-                # Connect to Telegram
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                success = loop.run_until_complete(self.telegram_client.initialize())
-                loop.close()
+                # Initialize the client selected by the configuration and connect to Telegram
+                self.telegram_client = create_telegram_client(self.config_manager)
+                success = run_client_call(self.telegram_client.initialize())
                 
                 if success:
                     # Initialize download manager
-                    download_config = self.config_manager.get_download_config()
-                    self.download_manager = DownloadManager(download_config, self.telegram_client)
+                    self.download_manager = create_download_manager(self.config_manager, self.telegram_client,
+                                                                    self.bandwidth_limiter)
                     self.download_manager.add_status_callback(self.on_download_status_change)
                     self.download_manager.start_downloads()
+                    self.control_api = start_control_api(self.config_manager, self.download_manager)
+                    self.metrics_server = start_metrics_server(self.config_manager)
                     
                     self.root.after(0, lambda: self.status_var.set("Connected"))
                     self.root.after(0, lambda: self.connect_button.configure(text="Disconnect", state="normal"))
@@ -242,15 +270,19 @@ class TelegramDownloadManagerGUI:
             # Stop auto-refresh
             self.stop_auto_refresh()
             
+            if self.control_api:
+                self.control_api.stop()
+                self.control_api = None
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
+            
             if self.download_manager:
                 self.download_manager.stop_downloads()
                 self.download_manager = None
             
             if self.telegram_client:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self.telegram_client.close())
-                loop.close()
+                run_client_call(self.telegram_client.close())
                 self.telegram_client = None
             
             self.status_var.set("Disconnected")
@@ -268,6 +300,25 @@ class TelegramDownloadManagerGUI:
             if self.download_manager:
                 self.download_manager.download_path = Path(path)
     
+    def apply_speed_limits(self):
+        """Apply the speed limits entered in the settings, including to running downloads."""
+        try:
+            global_limit = int(self.global_limit_var.get() or 0)
+            per_download_limit = int(self.per_download_limit_var.get() or 0)
+            if global_limit < 0 or per_download_limit < 0:
+                raise ValueError("limits cannot be negative")
+        except ValueError as e:
+            messagebox.showwarning("Invalid Limit", f"Please enter speed limits in whole KB/s: {e}")
+            return
+        
+        if not self.bandwidth_limiter:
+            return
+        
+        self.bandwidth_limiter.set_global_limit(global_limit * 1024)
+        self.bandwidth_limiter.set_per_download_limit(per_download_limit * 1024)
+        self.log_message(f"Speed limits: total {global_limit or 'unlimited'} KB/s, "
+                         f"per download {per_download_limit or 'unlimited'} KB/s")
+    
     def add_download(self):
         """Add a new download."""
         if not self.download_manager:
@@ -295,6 +346,31 @@ class TelegramDownloadManagerGUI:
             messagebox.showerror("Error", f"Failed to add download: {e}")
             self.log_message(f"Error adding download: {e}")
     
+    def import_downloads(self):
+        """Add every download listed in a CSV or JSONL file."""
+        if not self.download_manager:
+            messagebox.showwarning("Not Connected", "Please connect to Telegram first")
+            return
+        
+        path = filedialog.askopenfilename(
+            title="Import download list",
+            filetypes=[("Download lists", "*.csv *.jsonl *.ndjson"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        
+        download_manager = self.download_manager
+        self.log_message(f"Importing downloads from {path}")
+        
+        def import_thread():
+            try:
+                # Progress is reported through the downloads_added event
+                download_manager.import_downloads(path)
+            except Exception as e:
+                self.event_bus.publish_line(f"Error importing {path}: {e}")
+        
+        threading.Thread(target=import_thread, daemon=True).start()
+    
     def toggle_pause(self):
         """Toggle pause/resume downloads."""
         if not self.download_manager:
@@ -338,39 +414,66 @@ class TelegramDownloadManagerGUI:
             messagebox.showerror("Error", error_msg)
     
     def refresh_downloads(self):
-        """Refresh the downloads list."""
+        """Refresh the downloads list, touching only rows and cells that changed.
+        
+        Rows are keyed by file_id and never rebuilt, so selection and scroll
+        position survive a refresh.
+        """
         if not self.download_manager:
             return
         
-        # Clear current items and mapping
-        for item in self.downloads_tree.get_children():
-            self.downloads_tree.delete(item)
-        self.tree_file_id_map.clear()
-        
-        # Get all downloads
-        downloads = self.download_manager.get_all_downloads()
-        
-        for download in downloads:
-            progress_text = f"{download['progress']:.1f}%" if download['progress'] else "0%"
-            size_text = self.format_file_size(download['file_size']) if download['file_size'] else "Unknown"
-            
-            # Get current download speed
-            speed_text = ""
-            if download['status'] == 'downloading' and self.download_manager:
-                speed = self.download_manager.get_download_speed(download['file_id'])
-                speed_text = self.format_speed(speed) if speed > 0 else ""
+        # Get the newest downloads, only the columns the list shows
+        downloads = self.download_manager.query_downloads(columns=self.LIST_COLUMNS, limit=self.list_limit)
+        current = {download['file_id'] for download in downloads}
+        
+        # Remove rows for downloads that are gone
+        removed = [file_id for file_id in self._tree_rows if file_id not in current]
+        if removed:
+            self.downloads_tree.delete(*removed)
+            for file_id in removed:
+                del self._tree_rows[file_id]
+                del self.tree_file_id_map[file_id]
+        
+        # Insert new rows in place and update changed cells
+        columns = self.downloads_tree["columns"]
+        for index, download in enumerate(downloads):
+            file_id = download['file_id']
+            source = (download['id'], download['file_name'], download['status'],
+                      download['progress'], download['file_size'])
+            old_source, old_row = self._tree_rows.get(file_id, (None, None))
+            if source == old_source and download['status'] != 'downloading':
+                continue  # Unchanged, and no live speed to show
             
-            # Store file_id in the item for easy retrieval
-            item_id = self.downloads_tree.insert("", "end", 
-                                     text=f"{download['id']} ({download['file_id']})",
-                                     values=(download['file_name'],
-                                            download['status'],
-                                            progress_text,
-                                            size_text,
-                                            speed_text))  # Show actual speed
-            
-            # Map tree item to file_id for easy lookup
-            self.tree_file_id_map[item_id] = download['file_id']
+            row = self._format_download_row(download)
+            if old_row is None:
+                self.downloads_tree.insert("", index, iid=file_id, text=row[0], values=row[1])
+                self.tree_file_id_map[file_id] = file_id
+            elif old_row != row:
+                if old_row[0] != row[0]:
+                    self.downloads_tree.item(file_id, text=row[0])
+                for column, old_value, value in zip(columns, old_row[1], row[1]):
+                    if old_value != value:
+                        self.downloads_tree.set(file_id, column, value)
+            self._tree_rows[file_id] = (source, row)
+    
+    def show_more_downloads(self):
+        """Extend the downloads list by another page of older downloads."""
+        self.list_limit += self.list_page_size
+        self.refresh_downloads()
+    
+    def _format_download_row(self, download):
+        """Tree text and column values for a download."""
+        progress_text = f"{download['progress']:.1f}%" if download['progress'] else "0%"
+        size_text = self.format_file_size(download['file_size']) if download['file_size'] else "Unknown"
+        
+        # Get current download speed
+        speed_text = ""
+        if download['status'] == 'downloading' and self.download_manager:
+            speed = self.download_manager.get_download_speed(download['file_id'])
+            speed_text = self.format_speed(speed) if speed > 0 else ""
+        
+        return (f"{download['id']} ({download['file_id']})",
+                (download['file_name'], download['status'], progress_text, size_text, speed_text))
     
     def start_auto_refresh(self):
         """Start automatic refresh for real-time updates."""
@@ -475,6 +578,32 @@ class TelegramDownloadManagerGUI:
             self.log_message(error_msg)
             messagebox.showerror("Error", error_msg)
     
+    def change_selected_priority(self, delta):
+        """Raise or lower the priority of the selected download."""
+        file_id = self.get_selected_file_id()
+        if not file_id:
+            messagebox.showwarning("No Selection", "Please select a download to reprioritise")
+            return
+        
+        if not self.download_manager:
+            messagebox.showwarning("Not Connected", "Please connect to Telegram first")
+            return
+        
+        try:
+            download_info = self.get_selected_download_info()
+            if not download_info:
+                messagebox.showerror("Error", "Could not find download information")
+                return
+            
+            priority = (download_info.get('priority') or 0) + delta
+            self.download_manager.set_priority(file_id, priority)
+            self.log_message(f"Priority of {download_info['file_name']} set to {priority}")
+            
+        except Exception as e:
+            error_msg = f"Error changing priority: {e}"
+            self.log_message(error_msg)
+            messagebox.showerror("Error", error_msg)
+    
     def remove_selected(self):
         """Remove selected download."""
         file_id = self.get_selected_file_id()
@@ -496,7 +625,7 @@ class TelegramDownloadManagerGUI:
             
             if result:
                 # Cancel if currently active
-                if download_info['status'] in ['downloading', 'pending']:
+                if download_info['status'] in ['downloading', 'pending', 'retrying']:
                     self.download_manager.cancel_download(file_id)
                 
                 # Remove from database
@@ -527,19 +656,46 @@ class TelegramDownloadManagerGUI:
             self.log_message(f"Error opening folder: {e}")
     
     def on_download_status_change(self, event_type, download_item):
-        """Handle download status changes."""
-        self.root.after(0, lambda: self.log_message(f"Download {event_type}: {download_item.get('file_name', 'Unknown') if download_item else ''}"))
-        self.root.after(0, self.refresh_downloads)
+        """Handle download status changes (called from worker threads)."""
+        message = None
+        if event_type == "downloads_added":
+            message = f"Added {download_item['added']} downloads ({download_item['known']} already known)"
+        self.event_bus.publish(event_type, download_item, message)
+    
+    def _drain_events(self):
+        """Apply the events published since the last frame with one refresh and one log insert."""
+        started = time.perf_counter()
+        try:
+            updates, lines, dropped = self.event_bus.drain(self.log_scrollback)
+            if dropped:
+                lines.insert(0, f"({dropped} earlier log lines dropped)")
+            if lines:
+                self._append_log(lines)
+            if updates and self.download_manager:
+                self.refresh_downloads()
+        except Exception as e:
+            self.logger.error(f"Error applying download events: {e}")
+        
+        # A frame that overran its budget pushes the next one back, so Tk input still gets through
+        elapsed_ms = int((time.perf_counter() - started) * 1000)
+        self.drain_job = self.root.after(max(self.frame_interval, 2 * elapsed_ms), self._drain_events)
     
     def log_message(self, message):
         """Add message to log."""
+        self._append_log([message])
+    
+    def _append_log(self, lines):
+        """Append lines to the log in one insert, keeping at most log_scrollback lines."""
         self.log_text.configure(state="normal")
-        self.log_text.insert(tk.END, f"{message}\n")
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - self.log_scrollback
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
         self.log_text.configure(state="disabled")
         self.log_text.see(tk.END)
         
         # Update status bar
-        self.status_bar.configure(text=message)
+        self.status_bar.configure(text=lines[-1])
     
     def format_file_size(self, size_bytes):
         """Format file size in human readable format."""
@@ -568,15 +724,22 @@ class TelegramDownloadManagerGUI:
         try:
             # Stop auto-refresh
             self.stop_auto_refresh()
+            if self.drain_job is not None:
+                self.root.after_cancel(self.drain_job)
+                self.drain_job = None
+            
+            if self.control_api:
+                self.control_api.stop()
+                self.control_api = None
+            if self.metrics_server:
+                self.metrics_server.stop()
+                self.metrics_server = None
             
             if self.download_manager:
                 self.download_manager.stop_downloads()
             
             if self.telegram_client:
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(self.telegram_client.close())
-                loop.close()
+                run_client_call(self.telegram_client.close())
                 
         except Exception as e:
             self.logger.error(f"Error during cleanup: {e}")
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from logger import Logger
+
+class MetadataPrefetcher:
+    """Resolves file metadata (getFile) for queued downloads ahead of the workers.
+    
+    Runs a small pool of coroutines on its own event loop thread. Each result
+    primes the client's file info cache, so a worker can start streaming as
+    soon as it picks the download up. It is also handed to on_resolved and
+    written back to the database in batches.
+    
+    Only the first lookahead downloads of download_queue are looked up, and
+    lookups in flight plus results for downloads still among them are kept to
+    lookahead. That leaves the shared getFile budget to the workers and keeps
+    results from expiring before they are used. The owner calls started() as
+    downloads leave the queue, and the window is refilled a few at a time.
+    """
+    
+    def __init__(self, telegram_client, database, download_queue, on_resolved=None, concurrency=4,
+                 lookahead=16, resolved_ttl=None, flush_interval=1.0, batch_size=200):
+        self.telegram_client = telegram_client
+        self.database = database
+        self.download_queue = download_queue
+        self.on_resolved = on_resolved
+        self.concurrency = max(1, concurrency)
+        self.lookahead = max(1, lookahead)
+        self.refill = max(1, self.lookahead // 4)
+        self.resolved_ttl = resolved_ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.logger = Logger().get_logger(__name__)
+        
+        self._lock = threading.Lock()
+        self._submitted = set()
+        self._resolved = {}  # file_id -> when its lookup finished (failed ones too)
+        self._backlog = []  # file_ids submitted before the loop is running
+        self._results = []  # (file_size, file_unique_id, file_id) waiting to be written
+        
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._stopping = None
+    
+    def start(self):
+        """Start the resolver loop thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="MetadataPrefetcher")
+        self._thread.daemon = True
+        self._thread.start()
+        ready.wait()
+    
+    def stop(self):
+        """Stop resolving and write out any results still buffered."""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stopping.set)
+            except RuntimeError:
+                pass  # Loop already closed
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+    
+    def started(self, file_id):
+        """Note that a download left the queue (started or removed); refill once enough room is free."""
+        with self._lock:
+            prefetched = self._resolved.pop(file_id, None) is not None
+            room = self._room()
+        # One that was not looked up ahead means the queue order moved past the window
+        if room >= self.refill or not prefetched:
+            self.top_up()
+    
+    def top_up(self):
+        """Look up the front of the queue, up to lookahead lookups and unstarted results."""
+        file_ids = [item['file_id'] for item in self.download_queue.peek(self.lookahead)]
+        head = set(file_ids)
+        with self._lock:
+            # Results for downloads that left the front (started, removed or outranked) stop counting
+            for file_id in [file_id for file_id in self._resolved if file_id not in head]:
+                del self._resolved[file_id]
+            fresh = [file_id for file_id in file_ids
+                     if file_id not in self._submitted and file_id not in self._resolved][:max(0, self._room())]
+            self._submitted.update(fresh)
+            loop = self._loop
+            if loop is None:
+                self._backlog.extend(fresh)
+                return
+        
+        if fresh:
+            try:
+                loop.call_soon_threadsafe(self._enqueue_all, fresh)
+            except RuntimeError:
+                pass  # Stopped; workers resolve these themselves
+    
+    def _room(self):
+        """Lookups that can start now. Called with the lock held."""
+        if self.resolved_ttl is not None:
+            # Results whose link may have expired are looked up again if still queued
+            now = time.monotonic()
+            for file_id in [file_id for file_id, resolved_at in self._resolved.items()
+                            if now - resolved_at >= self.resolved_ttl]:
+                del self._resolved[file_id]
+        return self.lookahead - len(self._submitted) - len(self._resolved)
+    
+    def flush(self):
+        """Write buffered metadata to the database."""
+        with self._lock:
+            results, self._results = self._results, []
+        if results:
+            self.database.update_file_metadata_many(results)
+    
+    def _enqueue_all(self, file_ids):
+        for file_id in file_ids:
+            self._queue.put_nowait(file_id)
+    
+    def _run(self, ready):
+        """Thread body: own the loop and run the resolvers until stopped."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        with self._lock:
+            backlog, self._backlog = self._backlog, []
+            self._loop = loop
+        self._enqueue_all(backlog)
+        ready.set()
+        self.top_up()
+        
+        try:
+            loop.run_until_complete(self._resolve_all())
+        except Exception as e:
+            self.logger.error(f"Error in metadata prefetcher: {e}")
+        finally:
+            with self._lock:
+                self._loop = None
+                # Lookups still queued died with the loop; the next top_up() submits them again
+                self._submitted.clear()
+            loop.close()
+    
+    async def _resolve_all(self):
+        workers = [asyncio.ensure_future(self._resolver()) for _ in range(self.concurrency)]
+        last_flush = time.monotonic()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                if self._results and time.monotonic() - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = time.monotonic()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    
+    async def _resolver(self):
+        """Resolve queued file_ids one at a time."""
+        while True:
+            file_id = await self._queue.get()
+            try:
+                file_info = await self.telegram_client.get_file_info(file_id)
+            except Exception as e:
+                # Not fatal: the worker calls getFile itself when the download starts
+                self.logger.warning(f"Could not prefetch metadata for {file_id}: {e}")
+                file_info = None
+            finally:
+                with self._lock:
+                    self._submitted.discard(file_id)
+            
+            with self._lock:
+                # Failures count as done too, so they are not looked up again while queued
+                self._resolved[file_id] = time.monotonic()
+                if file_info is not None:
+                    self._results.append((file_info.get('file_size'), file_info.get('file_unique_id'), file_id))
+                should_flush = len(self._results) >= self.batch_size
+            if should_flush:
+                self.flush()
+            
+            if file_info is not None and self.on_resolved:
+                try:
+                    self.on_resolved(file_id, file_info)
+                except Exception as e:
+                    self.logger.error(f"Error handling prefetched metadata for {file_id}: {e}")
@@ -0,0 +1,363 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logger import Logger
+
+# Latency buckets in seconds, from sub-millisecond database writes to multi-minute streams
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base for a named metric family; labelled children are created on first use."""
+    
+    type_name = None
+    child_methods = ()
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}  # label values -> child
+        # Unlabelled metrics expose their single child's methods directly for the hot path
+        self._unlabelled = None if self.labelnames else self.labels()
+        if self._unlabelled is not None:
+            for method in self.child_methods:
+                setattr(self, method, getattr(self._unlabelled, method))
+    
+    def labels(self, *values, **kwargs):
+        """The child for the given label values (positional or by name)."""
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def _default(self):
+        if self._unlabelled is None:
+            raise ValueError(f"{self.name} needs label values: {', '.join(self.labelnames)}")
+        return self._unlabelled
+    
+    def render(self):
+        """The family in Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _ThreadCells:
+    """Per-thread lists of numbers, summed on read.
+    
+    Each thread only ever updates its own cell, so updates need no lock;
+    the lock is taken once per thread to register the cell and when reading.
+    Cells of threads that have ended (such as control API request threads)
+    are folded into a shared base and dropped, so they do not pile up.
+    """
+    
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cells = {}  # thread -> its cell
+        self._base = [0] * size  # totals of threads that have ended
+    
+    def cell(self):
+        """The calling thread's cell."""
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0] * self.size
+            with self._lock:
+                self._fold()
+                self._cells[threading.current_thread()] = cell
+            return cell
+    
+    def _fold(self):
+        # Called with the lock held; a finished thread can no longer change its cell
+        for thread in [thread for thread in self._cells if not thread.is_alive()]:
+            for i, value in enumerate(self._cells.pop(thread)):
+                self._base[i] += value
+    
+    def totals(self):
+        """Element-wise sum over every thread's cell."""
+        with self._lock:
+            self._fold()
+            cells = [self._base] + list(self._cells.values())
+        return [sum(values) for values in zip(*cells)]
+
+
+class _CounterChild:
+    def __init__(self):
+        self._cells = _ThreadCells(1)
+    
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+    
+    @property
+    def value(self):
+        return self._cells.totals()[0]
+    
+    def render(self, name, labelnames, values):
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+    
+    type_name = 'counter'
+    child_methods = ('inc',)
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+    
+    def set(self, value):
+        self.value = value
+    
+    def set_function(self, function):
+        """Read the value from function() at scrape time."""
+        self.function = function
+    
+    def render(self, name, labelnames, values):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []  # Source is gone (e.g. its download manager was stopped)
+        return [f"{name}{_format_labels(labelnames, values)} {_format_value(value)}"]
+
+
+class Gauge(Metric):
+    """Value that can go up and down, set directly or sampled from a function at scrape time."""
+    
+    type_name = 'gauge'
+    child_methods = ('set', 'set_function')
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def set(self, value):
+        self._default().set(value)
+    
+    def set_function(self, function):
+        self._default().set_function(function)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One count per bucket, then +Inf, then the sum of observations
+        self._cells = _ThreadCells(len(buckets) + 2)
+    
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+    
+    def time(self):
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self)
+    
+    def render(self, name, labelnames, values):
+        totals = self._cells.totals()
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), totals[:-1]):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, [('le', _format_value(float(bound)))])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(float(totals[-1]))}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Histogram(Metric):
+    """Distribution of observed values (seconds unless the name says otherwise)."""
+    
+    type_name = 'histogram'
+    child_methods = ('observe', 'time')
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value):
+        self._default().observe(value)
+    
+    def time(self):
+        return self._default().time()
+
+
+class MetricsRegistry:
+    """Collection of metric families rendered together for a scrape."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+    
+    def register(self, metric):
+        """Add a metric family, or return the one already registered under its name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def render(self):
+        """All metrics in Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Download manager
+QUEUE_DEPTH = REGISTRY.gauge('tdm_queue_depth', 'Downloads waiting for a slot')
+ACTIVE_DOWNLOADS = REGISTRY.gauge('tdm_active_downloads', 'Downloads currently running')
+RETRYING_DOWNLOADS = REGISTRY.gauge('tdm_retrying_downloads', 'Failed downloads waiting out their backoff')
+CONCURRENCY_LIMIT = REGISTRY.gauge('tdm_concurrency_limit', 'Download slots currently allowed')
+DOWNLOAD_THROUGHPUT = REGISTRY.gauge('tdm_download_throughput_bytes_per_second',
+                                     'Combined current speed of running downloads')
+DOWNLOADED_BYTES = REGISTRY.counter('tdm_downloaded_bytes_total', 'Bytes received by all downloads')
+DOWNLOADS_FINISHED = REGISTRY.counter('tdm_downloads_finished_total',
+                                      'Downloads that completed, were copied from identical content or failed for good',
+                                      ('result',))
+DOWNLOAD_RETRIES = REGISTRY.counter('tdm_download_retries_total', 'Failed download attempts scheduled for retry',
+                                    ('error_class',))
+TIME_TO_FIRST_BYTE = REGISTRY.histogram('tdm_time_to_first_byte_seconds',
+                                        'From starting a download attempt to its first progress report')
+STREAM_SECONDS = REGISTRY.histogram('tdm_stream_seconds', 'Time spent transferring each download attempt')
+
+# Bot API client
+API_CALL_SECONDS = REGISTRY.histogram('tdm_api_call_seconds', 'Bot API call latency (excluding budget waits)',
+                                      ('method',))
+API_RATE_LIMITED = REGISTRY.counter('tdm_api_rate_limited_total', 'Bot API calls answered with HTTP 429',
+                                    ('method',))
+
+# Database
+DB_WRITE_SECONDS = REGISTRY.histogram('tdm_db_write_seconds', 'Duration of database write transactions')
+DB_LOCK_WAIT_SECONDS = REGISTRY.histogram('tdm_db_lock_wait_seconds',
+                                          'Time spent waiting for the database writer lock')
+
+
+def error_class(error):
+    """Coarse, low-cardinality label for why a download attempt failed."""
+    message = str(error)
+    if getattr(error, 'retry_after', None) is not None:
+        return 'flood_wait'
+    if 'HTTP 429' in message:
+        return 'rate_limited'
+    if isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__:
+        return 'timeout'
+    if isinstance(error, (ConnectionError, OSError)) or 'Connection' in type(error).__name__ or 'Connection' in message:
+        return 'network'
+    if message.startswith('HTTP '):
+        return 'http'
+    return 'other'
+
+
+class MetricsServer:
+    """Serves a registry at /metrics in Prometheus text format on a background thread."""
+    
+    def __init__(self, registry=REGISTRY, host='127.0.0.1', port=9464):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.logger = Logger().get_logger(__name__)
+        self._server = None
+        self._thread = None
+    
+    def start(self):
+        """Start serving."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        registry = self.registry
+        
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MetricsServer")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+    
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
@@ -0,0 +1,80 @@
+import threading
+from logger import Logger
+
+class ProgressJournal:
+    """Write-behind buffer that coalesces download progress into batched database writes."""
+    
+    def __init__(self, database, flush_interval=1.0, flush_bytes=4 * 1024 * 1024):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.logger = Logger().get_logger(__name__)
+        
+        # Only the latest (progress, downloaded_bytes) per file_id is kept
+        self._pending = {}
+        self._last_bytes = {}  # file_id -> downloaded_bytes last recorded
+        self._unflushed_bytes = 0
+        self._lock = threading.Lock()
+        
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start the background flusher that bounds how stale the database can get."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="ProgressJournal")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def close(self):
+        """Stop the background flusher and write out everything still buffered."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+    
+    def record(self, file_id, progress, downloaded_bytes):
+        """Record the latest progress for a download, flushing if the byte threshold is hit."""
+        with self._lock:
+            last_bytes = self._last_bytes.get(file_id, 0)
+            self._unflushed_bytes += max(0, downloaded_bytes - last_bytes)
+            self._last_bytes[file_id] = downloaded_bytes
+            self._pending[file_id] = (progress, downloaded_bytes)
+            should_flush = self._unflushed_bytes >= self.flush_bytes
+        
+        if should_flush:
+            self.flush()
+    
+    def flush(self, file_id=None):
+        """Write buffered progress to the database, for one download or all of them."""
+        with self._lock:
+            if file_id is not None:
+                entry = self._pending.pop(file_id, None)
+                updates = [(entry[0], entry[1], file_id)] if entry else []
+            else:
+                updates = [(progress, downloaded, fid)
+                           for fid, (progress, downloaded) in self._pending.items()]
+                self._pending = {}
+                self._unflushed_bytes = 0
+        
+        if updates:
+            self.database.update_download_progress_many(updates)
+    
+    def discard(self, file_id):
+        """Forget a download's tracking state once it is no longer active."""
+        with self._lock:
+            self._pending.pop(file_id, None)
+            self._last_bytes.pop(file_id, None)
+    
+    def _flush_loop(self):
+        """Flush buffered progress at least once per flush interval."""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                if self._pending:
+                    self.flush()
+            except Exception as e:
+                self.logger.error(f"Error flushing progress journal: {e}")
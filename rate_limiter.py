@@ -0,0 +1,197 @@
+import asyncio
+import threading
+import time
+from logger import Logger
+
+class TokenBucket:
+    """Thread-safe token bucket measured in bytes; a rate of 0 means unlimited.
+    
+    Consumption is debt based: take() always succeeds and lets the balance go
+    negative, returning how long the caller must wait for the debt to be repaid.
+    Callers can therefore account for every chunk but only sleep once the debt
+    is worth sleeping for, which keeps the average rate exact at any chunk size.
+    """
+    
+    def __init__(self, rate=0, burst=None):
+        self._lock = threading.Lock()
+        self.rate = 0
+        self.burst = 0
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.set_rate(rate, burst)
+        self._tokens = float(self.burst)
+    
+    def set_rate(self, rate, burst=None):
+        """Change the rate (bytes/sec) and burst size (bytes, default a quarter second of rate)."""
+        with self._lock:
+            self._refill()
+            self.rate = max(0, rate or 0)
+            self.burst = burst if burst is not None else max(64 * 1024, self.rate // 4)
+            self._tokens = min(self._tokens, self.burst)
+    
+    def take(self, amount):
+        """Consume amount bytes and return the seconds until the balance is back to zero."""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            self._refill()
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+    
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class BandwidthLimiter:
+    """Global, per-download and per-chat bandwidth caps shared by every download.
+    
+    Each download gets a throttle coroutine from throttle_for(); clients await it
+    with the size of every chunk they receive. All limits are in bytes/sec and
+    can be changed at runtime; 0 disables a limit.
+    """
+    
+    def __init__(self, global_limit=0, per_download_limit=0, chat_limits=None, min_sleep=0.01):
+        self.logger = Logger().get_logger(__name__)
+        self.min_sleep = min_sleep
+        self.per_download_limit = per_download_limit
+        self.global_bucket = TokenBucket(global_limit)
+        self._lock = threading.Lock()
+        self._download_buckets = {}  # file_id -> TokenBucket
+        self._chat_buckets = {str(chat_id): TokenBucket(limit) for chat_id, limit in (chat_limits or {}).items()}
+    
+    def set_global_limit(self, limit):
+        """Change the cap on all downloads combined."""
+        self.global_bucket.set_rate(limit)
+        self.logger.info(f"Global bandwidth limit set to {limit or 'unlimited'} B/s")
+    
+    def set_per_download_limit(self, limit):
+        """Change the cap on each individual download, including ones in progress."""
+        with self._lock:
+            self.per_download_limit = limit
+            for bucket in self._download_buckets.values():
+                bucket.set_rate(limit)
+        self.logger.info(f"Per-download bandwidth limit set to {limit or 'unlimited'} B/s")
+    
+    def set_chat_limit(self, chat_id, limit):
+        """Change the cap shared by all downloads from one chat."""
+        with self._lock:
+            bucket = self._chat_buckets.get(str(chat_id))
+            if bucket is None:
+                self._chat_buckets[str(chat_id)] = TokenBucket(limit)
+            else:
+                bucket.set_rate(limit)
+        self.logger.info(f"Bandwidth limit for chat {chat_id} set to {limit or 'unlimited'} B/s")
+    
+    def get_limits(self):
+        """Current limits as a dict."""
+        with self._lock:
+            return {
+                'global_limit': self.global_bucket.rate,
+                'per_download_limit': self.per_download_limit,
+                'chat_limits': {chat_id: bucket.rate for chat_id, bucket in self._chat_buckets.items()}
+            }
+    
+    def throttle_for(self, file_id, chat_id=None):
+        """Return the throttle coroutine a client awaits with each received chunk size."""
+        with self._lock:
+            download_bucket = self._download_buckets.get(file_id)
+            if download_bucket is None:
+                download_bucket = self._download_buckets[file_id] = TokenBucket(self.per_download_limit)
+            chat_bucket = self._chat_buckets.get(str(chat_id)) if chat_id is not None else None
+        
+        buckets = [bucket for bucket in (self.global_bucket, download_bucket, chat_bucket) if bucket is not None]
+        
+        async def throttle(nbytes):
+            # Every bucket is charged; the slowest one decides how long to wait.
+            # Short waits are skipped because the debt carries over to the next chunk.
+            delay = max(bucket.take(nbytes) for bucket in buckets)
+            if delay >= self.min_sleep:
+                await asyncio.sleep(delay)
+        
+        return throttle
+    
+    def release(self, file_id):
+        """Forget a finished download's bucket."""
+        with self._lock:
+            self._download_buckets.pop(file_id, None)
+
+
+class FloodWaitError(Exception):
+    """Raised when the Bot API keeps answering 429 for longer than we are willing to wait."""
+    
+    status = 429
+    
+    def __init__(self, method, retry_after):
+        super().__init__(f"Flood control on {method}: retry after {retry_after}s (HTTP 429)")
+        self.method = method
+        self.retry_after = retry_after
+
+
+class ApiRateLimiter:
+    """Shared per-method call budgets for the Bot API that honour flood-control pauses.
+    
+    Every method (call class) has its own token bucket in calls/sec and its own
+    pause deadline, so a 429 on getFile holds back further getFile calls for
+    retry_after seconds without touching other methods or file streams that
+    are already running. Safe to share between event loops on different threads.
+    """
+    
+    def __init__(self, default_rate=30, method_rates=None, max_flood_wait=60, flood_retries=3):
+        self.logger = Logger().get_logger(__name__)
+        self.default_rate = default_rate
+        self.method_rates = dict(method_rates or {})
+        self.max_flood_wait = max_flood_wait
+        self.flood_retries = max(0, flood_retries)
+        self._lock = threading.Lock()
+        self._buckets = {}  # method -> TokenBucket
+        self._paused_until = {}  # method -> time.monotonic() deadline
+        self._stats = {}  # method -> counters
+    
+    async def acquire(self, method):
+        """Wait until a call to method fits its budget and no flood pause is active."""
+        bucket, stats = self._get_method(method)
+        waited = 0.0
+        while True:
+            with self._lock:
+                pause = self._paused_until.get(method, 0) - time.monotonic()
+            if pause <= 0:
+                break
+            waited += pause
+            await asyncio.sleep(pause)
+        
+        delay = bucket.take(1)
+        if delay > 0:
+            waited += delay
+            await asyncio.sleep(delay)
+        
+        with self._lock:
+            stats['calls'] += 1
+            if waited:
+                stats['deferred'] += 1
+                stats['deferred_seconds'] += waited
+    
+    def pause(self, method, retry_after):
+        """Hold back calls to method for retry_after seconds after a 429."""
+        _, stats = self._get_method(method)
+        with self._lock:
+            self._paused_until[method] = max(self._paused_until.get(method, 0),
+                                             time.monotonic() + retry_after)
+            stats['throttled'] += 1
+        self.logger.warning(f"Flood control on {method}: pausing for {retry_after}s")
+    
+    def get_stats(self):
+        """Per-method counters: calls made, deferred (had to wait) and throttled (429s received)."""
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._stats.items()}
+    
+    def _get_method(self, method):
+        with self._lock:
+            bucket = self._buckets.get(method)
+            if bucket is None:
+                rate = self.method_rates.get(method, self.default_rate)
+                bucket = self._buckets[method] = TokenBucket(rate, burst=1)
+                self._stats[method] = {'calls': 0, 'deferred': 0, 'deferred_seconds': 0.0, 'throttled': 0}
+            return bucket, self._stats[method]
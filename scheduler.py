@@ -0,0 +1,284 @@
+import heapq
+import itertools
+import math
+import queue
+import threading
+import time
+from logger import Logger
+
+class DownloadScheduler:
+    """Thread-safe download queue ordered by a pluggable sort key.
+    
+    Drop-in replacement for queue.Queue in DownloadManager: get() raises
+    queue.Empty on timeout. Items are download dicts keyed by file_id, so
+    re-queueing a file replaces its old entry and queued items can be
+    removed or reprioritised in place.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._heap = []
+        self._entries = {}  # file_id -> [key, seq, item]
+        self._counter = itertools.count()
+        self._listeners = []
+    
+    def _sort_key(self, item):
+        """Return the heap key for an item; smaller keys are dispatched first."""
+        raise NotImplementedError
+    
+    def add_listener(self, callback):
+        """Call callback() whenever new work is queued."""
+        self._listeners.append(callback)
+    
+    def put(self, item):
+        """Queue a download item."""
+        self.put_many([item])
+    
+    def put_many(self, items):
+        """Queue several download items with a single wakeup."""
+        with self._lock:
+            for item in items:
+                item.setdefault('queued_at', time.time())
+                self._push(item)
+            self._not_empty.notify_all()
+        
+        for callback in self._listeners:
+            callback()
+    
+    def get(self, timeout=None):
+        """Remove and return the next item, waiting up to timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._not_empty:
+            while True:
+                item = self._pop()
+                if item is not None:
+                    return item
+                
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Empty
+                self._not_empty.wait(remaining)
+    
+    def get_nowait(self):
+        """Remove and return the next item, or raise queue.Empty."""
+        with self._lock:
+            item = self._pop()
+        if item is None:
+            raise queue.Empty
+        return item
+    
+    def task_done(self):
+        """Kept for queue.Queue compatibility."""
+    
+    def remove(self, file_id):
+        """Drop a queued download. Returns the removed item, or None."""
+        with self._lock:
+            entry = self._entries.pop(file_id, None)
+            if entry is None:
+                return None
+            item, entry[2] = entry[2], None
+            return item
+    
+    def update(self, file_id, **fields):
+        """Change fields of a queued item (e.g. priority, file_size) and re-sort it."""
+        with self._lock:
+            entry = self._entries.get(file_id)
+            if entry is None:
+                return False
+            entry[2].update(fields)
+            # Re-sort only if the key moved, so an unchanged item keeps its place among equals
+            if self._sort_key(entry[2]) != entry[0]:
+                item, entry[2] = entry[2], None
+                self._push(item)
+            return True
+    
+    def reprioritize(self, file_id, priority):
+        """Change the priority of a queued download in place."""
+        return self.update(file_id, priority=priority)
+    
+    def peek(self, count):
+        """Up to count queued items in the order get() would return them, left queued."""
+        with self._lock:
+            heap = self._heap
+            items = []
+            skipped = 0
+            # Best-first walk down the heap, so only about count entries are visited
+            frontier = [(heap[0], 0)] if heap else []
+            while frontier and len(items) < count:
+                entry, index = heapq.heappop(frontier)
+                if entry[2] is not None:
+                    items.append(entry[2])
+                else:
+                    skipped += 1
+                for child in (2 * index + 1, 2 * index + 2):
+                    if child < len(heap):
+                        heapq.heappush(frontier, (heap[child], child))
+            
+            if skipped > max(64, count):
+                # Superseded entries sorting ahead of live ones would slow every peek; drop them all
+                self._heap = [entry for entry in heap if entry[2] is not None]
+                heapq.heapify(self._heap)
+            return items
+    
+    def qsize(self):
+        """Number of queued downloads."""
+        with self._lock:
+            return len(self._entries)
+    
+    def empty(self):
+        """Whether nothing is queued."""
+        return self.qsize() == 0
+    
+    def _push(self, item):
+        old = self._entries.get(item['file_id'])
+        if old is not None:
+            old[2] = None  # Superseded; skipped when popped
+        entry = [self._sort_key(item), next(self._counter), item]
+        self._entries[item['file_id']] = entry
+        heapq.heappush(self._heap, entry)
+    
+    def _pop(self):
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            item = entry[2]
+            if item is not None:
+                del self._entries[item['file_id']]
+                return item
+        return None
+
+
+class FifoScheduler(DownloadScheduler):
+    """Dispatch downloads in the order they were queued."""
+    
+    def _sort_key(self, item):
+        return item['queued_at']
+
+
+class PriorityScheduler(DownloadScheduler):
+    """Priority first, then shortest job first, with aging so large files cannot starve.
+    
+    An item's score is
+        priority + waited_seconds / aging_interval - size_weight * log2(1 + size_in_MiB)
+    and the highest score runs next. Because every queued item ages at the same
+    rate, the ordering only depends on when an item was queued, so the key is
+    fixed at push time and a plain heap stays correct as time passes.
+    
+    A download whose size is not known yet is scored as UNKNOWN_SIZE, so ones
+    already resolved are not overtaken by those still waiting for metadata.
+    """
+    
+    UNKNOWN_SIZE = 2000 * 1024 * 1024  # Largest file the Bot API serves (local server)
+    
+    def __init__(self, aging_interval=300.0, size_weight=1.0):
+        super().__init__()
+        self.aging_interval = aging_interval
+        self.size_weight = size_weight
+    
+    def _sort_key(self, item):
+        size_mib = (item.get('file_size') or self.UNKNOWN_SIZE) / (1024 * 1024)
+        score = (item.get('priority') or 0) - self.size_weight * math.log2(1 + size_mib)
+        return item['queued_at'] / self.aging_interval - score
+
+
+def create_scheduler(policy="priority", aging_interval=300.0, size_weight=1.0):
+    """Create a scheduler by policy name: priority or fifo."""
+    if policy == "priority":
+        return PriorityScheduler(aging_interval, size_weight)
+    if policy == "fifo":
+        return FifoScheduler()
+    raise ValueError(f"Unknown scheduler policy: {policy}")
+
+
+class RetryScheduler:
+    """Timer heap that holds failed downloads until their retry deadline.
+    
+    Failed items are parked here instead of sleeping on a worker, and are
+    handed to release_callback (normally the download queue) once their
+    deadline, in epoch seconds, has passed.
+    """
+    
+    def __init__(self, release_callback):
+        self.release_callback = release_callback
+        self.logger = Logger().get_logger(__name__)
+        self._condition = threading.Condition()
+        self._heap = []
+        self._entries = {}  # file_id -> [deadline, seq, item]
+        self._counter = itertools.count()
+        self._running = False
+        self._thread = None
+    
+    def start(self):
+        """Start the timer thread."""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        
+        self._thread = threading.Thread(target=self._run, name="RetryScheduler")
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def stop(self):
+        """Stop the timer thread; parked items stay persisted for the next start."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+    
+    def schedule(self, item, deadline):
+        """Release item once time.time() reaches deadline."""
+        with self._condition:
+            old = self._entries.get(item['file_id'])
+            if old is not None:
+                old[2] = None
+            entry = [deadline, next(self._counter), item]
+            self._entries[item['file_id']] = entry
+            heapq.heappush(self._heap, entry)
+            self._condition.notify_all()
+    
+    def cancel(self, file_id):
+        """Forget a parked download. Returns its item, or None."""
+        with self._condition:
+            entry = self._entries.pop(file_id, None)
+            if entry is None:
+                return None
+            item, entry[2] = entry[2], None
+            return item
+    
+    def pending_count(self):
+        """Number of downloads waiting for their retry deadline."""
+        with self._condition:
+            return len(self._entries)
+    
+    def _run(self):
+        """Sleep until the earliest deadline, then release every item that is due."""
+        while True:
+            due = []
+            with self._condition:
+                while self._running:
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                    
+                    now = time.time()
+                    while self._heap and self._heap[0][0] <= now:
+                        entry = heapq.heappop(self._heap)
+                        if entry[2] is not None:
+                            del self._entries[entry[2]['file_id']]
+                            due.append(entry[2])
+                    if due:
+                        break
+                    
+                    timeout = self._heap[0][0] - now if self._heap else None
+                    self._condition.wait(timeout)
+                
+                if not self._running:
+                    return
+            
+            for item in due:
+                try:
+                    self.release_callback(item)
+                except Exception as e:
+                    self.logger.error(f"Error releasing retry for {item['file_id']}: {e}")
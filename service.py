@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Headless service for Telegram Download Manager.
+Runs the download core without a display: python service.py [--import list.csv]
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+import threading
+import time
+from config_manager import ConfigManager
+from database import Database
+from download_manager import DownloadManager
+from rate_limiter import ApiRateLimiter, BandwidthLimiter
+from logger import Logger
+
+
+def create_telegram_client(config_manager):
+    """Create the Telegram client selected by the [telegram] section (bot, demo or user)."""
+    telegram_config = config_manager.get_telegram_config()
+    auth_type = telegram_config.get('auth_type', 'user')
+    
+    # Every client writes files through a FileWriter with these settings
+    download_config = config_manager.get_download_config()
+    writer_options = {
+        'preallocate': download_config['preallocate'],
+        'fsync_policy': download_config['fsync_policy'],
+        'fsync_interval': download_config['fsync_interval']
+    }
+    
+    # Client modules are imported on demand so only the one in use is loaded
+    if auth_type == 'bot':
+        from bot_client import BotTelegramClient
+        from http_transport import create_transport
+        return BotTelegramClient(
+            bot_token=telegram_config.get('bot_token'),
+            api_url=telegram_config.get('api_url'),
+            transport=create_transport(**config_manager.get_network_config()),
+            segments=download_config['segments'],
+            min_segment_size=download_config['min_segment_size'],
+            chunk_size=download_config['chunk_size'],
+            min_chunk_size=download_config['min_chunk_size'],
+            adaptive_chunk_size=download_config['adaptive_chunk_size'],
+            writer_options=writer_options,
+            api_limiter=ApiRateLimiter(**config_manager.get_api_limits_config())
+        )
+    if auth_type == 'demo':
+        from bot_client import DemoTelegramClient
+        return DemoTelegramClient(writer_options=writer_options)
+    
+    # User authentication (API credentials)
+    from telegram_client import TelegramClient
+    return TelegramClient(
+        api_id=telegram_config.get('api_id'),
+        api_hash=telegram_config.get('api_hash'),
+        phone=telegram_config.get('phone'),
+        writer_options=writer_options
+    )
+
+
+def run_client_call(coroutine):
+    """Run a client coroutine (initialize/close) to completion on a fresh event loop."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def create_download_manager(config_manager, telegram_client, bandwidth_limiter=None):
+    """Create a DownloadManager with its database from the configuration."""
+    download_config = config_manager.get_download_config()
+    database = Database(**config_manager.get_database_config())
+    return DownloadManager(download_config, telegram_client, database, bandwidth_limiter)
+
+
+def start_control_api(config_manager, download_manager):
+    """Start the HTTP control API if [api] enables it. Returns the server, or None."""
+    api_config = config_manager.get_api_config()
+    if not api_config.pop('enabled'):
+        return None
+    from control_api import ControlApiServer
+    server = ControlApiServer(download_manager, **api_config)
+    server.start()
+    return server
+
+
+def start_metrics_server(config_manager):
+    """Start the Prometheus metrics exporter if [metrics] enables it. Returns the server, or None."""
+    metrics_config = config_manager.get_metrics_config()
+    if not metrics_config.pop('enabled'):
+        return None
+    from metrics import MetricsServer
+    server = MetricsServer(**metrics_config)
+    server.start()
+    return server
+
+
+class DownloadService:
+    """Runs the download core headless until SIGINT/SIGTERM, then drains gracefully.
+    
+    On the first signal no new downloads are started and active ones get up
+    to drain_timeout seconds to finish; whatever is still running is then
+    interrupted and resumes on the next start. A second signal skips the wait.
+    """
+    
+    def __init__(self, config_manager, drain_timeout=30.0, exit_when_idle=False):
+        self.config_manager = config_manager
+        self.drain_timeout = drain_timeout
+        self.exit_when_idle = exit_when_idle
+        self.logger = Logger().get_logger(__name__)
+        self.telegram_client = None
+        self.download_manager = None
+        self.bandwidth_limiter = None
+        self.control_api = None
+        self.metrics_server = None
+        self._stop_event = threading.Event()
+        self._force_event = threading.Event()
+    
+    def start(self):
+        """Connect to Telegram and start downloading."""
+        self.bandwidth_limiter = BandwidthLimiter(**self.config_manager.get_bandwidth_config())
+        self.telegram_client = create_telegram_client(self.config_manager)
+        if not run_client_call(self.telegram_client.initialize()):
+            raise RuntimeError("Failed to connect to Telegram")
+        
+        self.download_manager = create_download_manager(self.config_manager, self.telegram_client,
+                                                        self.bandwidth_limiter)
+        self.download_manager.start_downloads()
+        self.control_api = start_control_api(self.config_manager, self.download_manager)
+        self.metrics_server = start_metrics_server(self.config_manager)
+        self.logger.info("Download service started")
+    
+    def request_stop(self, signum=None, frame=None):
+        """Begin a graceful stop; a second request stops without waiting for active downloads."""
+        if self._stop_event.is_set():
+            self.logger.info("Stopping without waiting for active downloads")
+            self._force_event.set()
+        else:
+            self.logger.info(f"Received {signal.Signals(signum).name if signum else 'stop request'}, draining")
+            self._stop_event.set()
+    
+    def install_signal_handlers(self):
+        """Route SIGINT and SIGTERM to request_stop (main thread only)."""
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.request_stop)
+    
+    def wait(self):
+        """Block until a stop is requested, or until all work is done with exit_when_idle."""
+        while not self._stop_event.wait(1.0):
+            if self.exit_when_idle and self.download_manager.is_idle():
+                self.logger.info("All downloads finished")
+                self._stop_event.set()
+    
+    def stop(self):
+        """Stop starting downloads, let active ones finish (up to drain_timeout), then shut down."""
+        if self.control_api:
+            self.control_api.stop()
+            self.control_api = None
+        if self.metrics_server:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        
+        if self.download_manager:
+            self.download_manager.pause_downloads()
+            deadline = time.monotonic() + self.drain_timeout
+            while self.download_manager.active_downloads and not self._force_event.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.logger.warning(f"{len(self.download_manager.active_downloads)} downloads still "
+                                        f"active after {self.drain_timeout}s, interrupting them")
+                    break
+                self._force_event.wait(min(0.2, remaining))
+            
+            self.download_manager.stop_downloads(resumable=True)
+            self.download_manager = None
+        
+        if self.telegram_client:
+            try:
+                run_client_call(self.telegram_client.close())
+            except Exception as e:
+                self.logger.error(f"Error closing Telegram client: {e}")
+            self.telegram_client = None
+        self.logger.info("Download service stopped")
+    
+    def run(self, import_paths=()):
+        """Start, queue the given download lists, and serve until stopped."""
+        self.install_signal_handlers()
+        self.start()
+        try:
+            for path in import_paths:
+                added, known = self.download_manager.import_downloads(path)
+                self.logger.info(f"Imported {path}: {added} added, {known} already known")
+            self.wait()
+        finally:
+            self.stop()
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Run Telegram Download Manager without the GUI.")
+    parser.add_argument('--config', default='config.ini', help="configuration file (default: config.ini)")
+    parser.add_argument('--import', dest='import_paths', action='append', default=[], metavar='FILE',
+                        help="queue the downloads listed in a CSV or JSONL file (repeatable)")
+    parser.add_argument('--drain-timeout', type=float, default=30.0,
+                        help="seconds active downloads get to finish on shutdown (default: 30)")
+    parser.add_argument('--exit-when-idle', action='store_true',
+                        help="exit once nothing is running, queued or waiting to retry")
+    args = parser.parse_args(argv)
+    
+    try:
+        config_manager = ConfigManager(args.config)
+        log_level = config_manager.get_logging_config()['log_level']
+        logging.getLogger().setLevel(getattr(logging, log_level.upper(), logging.INFO))
+        DownloadService(config_manager, args.drain_timeout, args.exit_when_idle).run(args.import_paths)
+    except Exception as e:
+        Logger().get_logger(__name__).error(f"Download service failed: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
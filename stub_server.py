@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API, for offline load and soak tests.
+Serves getMe, getFile and file downloads with injectable latency, bandwidth
+limits, flood control and faults: python stub_server.py --files 100 --file-size 10485760
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from logger import Logger
+
+# File content is a fixed pseudo-random block repeated from a per-file starting point,
+# so any range of any file can be served (and checked) without storing files
+PATTERN_SIZE = 64 * 1024
+_PATTERN = random.Random(0).randbytes(PATTERN_SIZE) * 2
+
+
+def file_content(file_id, start, end):
+    """Bytes start..end (exclusive) of the content the stub serves for file_id."""
+    offset = (zlib.crc32(file_id.encode()) + start) % PATTERN_SIZE
+    if end - start <= PATTERN_SIZE:
+        return _PATTERN[offset:offset + end - start]
+    repeats = (offset + end - start) // PATTERN_SIZE + 1
+    return (_PATTERN[:PATTERN_SIZE] * repeats)[offset:offset + end - start]
+
+
+class StubBotApiServer:
+    """Emulates the Bot API endpoints BotTelegramClient uses, with fault and latency injection.
+    
+    Files are registered with add_file(); with default_file_size set, any
+    other file_id is accepted too. Fault settings are plain attributes and
+    may be changed while the server runs:
+    
+    - latency: seconds before every response
+    - bandwidth: bytes/sec per file connection (0 = unlimited)
+    - range_support: honour Range headers (206) or always send the whole file (200)
+    - rate_limit / retry_after: getFile calls allowed per second before HTTP 429
+    - disconnect_probability: chance a file stream is cut off part way
+    - not_found_probability: chance a file request gets 404 (an expired link)
+    - bad_request_probability: chance getFile gets 400
+    - max_file_size: getFile refuses larger files like api.telegram.org (20 MB there)
+    """
+    
+    def __init__(self, host='127.0.0.1', port=0, token='123456:stub', default_file_size=None, latency=0.0,
+                 bandwidth=0, range_support=True, rate_limit=0, retry_after=1, disconnect_probability=0.0,
+                 not_found_probability=0.0, bad_request_probability=0.0, max_file_size=None, seed=None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.default_file_size = default_file_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.range_support = range_support
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.disconnect_probability = disconnect_probability
+        self.not_found_probability = not_found_probability
+        self.bad_request_probability = bad_request_probability
+        self.max_file_size = max_file_size
+        self.logger = Logger().get_logger(__name__)
+        
+        self.files = {}  # file_id -> {'file_path', 'file_size', 'file_unique_id'}
+        self._paths = {}  # file_path -> file_id
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = []  # monotonic times of recent getFile calls
+        self.stats = {'connections': 0, 'getMe': 0, 'getFile': 0, 'files': 0, 'rate_limited': 0,
+                      'disconnects': 0, 'not_found': 0, 'bad_requests': 0, 'bytes_sent': 0}
+        self._server = None
+        self._thread = None
+    
+    @property
+    def api_url(self):
+        """Value for BotTelegramClient's api_url (and [telegram] api_url)."""
+        return f"http://{self.host}:{self.port}"
+    
+    def add_file(self, file_id, file_size, file_path=None, file_unique_id=None):
+        """Register a file that getFile and the file endpoint will serve."""
+        with self._lock:
+            return self._add_file(file_id, file_size, file_path, file_unique_id)
+    
+    def _add_file(self, file_id, file_size, file_path=None, file_unique_id=None):
+        info = {
+            'file_path': file_path or f"documents/{file_id}",
+            'file_size': file_size,
+            'file_unique_id': file_unique_id or f"stub_{file_id}"
+        }
+        self.files[file_id] = info
+        self._paths[info['file_path']] = file_id
+        return info
+    
+    def get_file(self, file_id):
+        """A registered file, or a new default-sized one; None if unknown."""
+        with self._lock:
+            info = self.files.get(file_id)
+            if info is None and self.default_file_size is not None:
+                info = self._add_file(file_id, self.default_file_size)
+            return info
+    
+    def start(self):
+        """Start serving on a background thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        
+        self._server = StubHTTPServer((self.host, self.port), StubBotApiHandler)
+        self._server.stub = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="StubBotApiServer")
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info(f"Stub Bot API listening on {self.api_url} (token {self.token})")
+    
+    def stop(self):
+        """Stop serving."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+    
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+    
+    def _chance(self, probability):
+        if not probability:
+            return False
+        with self._lock:
+            return self._random.random() < probability
+    
+    def _rate_limited(self):
+        """Record a getFile call; True if it exceeds rate_limit calls in the last second."""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            self._calls = [called for called in self._calls if now - called < 1.0]
+            if len(self._calls) >= self.rate_limit:
+                return True
+            self._calls.append(now)
+            return False
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Load tests open many connections at once
+
+
+class StubBotApiHandler(BaseHTTPRequestHandler):
+    """Routes Bot API requests to the server's StubBotApiServer."""
+    
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.server.stub._count('connections')
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+        
+        url = urlparse(self.path)
+        match = re.fullmatch(r'/bot([^/]+)/(\w+)', url.path)
+        if match:
+            if match.group(1) != stub.token:
+                self._send_error_json(401, "Unauthorized")
+                return
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._handle_method(stub, match.group(2), params)
+            return
+        
+        match = re.fullmatch(r'/file/bot([^/]+)/(.+)', url.path)
+        if match and match.group(1) == stub.token:
+            self._handle_file(stub, match.group(2))
+            return
+        self._send_error_json(404, "Not Found")
+    
+    def _handle_method(self, stub, method, params):
+        if method == 'getMe':
+            stub._count('getMe')
+            self._send_json(200, {'ok': True, 'result': {'id': int(stub.token.split(':')[0] or 0), 'is_bot': True,
+                                                         'first_name': 'Stub', 'username': 'stub_bot'}})
+            return
+        if method != 'getFile':
+            self._send_error_json(404, "Not Found: method not found")
+            return
+        
+        stub._count('getFile')
+        if stub._rate_limited():
+            stub._count('rate_limited')
+            self._send_error_json(429, f"Too Many Requests: retry after {stub.retry_after}",
+                                  parameters={'retry_after': stub.retry_after})
+            return
+        
+        info = stub.get_file(params.get('file_id', ''))
+        if info is None or stub._chance(stub.bad_request_probability):
+            stub._count('bad_requests')
+            self._send_error_json(400, "Bad Request: invalid file_id")
+            return
+        if stub.max_file_size and info['file_size'] > stub.max_file_size:
+            stub._count('bad_requests')
+            self._send_error_json(400, "Bad Request: file is too big")
+            return
+        self._send_json(200, {'ok': True, 'result': dict(info, file_id=params['file_id'])})
+    
+    def _handle_file(self, stub, file_path):
+        stub._count('files')
+        file_id = stub._paths.get(file_path)
+        if file_id is None or stub._chance(stub.not_found_probability):
+            stub._count('not_found')
+            self._send_error_json(404, "Not Found")
+            return
+        size = stub.files[file_id]['file_size']
+        
+        start, end = 0, size
+        range_header = self.headers.get('Range')
+        match = re.fullmatch(r'bytes=(\d+)-(\d*)', range_header or '')
+        if range_header and stub.range_support and match:
+            start = int(match.group(1))
+            end = min(size, int(match.group(2)) + 1) if match.group(2) else size
+            if start >= size or start >= end:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('Accept-Ranges', 'bytes' if stub.range_support else 'none')
+        self.end_headers()
+        
+        # A cut-off stream stops somewhere in its body after promising all of it
+        stop = end
+        if end > start and stub._chance(stub.disconnect_probability):
+            with stub._lock:
+                stop = start + stub._random.randrange(end - start)
+        self._send_body(stub, file_id, start, stop)
+        if stop < end:
+            stub._count('disconnects')
+            self.close_connection = True
+    
+    def _send_body(self, stub, file_id, start, end):
+        """Write file bytes start..end, paced to the stub's per-connection bandwidth."""
+        started = time.monotonic()
+        sent = 0
+        try:
+            for position in range(start, end, PATTERN_SIZE):
+                chunk = file_content(file_id, position, min(end, position + PATTERN_SIZE))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if stub.bandwidth:
+                    delay = started + sent / stub.bandwidth - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            stub._count('bytes_sent', sent)
+    
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_error_json(self, status, description, **extra):
+        self._send_json(status, dict({'ok': False, 'error_code': status, 'description': description}, **extra))
+
+
+def main(argv=None):
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Telegram Bot API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', default='123456:stub', help="bot token clients must use")
+    parser.add_argument('--files', type=int, default=0,
+                        help="register file_0 .. file_<N-1> (any other file_id is accepted too)")
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help="size of every file in bytes")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before every response")
+    parser.add_argument('--bandwidth', type=int, default=0, help="bytes/sec per file connection (0 = unlimited)")
+    parser.add_argument('--no-range', action='store_true', help="ignore Range headers")
+    parser.add_argument('--rate-limit', type=int, default=0, help="getFile calls per second before HTTP 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after sent with HTTP 429")
+    parser.add_argument('--disconnect', type=float, default=0.0, help="probability a file stream is cut off")
+    parser.add_argument('--not-found', type=float, default=0.0, help="probability a file request gets 404")
+    parser.add_argument('--bad-request', type=float, default=0.0, help="probability getFile gets 400")
+    parser.add_argument('--max-file-size', type=int, help="getFile refuses larger files (Bot API: 20971520)")
+    parser.add_argument('--seed', type=int, help="seed for reproducible faults")
+    args = parser.parse_args(argv)
+    
+    server = StubBotApiServer(
+        host=args.host, port=args.port, token=args.token, default_file_size=args.file_size,
+        latency=args.latency, bandwidth=args.bandwidth, range_support=not args.no_range,
+        rate_limit=args.rate_limit, retry_after=args.retry_after, disconnect_probability=args.disconnect,
+        not_found_probability=args.not_found, bad_request_probability=args.bad_request,
+        max_file_size=args.max_file_size, seed=args.seed
+    )
+    for i in range(args.files):
+        server.add_file(f"file_{i}", args.file_size)
+    server.start()
+    print(f"Stub Bot API running. In config.ini:\n\n[telegram]\nbot_token = {args.token}\napi_url = {server.api_url}\n")
+    try:
+        while True:
+            time.sleep(10)
+            print(json.dumps(server.stats))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,15 +3,17 @@ import os
 from pathlib import Path
 import json
 import time
+from file_writer import FileWriter
 from logger import Logger
 
 class TelegramClient:
     """Telegram client wrapper for file downloads."""
     
-    def __init__(self, api_id, api_hash, phone):
+    def __init__(self, api_id, api_hash, phone, writer_options=None):
         self.api_id = api_id
         self.api_hash = api_hash
         self.phone = phone
+        self.writer_options = writer_options or {}
         self.logger = Logger().get_logger(__name__)
         self._authenticated = False
         self._client = None
@@ -39,7 +41,7 @@ class TelegramClient:
             except ImportError as ie:
                 self.logger.warning(f"TDLib not available ({ie}), using fallback implementation")
                 # Fallback to a mock client for development
-                self._client = MockTelegramClient()
+                self._client = MockTelegramClient(writer_options=self.writer_options)
                 self._authenticated = True
                 self.logger.info("Using mock client for development")
                 return True
@@ -48,23 +50,27 @@ class TelegramClient:
             self.logger.error(f"Error initializing Telegram client: {e}")
             return False
     
-    async def download_file(self, file_id, download_path, progress_callback=None):
-        """Download a file from Telegram."""
+    async def download_file(self, file_id, download_path, progress_callback=None, offset=0, throttle=None,
+                            hasher=None):
+        """Download a file from Telegram, resuming after the first offset bytes if given."""
         try:
             if not self._authenticated:
                 raise Exception("Client not authenticated")
             
             if hasattr(self._client, 'download_file'):
-                return await self._client.download_file(file_id, download_path, progress_callback)
+                return await self._client.download_file(file_id, download_path, progress_callback,
+                                                        offset=offset, throttle=throttle, hasher=hasher)
             else:
                 # Fallback implementation
-                return await self._mock_download(file_id, download_path, progress_callback)
+                return await self._mock_download(file_id, download_path, progress_callback, offset, throttle,
+                                                 hasher)
             
         except Exception as e:
             self.logger.error(f"Error downloading file {file_id}: {e}")
             raise
     
-    async def _mock_download(self, file_id, download_path, progress_callback):
+    async def _mock_download(self, file_id, download_path, progress_callback, offset=0, throttle=None,
+                             hasher=None):
         """Mock download for testing purposes."""
         try:
             # Create download directory if it doesn't exist
@@ -72,17 +78,20 @@ class TelegramClient:
             
             # Simulate file download with progress
             file_size = 10 * 1024 * 1024  # 10MB mock file
-            downloaded = 0
+            downloaded = min(offset, file_size)
             chunk_size = 1024 * 1024  # 1MB chunks
             
-            with open(download_path, 'wb') as f:
+            with FileWriter(download_path, file_size, keep=downloaded, hasher=hasher,
+                            **self.writer_options) as writer:
                 while downloaded < file_size:
                     # Simulate download delay
                     await asyncio.sleep(0.1)
                     
                     chunk = min(chunk_size, file_size - downloaded)
-                    f.write(b'0' * chunk)  # Write dummy data
+                    writer.write(b'0' * chunk)  # Write dummy data
                     downloaded += chunk
+                    if throttle:
+                        await throttle(chunk)
                     
                     progress = (downloaded / file_size) * 100
                     if progress_callback:
@@ -130,10 +139,12 @@ class TelegramClient:
 class MockTelegramClient:
     """Mock Telegram client for development and testing."""
     
-    def __init__(self):
+    def __init__(self, writer_options=None):
+        self.writer_options = writer_options or {}
         self.logger = Logger().get_logger(__name__)
     
-    async def download_file(self, file_id, download_path, progress_callback=None):
+    async def download_file(self, file_id, download_path, progress_callback=None, offset=0, throttle=None,
+                            hasher=None):
         """Mock file download."""
         try:
             # Create download directory if it doesn't exist
@@ -141,17 +152,20 @@ class MockTelegramClient:
             
             # Simulate file download with progress
             file_size = 10 * 1024 * 1024  # 10MB mock file
-            downloaded = 0
+            downloaded = min(offset, file_size)
             chunk_size = 1024 * 1024  # 1MB chunks
             
-            with open(download_path, 'wb') as f:
+            with FileWriter(download_path, file_size, keep=downloaded, hasher=hasher,
+                            **self.writer_options) as writer:
                 while downloaded < file_size:
                     # Simulate download delay
                     await asyncio.sleep(0.1)
                     
                     chunk = min(chunk_size, file_size - downloaded)
-                    f.write(b'0' * chunk)  # Write dummy data
+                    writer.write(b'0' * chunk)  # Write dummy data
                     downloaded += chunk
+                    if throttle:
+                        await throttle(chunk)
                     
                     progress = (downloaded / file_size) * 100
                     if progress_callback: